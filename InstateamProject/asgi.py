@@ -0,0 +1,163 @@
+"""
+ASGI config for InstateamProject project.
+
+It exposes the ASGI callable as a module-level variable named ``application``,
+to be served by any ASGI server, e.g.:
+
+    uvicorn InstateamProject.asgi:application
+
+Django 2.2 has no ASGI support and its views, ORM included, are synchronous, so
+the application runs each request through Django's WSGI handler in a bounded
+pool of ASGI_THREADS threads. The event loop does all the waiting on clients:
+request bodies are read before a thread is taken, and responses are sent after
+the thread is released, so slow clients don't hold a thread the way they hold a
+WSGI worker. Streaming responses are the exception, they read the database as
+they're sent and so keep their thread until the last chunk.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'InstateamProject.settings')
+
+
+# request bodies bigger than this go to a temporary file
+BODY_MEMORY_SIZE = 1024 * 1024
+
+
+class AsgiHandler:
+
+    def __init__(self, wsgi_application, threads):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError('Unsupported ASGI scope type %r' % scope['type'])
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        body = await self.read_body(receive)
+        if body is None:
+            # the client went away before sending the whole request
+            return
+        loop = asyncio.get_running_loop()
+        status, headers, content = await loop.run_in_executor(
+            self.executor, self.run_request, loop, scope, body, send)
+        if content is not None:
+            await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': content})
+
+    async def read_body(self, receive):
+        body = tempfile.SpooledTemporaryFile(max_size=BODY_MEMORY_SIZE)
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            body.write(message.get('body', b''))
+            if not message.get('more_body', False):
+                body.seek(0)
+                return body
+
+    def run_request(self, loop, scope, body, send):
+        """
+        Run the request in Django, in a pool thread. Return (status, headers, content)
+        for the event loop to send, or content None when it was streamed from here.
+        """
+        started = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.lower().encode('latin1'), value.encode('latin1'))
+                                  for name, value in response_headers]
+
+        response = self.wsgi_application(self.environ(scope, body), start_response)
+        try:
+            if not getattr(response, 'streaming', False):
+                return started['status'], started['headers'], b''.join(response)
+            # the chunks are read from the database in this thread, send them from here
+            self.send_from_thread(loop, send, {
+                'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+            for chunk in response:
+                self.send_from_thread(loop, send, {'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            self.send_from_thread(loop, send, {'type': 'http.response.body', 'body': b''})
+            return started['status'], started['headers'], None
+        finally:
+            # sends request_finished, which closes this thread's database connection when it's due
+            if hasattr(response, 'close'):
+                response.close()
+            body.close()
+
+    def send_from_thread(self, loop, send, message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    def environ(self, scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        body.seek(0, os.SEEK_END)
+        content_length = body.tell()
+        body.seek(0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'REMOTE_ADDR': client[0],
+            'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+            'CONTENT_LENGTH': str(content_length),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin1').upper().replace('-', '_')
+            value = value.decode('latin1')
+            if name == 'CONTENT_LENGTH':
+                continue
+            if name != 'CONTENT_TYPE':
+                name = 'HTTP_' + name
+            if name in environ:
+                value = environ[name] + ('; ' if name == 'HTTP_COOKIE' else ',') + value
+            environ[name] = value
+        return environ
+
+
+def get_asgi_application():
+    wsgi_application = get_wsgi_application()
+    if settings.INSTATEAM_SERVE_STATIC:
+        from instateam.assets import StaticFilesApplication
+        wsgi_application = StaticFilesApplication(wsgi_application, settings.STATIC_ROOT, settings.STATIC_URL)
+    return AsgiHandler(wsgi_application, threads=settings.ASGI_THREADS)
+
+
+application = get_asgi_application()
+
+if settings.INSTATEAM_WARMUP:
+    from instateam.warmup import warm_up
+    warm_up()
@@ -52,6 +52,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'instateam.middleware.RequestMetricsMiddleware',
+    'instateam.middleware.ReadYourWritesMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -79,18 +81,102 @@ TEMPLATES = [
     },
 ]
 
+# compile each template once per process instead of on every render (template changes
+# then need a restart), on by default in production
+CACHED_TEMPLATES = os.environ.get('CACHED_TEMPLATES', '0' if DEBUG else '1') == '1'
+if CACHED_TEMPLATES:
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
+# the WSGI and ASGI applications warm up their process when they're loaded (see instateam.warmup),
+# on by default in production; with a preforking server loading them before it forks, e.g.
+# gunicorn --preload, it's done once for all the workers
+INSTATEAM_WARMUP = os.environ.get('WARMUP', '0' if DEBUG else '1') == '1'
+
 WSGI_APPLICATION = 'InstateamProject.wsgi.application'
 
+# InstateamProject.asgi runs the (synchronous) views in a pool of that many threads,
+# each of them with its own database connection
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 32))
+
 
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
-# keep the default sqlite3 DB for now - not suitable for production!
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+# DB_PROFILE picks the database:
+# - dev (default): the sqlite3 file next to manage.py with Django's defaults - not suitable for production!
+# - sqlite: a sqlite3 file tuned for a single-node production server (WAL, mmap...), see instateam.db.backends.sqlite3
+# - postgresql: a PostgreSQL server, with persistent or pooled connections, see instateam.db.backends.postgresql
+DB_PROFILE = os.environ.get('DB_PROFILE', 'dev')
+if DB_PROFILE == 'dev':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        }
+    }
+elif DB_PROFILE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'instateam.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+            # the PRAGMAs are applied once per connection, keep them open
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        }
+    }
+elif DB_PROFILE == 'postgresql':
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 0))
+    DATABASES = {
+        'default': {
+            'ENGINE': 'instateam.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'instateam'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', ''),
+            'PORT': os.environ.get('DB_PORT', ''),
+            # with a pool, each request hands its connection back to the pool
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 0 if DB_POOL_SIZE else 600)),
+            'CONN_HEALTH_CHECKS': True,
+            'POOL_SIZE': DB_POOL_SIZE,
+            'POOL_TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 5)),
+        }
+    }
+else:
+    sys.exit("Unknown DB_PROFILE %r, expected dev, sqlite or postgresql." % DB_PROFILE)
+
+# DB_REPLICAS: comma-separated read replicas of the default database, sqlite3 files (dev and sqlite
+# profiles, see the sync_replicas command) or PostgreSQL hosts, which the roster's list, search and
+# export read from, see instateam.db.replicas
+INSTATEAM_READ_REPLICAS = []
+for number, replica in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(',')), 1):
+    alias = 'replica%s' % number
+    DATABASES[alias] = dict(DATABASES['default'], TEST={'MIRROR': 'default'},
+                            **({'HOST': replica} if DB_PROFILE == 'postgresql' else {'NAME': replica}))
+    if DB_PROFILE == 'sqlite':
+        DATABASES[alias]['PRAGMAS'] = {'query_only': 'ON'}
+    INSTATEAM_READ_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['instateam.db.replicas.ReplicaRouter']
+
+
+# Caches: in local memory by default, CACHE_DIR shares them between the processes of a host
+if os.environ.get('CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ['CACHE_DIR'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'instateam',
+        }
     }
-}
 
 
 # Password validation
@@ -130,7 +216,78 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
 
 STATIC_URL = '/static/'
+STATIC_ROOT = os.environ.get('STATIC_ROOT', os.path.join(BASE_DIR, 'staticfiles'))
+
+# in production, collectstatic minifies the stylesheets, fingerprints every file and writes
+# compressed variants of them, which the WSGI and ASGI applications serve with far-future
+# cache headers (see instateam.assets)
+if not DEBUG:
+    STATICFILES_STORAGE = 'instateam.assets.CompressedManifestStaticFilesStorage'
+INSTATEAM_SERVE_STATIC = os.environ.get('SERVE_STATIC', '0' if DEBUG else '1') == '1'
 
 # https://github.com/stefanfoulis/django-phonenumber-field
 PHONENUMBER_DB_FORMAT = 'E164'
-PHONENUMBER_DEFAULT_REGION = 'US'
\ No newline at end of file
+PHONENUMBER_DEFAULT_REGION = 'US'
+
+
+# instateam: the team-members list is paginated on (last_name, first_name, pk)
+# ?page_size can ask for any size up to INSTATEAM_MAX_PAGE_SIZE
+INSTATEAM_PAGE_SIZE = 50
+INSTATEAM_MAX_PAGE_SIZE = 500
+# number of rows fetched and rendered at a time by the streaming list (?stream=1)
+INSTATEAM_STREAM_CHUNK_SIZE = 2000
+# upper bound of ?limit on /teammembers/search
+INSTATEAM_SEARCH_MAX_RESULTS = 100
+# /teammembers/import inserts the uploaded members this many at a time
+INSTATEAM_IMPORT_BATCH_SIZE = 1000
+INSTATEAM_IMPORT_MAX_DISPLAYED_ERRORS = 100
+# most changes a single /api/teammembers/batch request can apply
+INSTATEAM_API_MAX_BATCH_SIZE = 1000
+# cache holding the roster version (see RosterState.current) and the rendered member rows
+INSTATEAM_CACHE = 'default'
+# how long other processes may keep using a stale roster version with per-process caches
+INSTATEAM_ROSTER_VERSION_TIMEOUT = 5
+# seconds the rendered list rows are kept, per member and member version
+INSTATEAM_ROW_CACHE_TIMEOUT = 300
+# cache alias of the rendered list pages (see instateam.pagecache), None turns it off
+INSTATEAM_PAGE_CACHE = 'default'
+INSTATEAM_PAGE_CACHE_TIMEOUT = 600
+# a rebuilding worker holds the page lock at most this long,
+# workers without a stale copy to serve wait up to INSTATEAM_PAGE_CACHE_WAIT seconds for it
+INSTATEAM_PAGE_CACHE_LOCK_TIMEOUT = 10
+INSTATEAM_PAGE_CACHE_WAIT = 2.0
+# per-view request metrics (see instateam.middleware), exposed at /metrics
+# add a Server-Timing header (database, template and total time) to the responses
+INSTATEAM_SERVER_TIMING = False
+# log the requests slower than that with their slowest SQL queries, None turns it off
+INSTATEAM_SLOW_REQUEST_MS = 500
+
+# phone numbers parsed, validated and formatted are kept in LRU caches of that many entries each (see instateam.phones)
+INSTATEAM_PHONE_CACHE_SIZE = 10000
+# regions whose phone metadata is loaded at startup, PHONENUMBER_DEFAULT_REGION if empty
+INSTATEAM_PHONE_REGIONS = [PHONENUMBER_DEFAULT_REGION]
+
+# deletes only set TeamMember.deleted_at (a single UPDATE), purge_members deletes the rows
+# INSTATEAM_PURGE_AFTER_DAYS later; soft-deleted members free their email and phone right away
+INSTATEAM_SOFT_DELETE = False
+INSTATEAM_PURGE_AFTER_DAYS = 30
+# bulk deletes (see /api/teammembers/delete) and purges handle that many members per statement
+INSTATEAM_BULK_DELETE_BATCH_SIZE = 500
+# changes older than that are deleted by compact_changes, see /api/teammembers/changes
+INSTATEAM_CHANGES_RETENTION_DAYS = 7
+# only admin members may delete members, see instateam.permissions
+INSTATEAM_ENFORCE_ROLES = False
+# seconds a process keeps the role table at most, for the changes made by other processes
+# when the cache isn't shared between them (see Role.check_table)
+INSTATEAM_ROLE_TABLE_TIMEOUT = 60
+# the background jobs run by run_worker, see instateam.jobs: attempts before giving up,
+# seconds before the first retry (doubling with each attempt), seconds without a sign of
+# life from a running job's worker before it's run again, days finished jobs are kept
+INSTATEAM_JOB_MAX_ATTEMPTS = 3
+INSTATEAM_JOB_RETRY_DELAY = 10
+INSTATEAM_JOB_TIMEOUT = 600
+INSTATEAM_JOB_RETENTION_DAYS = 7
+# the files of the jobs: uploaded imports and exports
+INSTATEAM_JOB_FILES_DIR = os.path.join(BASE_DIR, 'jobfiles')
+# seconds a client reads from the primary database rather than a replica after each of its writes
+INSTATEAM_REPLICA_STICKY_SECONDS = 10
\ No newline at end of file
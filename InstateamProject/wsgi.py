@@ -9,8 +9,17 @@ https://docs.djangoproject.com/en/2.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'InstateamProject.settings')
 
 application = get_wsgi_application()
+
+if settings.INSTATEAM_SERVE_STATIC:
+    from instateam.assets import StaticFilesApplication
+    application = StaticFilesApplication(application, settings.STATIC_ROOT, settings.STATIC_URL)
+
+if settings.INSTATEAM_WARMUP:
+    from instateam.warmup import warm_up
+    warm_up()
@@ -0,0 +1,430 @@
+"""
+JSON API for the team members.
+
+    GET    /api/teammembers                 list, with ?fields=, ?cursor= and ?page_size=
+    POST   /api/teammembers                 create
+    GET    /api/teammembers/<pk>            retrieve
+    PUT    /api/teammembers/<pk>            replace
+    PATCH  /api/teammembers/<pk>            update some fields
+    DELETE /api/teammembers/<pk>            delete
+    POST   /api/teammembers/batch           {"upsert": [...], "delete": [pks]} in one transaction
+    POST   /api/teammembers/delete          {"ids": [pks]} or {"filter": {...}}, deleted in batches
+    GET    /api/teammembers/changes         the changes after ?cursor=, see TeamMemberChangesApi
+    GET    /api/jobs/<pk>                   the status of a background job, see JobApi
+    GET    /api/jobs/<pk>/file              the file a job produced, e.g. an export
+
+Members are validated by TeamMemberForm, so the API accepts exactly what the HTML
+forms accept. Request bodies must be JSON, which is why the API doesn't need
+CSRF tokens: browsers can't send a cross-site JSON request without a preflight.
+GET responses carry an ETag derived from the roster version, so pollers get a
+304 until something changes. Members carry a version: a PUT, PATCH or batch
+upsert given the version it was based on fails with a 409 if the member changed
+since, rather than overwriting that change. Deletes need a role allowing them
+when INSTATEAM_ENFORCE_ROLES is on (see instateam.permissions), or get a 403.
+"""
+import json
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.db.models import Q
+from django.http import FileResponse, HttpResponse, JsonResponse
+from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from .conditional import revalidate, roster_condition
+from .db.replicas import reads_from_replica
+from . import jobs, permissions, validation
+from .forms import BatchTeamMemberForm, TeamMemberForm
+from .models import ConcurrentUpdate, Job, MemberChange, Role, TeamMember, soft_delete_enabled
+from .pagination import InvalidCursor, KeysetPaginator, requested_page_size
+
+
+# API field: (model fields it needs loaded, how to get it from a member)
+API_FIELDS = {
+    'id': (['id'], lambda member: member.pk),
+    'first_name': (['first_name'], lambda member: member.first_name),
+    'last_name': (['last_name'], lambda member: member.last_name),
+    'email': (['email'], lambda member: member.email),
+    'phone': (['phone'], lambda member: member.formatted_phone_e164()),
+    'role': (['role'], lambda member: member.role.name),
+    'version': (['version'], lambda member: member.version),
+}
+FORM_FIELDS = TeamMemberForm.Meta.fields
+
+
+class ApiError(Exception):
+
+    def __init__(self, message, status=400, errors=None):
+        super().__init__(message)
+        self.status = status
+        self.errors = errors
+
+    def response(self):
+        data = {'error': str(self)}
+        if self.errors is not None:
+            data['errors'] = self.errors
+        return JsonResponse(data, status=self.status)
+
+
+def form_errors(form):
+    return {field: list(errors) for field, errors in form.errors.items()}
+
+
+def serialize(member, fields=API_FIELDS):
+    return {field: API_FIELDS[field][1](member) for field in fields}
+
+
+def requested_fields(request):
+    if 'fields' not in request.GET:
+        return list(API_FIELDS)
+    fields = [field for field in request.GET['fields'].split(',') if field]
+    unknown = set(fields) - set(API_FIELDS)
+    if unknown or not fields:
+        raise ApiError('fields must be a comma-separated list of: %s' % ', '.join(API_FIELDS))
+    return fields
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ApiView(View):
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except ApiError as e:
+            return e.response()
+        except ConcurrentUpdate as e:
+            return ApiError('Conflict: %s, fetch it again' % e, status=409).response()
+        except PermissionDenied as e:
+            return ApiError(str(e) or 'Forbidden', status=403).response()
+
+    def read_json(self):
+        if self.request.content_type != 'application/json':
+            raise ApiError('The request body must be JSON (Content-Type: application/json)', status=415)
+        try:
+            return json.loads(self.request.body.decode('utf-8'))
+        except ValueError:
+            raise ApiError('The request body is not valid JSON')
+
+    def read_json_object(self):
+        data = self.read_json()
+        if not isinstance(data, dict):
+            raise ApiError('The request body must be a JSON object')
+        return data
+
+
+class TeamMembersApi(ApiView):
+
+    @method_decorator(reads_from_replica)
+    @method_decorator(roster_condition)
+    def get(self, request):
+        fields = requested_fields(request)
+        try:
+            page_size = requested_page_size(request)
+        except ValueError:
+            raise ApiError('page_size must be a number')
+        ordering = ('last_name', 'first_name', 'pk')
+        # only load the columns needed, parsing phone numbers is the costly part
+        columns = {'id', 'last_name', 'first_name'}
+        for field in fields:
+            columns.update(API_FIELDS[field][0])
+        paginator = KeysetPaginator(TeamMember.objects.only(*columns), page_size, ordering=ordering)
+        try:
+            page = paginator.page(request.GET.get('cursor'))
+        except InvalidCursor as e:
+            raise ApiError(str(e))
+        return revalidate(JsonResponse({
+            'results': [serialize(member, fields) for member in page],
+            'next': page.next_cursor,
+            'previous': page.previous_cursor,
+        }))
+
+    def post(self, request):
+        form = TeamMemberForm(data=self.read_json_object())
+        if not form.is_valid():
+            raise ApiError('Invalid team member', errors=form_errors(form))
+        member = form.save()
+        response = JsonResponse(serialize(member), status=201)
+        response['Location'] = reverse('api_team_member', kwargs={'pk': member.pk})
+        return response
+
+
+class TeamMemberApi(ApiView):
+
+    def get_member(self, pk):
+        try:
+            return TeamMember.objects.get(pk=pk)
+        except TeamMember.DoesNotExist:
+            raise ApiError('Team member not found', status=404)
+
+    @method_decorator(roster_condition)
+    def get(self, request, pk):
+        return revalidate(JsonResponse(serialize(self.get_member(pk))))
+
+    def put(self, request, pk, partial=False):
+        member = self.get_member(pk)
+        data = self.read_json_object()
+        if partial:
+            current = serialize(member, FORM_FIELDS)
+            current.update(data)
+            data = current
+        form = TeamMemberForm(data=data, instance=member)
+        if not form.is_valid():
+            raise ApiError('Invalid team member', errors=form_errors(form))
+        return JsonResponse(serialize(form.save()))
+
+    def patch(self, request, pk):
+        return self.put(request, pk, partial=True)
+
+    def delete(self, request, pk):
+        permissions.for_request(request).require(permissions.DELETE_MEMBERS)
+        self.get_member(pk).delete()
+        return HttpResponse(status=204)
+
+
+class TeamMembersBatchApi(ApiView):
+    """
+    Apply a batch of upserts and deletes in a single transaction, all or nothing:
+        {"upsert": [{"id": 1, ...}, {"email": "new@example.com", ...}], "delete": [2, 3]}
+    An upserted member without an id updates the member with the same email, if
+    there's one, and a member can only be upserted once per batch. Deletes are applied first, so their emails and phones can be reused.
+    """
+
+    def post(self, request):
+        data = self.read_json_object()
+        upserts, deletes = data.get('upsert', []), data.get('delete', [])
+        if not isinstance(upserts, list) or not all(isinstance(item, dict) for item in upserts):
+            raise ApiError('upsert must be a list of JSON objects')
+        if not isinstance(deletes, list) or not all(isinstance(pk, int) for pk in deletes):
+            raise ApiError('delete must be a list of ids')
+        max_size = getattr(settings, 'INSTATEAM_API_MAX_BATCH_SIZE', 1000)
+        if len(upserts) + len(deletes) > max_size:
+            raise ApiError('A batch can hold at most %s changes' % max_size)
+        ids = [item['id'] for item in upserts if isinstance(item.get('id'), int)]
+        emails = [item['email'] for item in upserts if 'id' not in item and isinstance(item.get('email'), str)]
+        if len(set(ids)) < len(ids) or len(set(emails)) < len(emails):
+            # the second upsert of a member would look like a concurrent change of the first
+            raise ApiError('A batch can upsert each member (id, or email without id) only once')
+
+        if deletes:
+            # once for the whole batch
+            permissions.for_request(request).require(permissions.DELETE_MEMBERS)
+        deletes = set(deletes)
+        forms, errors = self.validate(upserts, deletes)
+        if errors:
+            raise ApiError('Invalid batch, nothing was changed', errors=errors)
+
+        created = [form.instance for form in forms if form.instance.pk is None]
+        updated = [form.instance for form in forms if form.instance.pk is not None]
+        with transaction.atomic():
+            deleted = TeamMember.objects.filter(pk__in=deletes).bulk_delete()
+            TeamMember.objects.bulk_create(created)
+            TeamMember.objects.bulk_update(updated, FORM_FIELDS)
+        return JsonResponse({'created': len(created), 'updated': len(updated), 'deleted': deleted})
+
+    def validate(self, upserts, deletes):
+        "Return the valid forms of the upserts, and the errors by upsert index."
+        ids = [item['id'] for item in upserts if isinstance(item.get('id'), int)]
+        emails = [item['email'] for item in upserts if 'id' not in item and isinstance(item.get('email'), str)]
+        by_id = TeamMember.objects.in_bulk(ids)
+        # emails are only unique among the members that aren't deleted, which in_bulk() can't tell
+        by_email = {member.email: member for member in TeamMember.objects.filter(email__in=emails)}
+
+        forms, errors = [], {}
+        for i, item in enumerate(upserts):
+            if 'id' in item:
+                instance = by_id.get(item['id']) if isinstance(item['id'], int) else None
+                if instance is None or instance.pk in deletes:
+                    errors[i] = {'id': ['Team member not found']}
+                    continue
+            else:
+                instance = by_email.get(item['email']) if isinstance(item.get('email'), str) else None
+            form = BatchTeamMemberForm(data=item, instance=instance)
+            if form.is_valid():
+                forms.append((i, form))
+            else:
+                errors[i] = form_errors(form)
+
+        # one query for the uniqueness of every email and phone of the batch
+        valid = []
+        members = [form.instance for i, form in forms]
+        for (i, form), member_errors in zip(forms, validation.unique_errors(members, exclude_pks=deletes)):
+            if member_errors:
+                errors[i] = validation.error_messages(member_errors)
+            else:
+                valid.append(form)
+        return valid, errors
+
+
+def _text(value):
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(value)
+    return value.strip()
+
+
+def _role(value):
+    try:
+        return Role.named(_text(value))
+    except Role.DoesNotExist:
+        raise ValueError(value)
+
+
+# bulk delete filter: the condition it stands for, given its value
+BULK_DELETE_FILTERS = {
+    'role': lambda value: Q(role_id=_role(value).pk),
+    'email_domain': lambda value: Q(email__iendswith='@' + _text(value).lstrip('@')),
+    'last_name': lambda value: Q(last_name__iexact=_text(value)),
+}
+
+
+def bulk_delete_queryset(ids=None, filter=None):
+    "The members a bulk delete of `ids` or of the members matching `filter` is about."
+    if (ids is None) == (filter is None):
+        raise ApiError('Either ids or filter is needed')
+    queryset = TeamMember.objects.all()
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(pk, int) for pk in ids):
+            raise ApiError('ids must be a list of ids')
+        return queryset.filter(pk__in=ids)
+    if not isinstance(filter, dict) or not filter:
+        raise ApiError('filter must be a non-empty object of: %s' % ', '.join(BULK_DELETE_FILTERS))
+    for name, value in filter.items():
+        try:
+            queryset = queryset.filter(BULK_DELETE_FILTERS[name](value))
+        except (KeyError, ValueError):
+            raise ApiError('Invalid filter %s' % name)
+    return queryset
+
+
+def job_accepted(job):
+    "The 202 response to a request queued as `job`."
+    response = JsonResponse(serialize_job(job), status=202)
+    response['Location'] = reverse('api_job', kwargs={'pk': job.pk})
+    return response
+
+
+class TeamMembersBulkDeleteApi(ApiView):
+    """
+    Delete any number of members, chosen by id or by a filter:
+        {"ids": [1, 2, 3]}
+        {"filter": {"role": "regular", "email_domain": "example.com", "last_name": "Doe"}}
+    with "dry_run": true to only count them. They're deleted in batches of
+    INSTATEAM_BULK_DELETE_BATCH_SIZE, a statement each, rather than one by one:
+    a batch is only an UPDATE when INSTATEAM_SOFT_DELETE is on. With
+    "background": true, they're deleted by a worker, see /api/jobs/<id>.
+    """
+
+    def post(self, request):
+        data = self.read_json_object()
+        queryset = bulk_delete_queryset(data.get('ids'), data.get('filter'))
+        if data.get('dry_run'):
+            return JsonResponse({'deleted': 0, 'matching': queryset.count()})
+        permissions.for_request(request).require(permissions.DELETE_MEMBERS)
+        if data.get('background'):
+            return job_accepted(jobs.enqueue('bulk_delete', ids=data.get('ids'), filter=data.get('filter')))
+        return JsonResponse({'deleted': queryset.bulk_delete(), 'soft': soft_delete_enabled()})
+
+
+class TeamMemberChangesApi(ApiView):
+    """
+    The changes to the roster after ?cursor, oldest first, at most ?page_size of them:
+        {"changes": [{"cursor": 8, "action": "update", "id": 3, "member": {...}, "changed_at": "..."},
+                     {"cursor": 9, "action": "delete", "id": 5, "member": null, "changed_at": "..."}],
+         "cursor": 9, "more": false}
+    A client keeps the last cursor it got and asks for the changes after it. To start,
+    it asks for ?cursor=latest, fetches the whole roster, then applies the changes after
+    that cursor (each carries the member as it is after the change, so applying one
+    twice does no harm). Changes are kept INSTATEAM_CHANGES_RETENTION_DAYS days (see
+    compact_changes): an older cursor gets a 410, and the client starts over.
+    """
+
+    def get(self, request):
+        try:
+            page_size = requested_page_size(request)
+        except ValueError:
+            raise ApiError('page_size must be a number')
+        cursor = request.GET.get('cursor', '0')
+        if cursor == 'latest':
+            latest = MemberChange.objects.order_by('-id').values_list('id', flat=True).first()
+            return JsonResponse({'changes': [], 'cursor': latest or 0, 'more': False})
+        try:
+            cursor = int(cursor)
+        except ValueError:
+            raise ApiError('cursor must be a number or latest')
+        if cursor < MemberChange.compacted_through():
+            raise ApiError('Changes after that cursor were compacted, fetch the whole roster again', status=410)
+        changes = list(MemberChange.objects.filter(id__gt=cursor).order_by('id')[:page_size + 1])
+        more = len(changes) > page_size
+        changes = changes[:page_size]
+        return JsonResponse({
+            'changes': [serialize_change(change) for change in changes],
+            'cursor': changes[-1].id if changes else cursor,
+            'more': more,
+        })
+
+
+def serialize_change(change):
+    member = None
+    if change.action != MemberChange.DELETE:
+        member = {'id': change.member_id}
+        member.update(json.loads(change.data))
+    return {
+        'cursor': change.id,
+        'action': change.action,
+        'id': change.member_id,
+        'member': member,
+        'changed_at': change.changed_at.isoformat(),
+    }
+
+
+def serialize_job(job):
+    result = job.get_result()
+    return {
+        'id': job.pk,
+        'name': job.name,
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'progress': {'done': job.progress_done, 'total': job.progress_total},
+        # partial while it runs
+        'result': result,
+        'error': job.error or None,
+        'file': (reverse('api_job_file', kwargs={'pk': job.pk})
+                 if job.status == Job.DONE and isinstance(result, dict) and result.get('file') else None),
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at and job.started_at.isoformat(),
+        'finished_at': job.finished_at and job.finished_at.isoformat(),
+    }
+
+
+class JobApi(ApiView):
+    """
+    A background job: its status (queued, running, done or failed), progress,
+    result and the error of its last attempt. Pollers get its progress as the
+    worker reports it, at most every second.
+    """
+
+    def get_job(self, pk):
+        try:
+            return Job.objects.get(pk=pk)
+        except Job.DoesNotExist:
+            raise ApiError('Job not found', status=404)
+
+    def get(self, request, pk):
+        return JsonResponse(serialize_job(self.get_job(pk)))
+
+
+class JobFileApi(JobApi):
+
+    def get(self, request, pk):
+        job = self.get_job(pk)
+        if serialize_job(job)['file'] is None:
+            raise ApiError('This job has no file, or not yet', status=404)
+        result = job.get_result()
+        storage = jobs.files()
+        if not storage.exists(result['file']):
+            raise ApiError('The file of this job was purged', status=410)
+        return FileResponse(storage.open(result['file']), as_attachment=True,
+                            filename=result.get('filename', result['file']))
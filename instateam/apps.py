@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class InstateamConfig(AppConfig):
     name = 'instateam'
+
+    def ready(self):
+        from . import phones, receivers  # noqa: F401
+        # rather than on the first numbers parsed or formatted by a request
+        phones.preload_metadata(phones.configured_regions())
\ No newline at end of file
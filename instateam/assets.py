@@ -0,0 +1,199 @@
+"""
+The static asset pipeline for production.
+
+collectstatic, with STATICFILES_STORAGE set to CompressedManifestStaticFilesStorage,
+minifies the stylesheets, copies every file under a name with a hash of its
+content (e.g. main.3f2a1b9c04d7.css, listed in STATIC_ROOT/staticfiles.json
+for {% static %}), and writes gzip and, when the brotli package is installed,
+brotli variants of the text files next to them.
+
+StaticFilesApplication then serves STATIC_ROOT in front of the Django
+application, without going through it: the variant the client accepts, and
+since a hashed name always has the same content, with a year-long immutable
+Cache-Control so that browsers don't even revalidate them.
+"""
+import gzip
+import mimetypes
+import os
+import re
+from email.utils import formatdate
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSED_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.map')
+# variants are only kept when they're at least that much smaller
+MIN_COMPRESSION_RATIO = 0.95
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+CONTENT_TYPES = {
+    '.css': 'text/css; charset=utf-8',
+    '.js': 'application/javascript; charset=utf-8',
+    '.svg': 'image/svg+xml',
+    '.json': 'application/json',
+}
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# the unhashed names can change content with any deployment
+CACHE_CONTROL = 'public, max-age=60'
+
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[^.]+$')
+
+
+def minify_css(css):
+    "A conservative minifier for the app's own stylesheets: comments and needless whitespace."
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    # not before ':', which separates a descendant selector from a pseudo-class (`a :hover`)
+    css = re.sub(r':\s+', ':', css)
+    return css.replace(';}', '}').strip()
+
+
+def compressed_variants(content):
+    "[(extension, compressed content)] of the variants worth keeping."
+    variants = []
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(content, quality=11)))
+    # mtime=0 so that the same content always compresses to the same bytes
+    variants.append(('.gz', gzip.compress(content, compresslevel=9, mtime=0)))
+    return [(extension, compressed) for extension, compressed in variants
+            if len(compressed) <= len(content) * MIN_COMPRESSION_RATIO]
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+
+    def _save(self, name, content):
+        if name.endswith('.css'):
+            # as the copies are written: post_process() has hashed the source by then, so a
+            # change of minify_css() alone needs a change of the source to get a new hash
+            content = ContentFile(minify_css(b''.join(content.chunks()).decode('utf-8')).encode('utf-8'))
+        return super()._save(name, content)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        for original in paths:
+            for name in {original, self.stored_name(original)}:
+                if name.endswith(COMPRESSED_EXTENSIONS) and self.exists(name):
+                    self.compress(name)
+
+    def compress(self, name):
+        with self.open(name) as f:
+            content = f.read()
+        for extension, compressed in compressed_variants(content):
+            path = self.path(name + extension)
+            with open(path, 'wb') as f:
+                f.write(compressed)
+
+
+class StaticFile:
+
+    def __init__(self, path, immutable):
+        self.path = path
+        stat = os.stat(path)
+        self.size = stat.st_size
+        self.last_modified = formatdate(stat.st_mtime, usegmt=True)
+        self.etag = '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+        extension = os.path.splitext(path)[1]
+        self.content_type = CONTENT_TYPES.get(extension) or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.cache_control = IMMUTABLE_CACHE_CONTROL if immutable else CACHE_CONTROL
+        # encoding: (path, size) of the compressed variants present on disk
+        self.variants = {}
+        for encoding, suffix in ENCODINGS:
+            if os.path.isfile(path + suffix):
+                self.variants[encoding] = (path + suffix, os.path.getsize(path + suffix))
+
+
+class StaticFilesApplication:
+    """
+    A WSGI application serving the files of `root` under the URL `prefix`, and
+    handing every other request over to `application`. The files are listed
+    once, when it's created: restart it after collectstatic.
+    """
+
+    def __init__(self, application, root, prefix):
+        self.application = application
+        self.prefix = '/' + prefix.strip('/') + '/'
+        self.files = {}
+        if root and os.path.isdir(root):
+            self.index(root)
+
+    def index(self, root):
+        variant_suffixes = tuple(suffix for encoding, suffix in ENCODINGS)
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                if filename.endswith(variant_suffixes):
+                    continue
+                path = os.path.join(directory, filename)
+                url_path = os.path.relpath(path, root).replace(os.sep, '/')
+                self.files[url_path] = StaticFile(path, immutable=bool(HASHED_NAME.search(filename)))
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if not path.startswith(self.prefix):
+            return self.application(environ, start_response)
+        static_file = self.files.get(path[len(self.prefix):])
+        if static_file is None:
+            start_response('404 Not Found', [('Content-Type', 'text/plain'), ('Content-Length', '9')])
+            return [b'Not Found']
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            start_response('405 Method Not Allowed', [('Allow', 'GET, HEAD'), ('Content-Length', '0')])
+            return []
+        return self.serve(static_file, environ, start_response)
+
+    def serve(self, static_file, environ, start_response):
+        path, size, etag = static_file.path, static_file.size, static_file.etag
+        headers = [('Cache-Control', static_file.cache_control), ('Last-Modified', static_file.last_modified)]
+        if static_file.variants:
+            headers.append(('Vary', 'Accept-Encoding'))
+            accepted = self.accepted_encodings(environ.get('HTTP_ACCEPT_ENCODING', ''))
+            for encoding, suffix in ENCODINGS:
+                if encoding in accepted and encoding in static_file.variants:
+                    path, size = static_file.variants[encoding]
+                    # each representation has its own ETag
+                    etag = '%s-%s"' % (etag[:-1], encoding)
+                    headers.append(('Content-Encoding', encoding))
+                    break
+        headers.append(('ETag', etag))
+        if etag in environ.get('HTTP_IF_NONE_MATCH', ''):
+            start_response('304 Not Modified', headers)
+            return []
+        headers += [('Content-Type', static_file.content_type), ('Content-Length', str(size))]
+        start_response('200 OK', headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        f = open(path, 'rb')
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None:
+            return file_wrapper(f, 64 * 1024)
+        return FileIterator(f)
+
+    def accepted_encodings(self, accept_encoding):
+        accepted = set()
+        for part in accept_encoding.split(','):
+            encoding, _, params = part.strip().partition(';')
+            if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                continue
+            accepted.add(encoding.strip().lower())
+        return accepted
+
+
+class FileIterator:
+
+    def __init__(self, f, block_size=64 * 1024):
+        self.f = f
+        self.block_size = block_size
+
+    def __iter__(self):
+        return iter(lambda: self.f.read(self.block_size), b'')
+
+    def close(self):
+        self.f.close()
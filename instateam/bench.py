@@ -0,0 +1,131 @@
+"""
+Helpers shared by the benchmark management commands (bench_*), load_test and
+seed_members.
+
+Benchmarks always run against a freshly migrated test database, see
+temporary_database(); only seed_members, for load_test --url, fills the
+configured one.
+"""
+import contextlib
+import os
+import re
+import tempfile
+import time
+
+from django.core.management.color import no_style
+from django.db import connections, transaction
+
+from .models import TeamMember
+
+
+FIRST_NAMES = [
+    'Ada', 'Alan', 'Alice', 'Amir', 'Anna', 'Arthur', 'Beatrice', 'Bruno', 'Camille', 'Carlos',
+    'Chloe', 'Claude', 'Daniel', 'Diane', 'Elena', 'Emile', 'Eugenie', 'Farid', 'Grace', 'Hugo',
+    'Ines', 'Isaac', 'Jade', 'Jules', 'Karim', 'Laura', 'Leon', 'Lina', 'Louis', 'Maya',
+    'Nadia', 'Noah', 'Olivia', 'Oscar', 'Paul', 'Rosa', 'Sacha', 'Sofia', 'Tom', 'Zoe',
+]
+LAST_NAMES = [
+    'Adams', 'Baker', 'Bernard', 'Brown', 'Carter', 'Clark', 'Dubois', 'Durand', 'Evans', 'Garcia',
+    'Green', 'Hall', 'Harris', 'Jackson', 'Johnson', 'King', 'Lambert', 'Le Moulec', 'Lee', 'Lewis',
+    'Martin', 'Moreau', 'Morris', 'Nguyen', 'O\'Neil', 'Perez', 'Petit', 'Roux', 'Scott', 'Smith',
+    'Taylor', 'Thomas', 'Turner', 'Walker', 'White', 'Wilson', 'Wright', 'Young', 'Zhang', 'Van Dyke',
+]
+AREA_CODES = ['415', '212', '310', '503', '617', '646', '702', '808', '917', '206']
+NUMBERS_PER_AREA_CODE = 8000000
+
+
+def member_attributes(i):
+    "Deterministic, valid and unique attributes of the i-th generated member."
+    first_name = FIRST_NAMES[i % len(FIRST_NAMES)]
+    last_name = LAST_NAMES[(i // len(FIRST_NAMES)) % len(LAST_NAMES)]
+    area_code = AREA_CODES[(i // NUMBERS_PER_AREA_CODE) % len(AREA_CODES)]
+    return {
+        'first_name': first_name,
+        'last_name': last_name,
+        'email': '%s.%s.%s@example.com' % (first_name.lower(), re.sub('[^a-z]', '', last_name.lower()), i),
+        'phone': '+1%s%07d' % (area_code, 2000000 + i % NUMBERS_PER_AREA_CODE),
+        'role': 'admin' if i % 10 == 0 else 'regular',
+    }
+
+
+def seed_members(count, batch_size=5000, using='default'):
+    """
+    Insert `count` generated members after the ones already in the table, soft-deleted
+    ones included. Pks are set explicitly so that nothing has to be fetched back after
+    bulk_create, and the pk sequence is moved past them afterwards.
+    """
+    queryset = TeamMember.all_objects.using(using)
+    start = queryset.order_by('-pk').values_list('pk', flat=True).first() or 0
+    for offset in range(0, count, batch_size):
+        batch = [
+            TeamMember(pk=start + i + 1, **member_attributes(start + i))
+            for i in range(offset, min(offset + batch_size, count))
+        ]
+        with transaction.atomic(using=using):
+            queryset.bulk_create(batch)
+    # or the next inserts would be given the pks taken here, on PostgreSQL
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [TeamMember]):
+            cursor.execute(sql)
+    return count
+
+
+@contextlib.contextmanager
+def temporary_database(using='default', verbosity=0, on_disk=False):
+    """
+    Point the `using` connection to a new, migrated test database for the duration of the block.
+    With `on_disk`, a SQLite test database is a file rather than in memory, so that it's
+    configured like the real one (see instateam.db.backends.sqlite3).
+    """
+    connection = connections[using]
+    old_name = connection.settings_dict['NAME']
+    if on_disk and connection.vendor == 'sqlite':
+        connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+
+
+def timed(func, *args, **kwargs):
+    "Call func and return (elapsed seconds, result)."
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def percentiles(samples, points=(50, 90, 95, 99)):
+    "Nearest-rank percentiles of a list of samples, plus their count, mean and max."
+    ordered = sorted(samples)
+    if not ordered:
+        return {'count': 0}
+    stats = {
+        'count': len(ordered),
+        'mean': sum(ordered) / len(ordered),
+        'max': ordered[-1],
+    }
+    for point in points:
+        rank = max(0, min(len(ordered) - 1, -(-point * len(ordered) // 100) - 1))
+        stats['p%s' % point] = ordered[rank]
+    return stats
+
+
+def compare_results(baseline, current, threshold=0.2, stats=('p50', 'p95')):
+    """
+    Compare two benchmark reports, {size: {benchmark: {stat: value}}}, whose values
+    are latencies (lower is better). Return a list of (size, benchmark, stat,
+    baseline value, current value, regressed), where regressed means the current
+    value is more than `threshold` (a fraction) above the baseline one.
+    """
+    rows = []
+    for size, benchmarks in sorted(current.items()):
+        for name, values in sorted(benchmarks.items()):
+            baseline_values = baseline.get(size, {}).get(name, {})
+            for stat in stats:
+                if stat not in values or stat not in baseline_values:
+                    continue
+                old, new = baseline_values[stat], values[stat]
+                rows.append((size, name, stat, old, new, new > old * (1 + threshold)))
+    return rows
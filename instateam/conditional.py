@@ -0,0 +1,54 @@
+"""
+Conditional GET for the roster pages: ETags and Last-Modified dates derived from
+the roster version (see RosterState.current), which comes from the cache, so a
+client whose copy is current gets its 304 without a database query.
+"""
+import hashlib
+
+from django.conf import settings
+from django.db import router
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from .models import RosterState
+
+
+def roster_state(request):
+    "The RosterVersion, read once per request from the database its pages read from."
+    if not hasattr(request, '_roster_state'):
+        # a replica's version, so that it's never ahead of the rows read from that replica
+        request._roster_state = RosterState.current(using=router.db_for_read(RosterState))
+    return request._roster_state
+
+
+def roster_last_modified(request, *args, **kwargs):
+    return roster_state(request).modified_at
+
+
+def roster_etag(request, *args, **kwargs):
+    return 'v%s' % roster_state(request).version
+
+
+def form_page_etag(request, *args, **kwargs):
+    """
+    Pages with a form embed a CSRF token which is only valid along with the client's
+    CSRF cookie, a client whose cookie changed must get the page again.
+    """
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+    return '%s-%s' % (roster_etag(request), hashlib.sha1(csrf_cookie.encode()).hexdigest()[:12])
+
+
+def export_etag(request, *args, **kwargs):
+    encoding = 'gzip' if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '') else 'identity'
+    return '%s-%s' % (roster_etag(request), encoding)
+
+
+def revalidate(response):
+    "Let clients keep a copy of the response, as long as they check it's current before using it."
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+roster_condition = condition(etag_func=roster_etag, last_modified_func=roster_last_modified)
+form_page_condition = condition(etag_func=form_page_etag, last_modified_func=roster_last_modified)
+export_condition = condition(etag_func=export_etag, last_modified_func=roster_last_modified)
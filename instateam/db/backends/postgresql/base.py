@@ -0,0 +1,93 @@
+"""
+PostgreSQL backend with an in-process connection pool and health checks.
+
+    'ENGINE': 'instateam.db.backends.postgresql',
+    'POOL_SIZE': 10,             # connections kept per process, 0 turns the pool off
+    'POOL_TIMEOUT': 5,           # seconds to wait for a free connection
+    'CONN_HEALTH_CHECKS': True,  # check a reused connection works before a request uses it
+
+With a pool, CONN_MAX_AGE should be 0: Django "closes" the connection at the end
+of each request, which hands it back to the pool. Without one, CONN_MAX_AGE keeps
+a connection per thread, and the health checks make up for the CONN_HEALTH_CHECKS
+setting Django only has from version 4.1.
+"""
+import threading
+
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.base import Database
+
+from instateam.db.pool import ConnectionPool, PoolExhausted
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_done = False
+
+    @property
+    def pool(self):
+        size = self.settings_dict.get('POOL_SIZE') or 0
+        if not size:
+            return None
+        key = (self.alias, self.settings_dict['NAME'])
+        with _pools_lock:
+            if key not in _pools:
+                _pools[key] = ConnectionPool(size, timeout=self.settings_dict.get('POOL_TIMEOUT', 5))
+            return _pools[key]
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        connect = lambda: super(DatabaseWrapper, self).get_new_connection(conn_params)
+        check = self._is_alive if self.settings_dict.get('CONN_HEALTH_CHECKS') else None
+        try:
+            return pool.acquire(connect, check)
+        except PoolExhausted as e:
+            raise Database.OperationalError(str(e))
+
+    def _is_alive(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except Database.Error:
+            return False
+
+    def _close(self):
+        pool = self.pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        connection = self.connection
+        discard = bool(connection.closed) or (self.errors_occurred and not self._is_alive(connection))
+        if not discard and connection.get_transaction_status() != Database.extensions.TRANSACTION_STATUS_IDLE:
+            # don't hand a connection in the middle of a transaction to the next request
+            try:
+                connection.rollback()
+            except Database.Error:
+                discard = True
+        pool.release(connection, discard=discard)
+
+    def connect(self):
+        super().connect()
+        self.health_check_done = True
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        # the connection is kept for the next request, check it then
+        self.health_check_done = False
+
+    def ensure_connection(self):
+        if (self.connection is not None and not self.health_check_done and not self.in_atomic_block
+                and self.settings_dict.get('CONN_HEALTH_CHECKS')):
+            self.health_check_done = True
+            if not self.is_usable():
+                # so that _close() doesn't hand it back to the pool
+                self.errors_occurred = True
+                self.close()
+        super().ensure_connection()
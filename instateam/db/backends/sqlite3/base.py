@@ -0,0 +1,34 @@
+"""
+SQLite backend for production on a single node: the PRAGMAs below are applied
+to every new connection, settings_dict['PRAGMAS'] can override or add some.
+
+    'ENGINE': 'instateam.db.backends.sqlite3',
+    'PRAGMAS': {'mmap_size': 1073741824},
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    PRAGMAS = {
+        # wait for a lock rather than failing with "database is locked", set first for the others
+        'busy_timeout': 5000,
+        # readers don't block the writer and the other way round
+        'journal_mode': 'WAL',
+        # in WAL mode, only fsync on checkpoints: a power loss can drop the last commits, never corrupt the file
+        'synchronous': 'NORMAL',
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+        # in KiB when negative
+        'cache_size': -20000,
+    }
+
+    def pragmas(self):
+        pragmas = dict(self.PRAGMAS)
+        pragmas.update(self.settings_dict.get('PRAGMAS') or {})
+        return pragmas
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        for name, value in self.pragmas().items():
+            connection.execute('PRAGMA %s = %s' % (name, value))
+        return connection
@@ -0,0 +1,67 @@
+"""
+A small thread-safe pool of DB-API connections, used by the PostgreSQL backend
+(instateam.db.backends.postgresql) to keep connections open between requests.
+"""
+import queue
+import threading
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    At most `size` connections, each of them either idle in the pool or checked
+    out. Idle connections are handed back last in, first out, so that the ones
+    left idle long enough to be dropped by the server are the least used.
+    """
+
+    def __init__(self, size, timeout=5):
+        self.size = size
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def acquire(self, connect, check=None):
+        """
+        Return an idle connection passing `check` (when given), or a new one from
+        `connect()`, waiting up to `timeout` seconds for a free slot.
+        """
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PoolExhausted('No database connection freed up within %ss (pool of %s)' % (self.timeout, self.size))
+        try:
+            while True:
+                try:
+                    connection = self.idle.get_nowait()
+                except queue.Empty:
+                    return connect()
+                if check is None or check(connection):
+                    return connection
+                self._discard(connection)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, connection, discard=False):
+        try:
+            if discard:
+                self._discard(connection)
+            else:
+                self.idle.put(connection)
+        finally:
+            self.slots.release()
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        "Close the idle connections."
+        while True:
+            try:
+                self._discard(self.idle.get_nowait())
+            except queue.Empty:
+                return
@@ -0,0 +1,106 @@
+"""
+Read replicas for the roster's read paths: the views decorated with
+reads_from_replica() (the list, search, export and the API list) read from one
+of the INSTATEAM_READ_REPLICAS aliases, picked per request, while everything
+else, and every write, goes to the primary (the default database).
+
+A replica lags behind the primary, so a client that just changed the roster
+must not read from one: instateam.middleware.ReadYourWritesMiddleware gives the clients making a
+write request (POST, PUT, PATCH, DELETE) a cookie that keeps their reads on the
+primary for INSTATEAM_REPLICA_STICKY_SECONDS.
+
+    DATABASE_ROUTERS = ['instateam.db.replicas.ReplicaRouter']
+"""
+import contextlib
+import contextvars
+import functools
+import random
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+# set on the write responses, the client reads from the primary as long as it sends it back
+STICKY_COOKIE = 'instateam_primary'
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# the replica the reads of the current request go to, None for the primary
+_read_alias = contextvars.ContextVar('instateam_read_alias', default=None)
+_END = object()
+
+
+def read_replicas():
+    return getattr(settings, 'INSTATEAM_READ_REPLICAS', [])
+
+
+def sticky_seconds():
+    return getattr(settings, 'INSTATEAM_REPLICA_STICKY_SECONDS', 10)
+
+
+def replica_for(request):
+    "The replica alias the reads of `request` may go to, None when they must go to the primary."
+    replicas = read_replicas()
+    if not replicas or request.method not in READ_METHODS or STICKY_COOKIE in request.COOKIES:
+        return None
+    return random.choice(replicas)
+
+
+@contextlib.contextmanager
+def reading_from(alias):
+    "Route the reads made in the block to the database `alias`."
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def pinned(chunks, alias):
+    "Iterate over a streaming response's content with its reads still going to `alias`."
+    chunks = iter(chunks)
+    while True:
+        # set and reset around each chunk: the server may iterate from another thread, or not to the end
+        with reading_from(alias):
+            chunk = next(chunks, _END)
+        if chunk is _END:
+            return
+        yield chunk
+
+
+def reads_from_replica(view):
+    """
+    Let `view` read from a replica, rendering its response or wrapping its streaming
+    content so that the reads made after the view returns go there too.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        alias = replica_for(request)
+        if alias is None:
+            return view(request, *args, **kwargs)
+        with reading_from(alias):
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+        if response.streaming:
+            response.streaming_content = pinned(response.streaming_content, alias)
+        return response
+    return wrapper
+
+
+class ReplicaRouter:
+    "Reads inside reading_from() go to its replica, all the writes to the primary."
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        # even for an instance read from a replica, which Django would save back there
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # the replicas get the schema from the primary with its data
+        return db not in read_replicas()
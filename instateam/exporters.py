@@ -0,0 +1,128 @@
+"""
+Streaming export of the team members as CSV, JSON Lines or vCard.
+
+Members are read with a server-side iterator and serialized a chunk at a time,
+so exporting holds at most one chunk of members in memory whatever the size of
+the roster.
+"""
+import csv
+import json
+import zlib
+
+from .models import TeamMember
+
+
+EXPORT_FIELDS = ['id', 'first_name', 'last_name', 'email', 'phone', 'role']
+
+# format: (content type, file extension)
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'jsonl': ('application/x-ndjson; charset=utf-8', 'jsonl'),
+    'vcard': ('text/vcard; charset=utf-8', 'vcf'),
+}
+
+
+def member_record(member):
+    return {
+        'id': member.pk,
+        'first_name': member.first_name,
+        'last_name': member.last_name,
+        'email': member.email,
+        'phone': member.formatted_phone_e164(),
+        'role': member.role.name,
+    }
+
+
+class _Line:
+    "A file-like object handing back what csv.writer writes to it."
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(members):
+    writer = csv.writer(_Line())
+    yield writer.writerow(EXPORT_FIELDS)
+    for member in members:
+        record = member_record(member)
+        yield writer.writerow([record[field] for field in EXPORT_FIELDS])
+
+
+def jsonl_lines(members):
+    for member in members:
+        yield json.dumps(member_record(member)) + '\n'
+
+
+def _vcard_escape(value):
+    # RFC 2426 §4: a line break would end the property, and start another one
+    return (value.replace('\\', '\\\\').replace(',', '\\,').replace(';', '\\;')
+            .replace('\r', '').replace('\n', '\\n'))
+
+
+def vcard_lines(members):
+    for member in members:
+        yield '\r\n'.join([
+            'BEGIN:VCARD',
+            'VERSION:3.0',
+            'N:%s;%s;;;' % (_vcard_escape(member.last_name), _vcard_escape(member.first_name)),
+            'FN:%s' % _vcard_escape(member.get_fullname()),
+            'EMAIL;TYPE=INTERNET:%s' % member.email,
+            'TEL;TYPE=CELL:%s' % member.formatted_phone_e164(),
+            'END:VCARD',
+        ]) + '\r\n'
+
+
+SERIALIZERS = {
+    'csv': csv_lines,
+    'jsonl': jsonl_lines,
+    'vcard': vcard_lines,
+}
+
+
+def pages_by_pk(queryset, chunk_size):
+    """
+    The members of `queryset` by pk, each chunk read with a query of its own, so
+    that no read transaction stays open from one chunk to the next: on SQLite, the
+    connection couldn't write anything meanwhile (e.g. a job's progress).
+    """
+    last_pk = None
+    while True:
+        page = queryset.order_by('pk')
+        if last_pk is not None:
+            page = page.filter(pk__gt=last_pk)
+        page = list(page[:chunk_size])
+        yield from page
+        if len(page) < chunk_size:
+            return
+        last_pk = page[-1].pk
+
+
+def export_members(file_format, queryset=None, chunk_size=2000, paged=False):
+    """
+    Yield the export of `queryset` (every member by default) as str chunks of
+    `chunk_size` members, read with an iterator, or with pages_by_pk() if `paged`.
+    """
+    if queryset is None:
+        queryset = TeamMember.objects.all()
+    if paged:
+        members = pages_by_pk(queryset, chunk_size)
+    else:
+        members = queryset.order_by('pk').iterator(chunk_size=chunk_size)
+    buffer = []
+    for i, line in enumerate(SERIALIZERS[file_format](members), 1):
+        buffer.append(line)
+        if i % chunk_size == 0:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+def gzip_chunks(chunks, level=6):
+    "Compress an iterable of str chunks into a gzip stream, one chunk at a time."
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
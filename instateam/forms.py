@@ -1,6 +1,25 @@
 from django import forms
 from phonenumber_field.formfields import PhoneNumberField
-from .models import TeamMember
+from .models import Role, TeamMember
+from .importers import ImportFormatError, guess_format
+from . import phones, validation
+
+
+class CachedPhoneNumberField(PhoneNumberField):
+    "A PhoneNumberField parsing and checking each distinct input once (see instateam.phones)."
+    default_validators = [validation.validate_phone]
+
+    def to_python(self, value):
+        phone_number = phones.parse(value, region=self.region)
+        if validation.is_empty(phone_number):
+            return self.empty_value
+        if not phones.is_valid(phone_number):
+            raise forms.ValidationError(self.error_messages['invalid'])
+        return phone_number
+
+
+def role_choices():
+    return [(role.name, role.label or role.name) for role in Role.table().values()]
 
 
 class TeamMemberForm(forms.ModelForm):
@@ -18,12 +37,48 @@ class TeamMemberForm(forms.ModelForm):
         widget=forms.TextInput(attrs={'placeholder':'last name'})
     )
     email = forms.EmailField(widget=forms.EmailInput(attrs={'placeholder':'email'}))
-    phone = PhoneNumberField(widget=forms.TextInput(attrs={'placeholder':'phone number'}))
+    phone = CachedPhoneNumberField(widget=forms.TextInput(attrs={'placeholder':'phone number'}))
     role = forms.ChoiceField(
         widget=forms.RadioSelect(),
-        choices=[
-            ('regular', "Regular - Can't delete members"), 
-            ('admin',  'Admin - Can delete members'),
-        ],
+        # from the cached role table, and given to the model by name (see models.CachedRoleDescriptor)
+        choices=role_choices,
         initial="regular",
-    )
\ No newline at end of file
+    )
+    # the version of the member being edited, so that saving it doesn't overwrite a change made meanwhile
+    version = forms.IntegerField(widget=forms.HiddenInput, required=False, min_value=1)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk is not None:
+            self.initial.setdefault('version', self.instance.version)
+            # model_to_dict() gives the role's id
+            if self.initial.get('role') == self.instance.role_id:
+                self.initial['role'] = self.instance.role.name
+
+    def clean(self):
+        cleaned_data = super().clean()
+        # without one, the version the instance was read at is checked
+        if cleaned_data.get('version') is not None and self.instance.pk is not None:
+            self.instance.version = cleaned_data['version']
+        return cleaned_data
+
+
+class BatchTeamMemberForm(TeamMemberForm):
+    "A TeamMemberForm whose uniqueness is checked by the caller, for a whole batch at once."
+
+    def validate_unique(self):
+        pass
+
+
+class MemberImportForm(forms.Form):
+    file = forms.FileField(help_text='A .csv file with a first_name,last_name,email,phone,role header, or a .jsonl file')
+    # by a run_worker process, for files too big to import within a request
+    background = forms.BooleanField(required=False, label='Import in the background')
+
+    def clean_file(self):
+        uploaded = self.cleaned_data['file']
+        try:
+            self.file_format = guess_format(uploaded.name)
+        except ImportFormatError as e:
+            raise forms.ValidationError(str(e))
+        return uploaded
\ No newline at end of file
@@ -0,0 +1,173 @@
+"""
+Bulk import of team members from CSV or JSON Lines files.
+
+Rows are read lazily and handled one batch at a time: every member goes through
+instateam.validation (so the same checks and messages as the forms), which
+checks the batch's emails and phones against the database with a single query,
+and the valid members are inserted with one bulk_create in a transaction of
+their own.
+"""
+import csv
+import json
+from collections import namedtuple
+
+from django.db import IntegrityError, transaction
+
+from . import phones, validation
+from .models import Role, TeamMember
+
+
+IMPORT_FIELDS = ['first_name', 'last_name', 'email', 'phone', 'role']
+REQUIRED_FIELDS = ['first_name', 'last_name', 'email', 'phone']
+FORMATS = ('csv', 'jsonl')
+
+RowError = namedtuple('RowError', ['line', 'field', 'message'])
+
+
+class ImportFormatError(Exception):
+    pass
+
+
+def guess_format(filename):
+    extension = filename.rsplit('.', 1)[-1].lower()
+    if extension in ('jsonl', 'ndjson'):
+        return 'jsonl'
+    if extension == 'csv':
+        return 'csv'
+    raise ImportFormatError('Unknown file format, expected a .csv or .jsonl file')
+
+
+def read_rows(lines, file_format):
+    "Yield (line number, row dict) from an iterable of text lines."
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        missing = set(REQUIRED_FIELDS) - set(reader.fieldnames or [])
+        if missing:
+            raise ImportFormatError('The CSV header is missing the %s column(s)' % ', '.join(sorted(missing)))
+        for row in reader:
+            yield reader.line_num, row
+    elif file_format == 'jsonl':
+        for line_num, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            if not isinstance(row, dict):
+                yield line_num, None
+            else:
+                yield line_num, row
+    else:
+        raise ImportFormatError('Unknown file format %r' % file_format)
+
+
+class ImportResult:
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.errors = []
+
+    @property
+    def rejected(self):
+        return len({error.line for error in self.errors})
+
+
+class MemberImporter:
+
+    def __init__(self, batch_size=1000, using='default'):
+        self.batch_size = batch_size
+        self.using = using
+
+    def clean_row(self, row):
+        "Return (TeamMember, errors) for one row, with the errors TeamMember's own validation doesn't check for."
+        values, errors = {}, []
+        for name in IMPORT_FIELDS:
+            raw = row.get(name)
+            values[name] = '' if raw is None else str(raw).strip()
+        role = values.pop('role')
+        try:
+            values['role'] = Role.named(role) if role else Role.cached(Role.REGULAR)
+        except Role.DoesNotExist:
+            errors.append(('role', 'The role must be one of %s.' % ', '.join(Role.names())))
+        values['phone'] = phones.parse(values['phone'])
+        return TeamMember(**values), errors
+
+    def validate_batch(self, batch):
+        """
+        Return (members, errors) for a list of (line, row): the (line, member) that
+        can be inserted, and the errors of all the other rows.
+        """
+        candidates, errors = [], []
+        for line, row in batch:
+            if row is None:
+                errors.append(RowError(line, None, 'This line is not a JSON object.'))
+                continue
+            member, row_errors = self.clean_row(row)
+            if row_errors:
+                # report the other fields' errors too, without checking the row against the others
+                field_errors = validation.error_messages(validation.clean_fields(member))
+                row_errors = [(field, message) for field, messages in field_errors.items() for message in messages] + row_errors
+                errors.extend(RowError(line, field, message) for field, message in row_errors)
+            else:
+                candidates.append((line, member))
+
+        # one query for the whole batch's email and phone conflicts, rows also conflict with earlier ones
+        members = []
+        results = validation.validate_many([member for line, member in candidates], using=self.using)
+        for (line, member), member_errors in zip(candidates, results):
+            if member_errors:
+                errors.extend(RowError(line, field, message)
+                              for field, messages in member_errors.items() for message in messages)
+            else:
+                members.append((line, member))
+        return members, errors
+
+    def conflict_errors(self, line, member):
+        "The errors of a member whose insert failed on a unique constraint."
+        member_errors = validation.unique_errors([member], using=self.using)[0]
+        if not member_errors:
+            return [RowError(line, None, 'This member conflicts with one saved meanwhile.')]
+        return [RowError(line, field, message)
+                for field, messages in validation.error_messages(member_errors).items() for message in messages]
+
+    def import_batch(self, batch, result):
+        members, errors = self.validate_batch(batch)
+        try:
+            with transaction.atomic(using=self.using):
+                TeamMember.objects.using(self.using).bulk_create([member for line, member in members])
+        except IntegrityError:
+            # a concurrent write took an email or phone since the batch was checked: check it
+            # again, and insert its members one by one in case another write races this one
+            members, errors = self.validate_batch(batch)
+            inserted = []
+            for line, member in members:
+                try:
+                    with transaction.atomic(using=self.using):
+                        TeamMember.objects.using(self.using).bulk_create([member])
+                except IntegrityError:
+                    errors.extend(self.conflict_errors(line, member))
+                else:
+                    inserted.append((line, member))
+            members = inserted
+        result.created += len(members)
+        result.errors.extend(errors)
+
+    def run(self, rows, progress=None):
+        "Import an iterable of (line, row) as read by read_rows(), and return an ImportResult."
+        result = ImportResult()
+        batch = []
+        for line, row in rows:
+            result.rows += 1
+            batch.append((line, row))
+            if len(batch) == self.batch_size:
+                self.import_batch(batch, result)
+                batch = []
+                if progress:
+                    progress(result)
+        if batch:
+            self.import_batch(batch, result)
+            if progress:
+                progress(result)
+        return result
@@ -0,0 +1,239 @@
+"""
+A job queue kept in the database, so that the slow operations (imports,
+exports, bulk deletes, search index rebuilds) run in the run_worker processes
+instead of the requests asking for them, with no broker to run: the Job rows
+are the queue.
+
+enqueue() adds a job. A worker claims it with a compare-and-swap UPDATE, from
+queued to running, so that two workers never both get it (on SQLite as well as
+PostgreSQL), runs its task (see instateam.tasks) and marks it done or failed.
+A task raising an exception is retried after an exponential backoff, up to the
+job's max_attempts; a running job whose worker hasn't given a sign of life for
+INSTATEAM_JOB_TIMEOUT seconds (it was killed, or its machine rebooted) is
+queued again. Tasks report their progress, written at most every
+PROGRESS_INTERVAL seconds, which also serves as the worker's heartbeat.
+"""
+import json
+import logging
+import os
+import random
+import socket
+import time
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+
+logger = logging.getLogger(__name__)
+
+# task name: function(job, progress, **arguments), returning a JSON-serializable result
+TASKS = {}
+TASK_MODULES = ('instateam.tasks',)
+
+# seconds between two progress reports written to the database
+PROGRESS_INTERVAL = 1.0
+# the longest backoff between two attempts, in seconds
+MAX_RETRY_DELAY = 3600
+# seconds between two purges of the finished jobs by an idle worker
+PURGE_INTERVAL = 3600
+# seconds between two looks for the jobs of lost workers, each is an UPDATE
+LOST_JOBS_INTERVAL = 60
+
+
+def task(name):
+    "Register a function as the task `name`."
+    def register(func):
+        TASKS[name] = func
+        return func
+    return register
+
+
+def load_tasks():
+    for module in TASK_MODULES:
+        import_module(module)
+
+
+def job_timeout():
+    return getattr(settings, 'INSTATEAM_JOB_TIMEOUT', 600)
+
+
+def files():
+    "Where the jobs keep their input and output files: uploaded imports, exports."
+    return FileSystemStorage(location=getattr(
+        settings, 'INSTATEAM_JOB_FILES_DIR', os.path.join(settings.BASE_DIR, 'jobfiles')))
+
+
+def enqueue(name, max_attempts=None, using='default', **arguments):
+    "Queue the task `name` to be run with `arguments` by a worker, and return its Job."
+    if max_attempts is None:
+        max_attempts = getattr(settings, 'INSTATEAM_JOB_MAX_ATTEMPTS', 3)
+    return Job.objects.using(using).create(
+        name=name, arguments=json.dumps(arguments, separators=(',', ':')), max_attempts=max_attempts)
+
+
+def retry_delay(attempts):
+    "Seconds before the next attempt, after `attempts` failed ones: doubling, with jitter."
+    delay = min(getattr(settings, 'INSTATEAM_JOB_RETRY_DELAY', 10) * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+    # so that the jobs failing together don't all come back together
+    return delay * random.uniform(0.5, 1)
+
+
+class JobFailed(Exception):
+    "Raised by a task to fail its job at once, without retrying it."
+
+
+class Progress:
+    "Handed to the task with its job: report(done, total, **partial result), throttled."
+
+    def __init__(self, worker, job):
+        self.worker = worker
+        self.job = job
+        self.reported_at = None
+
+    def report(self, done, total=None, force=False, **partial):
+        # written with the job's outcome in any case
+        self.job.progress_done, self.job.progress_total = done, total
+        now = time.monotonic()
+        if not force and self.reported_at is not None and now - self.reported_at < PROGRESS_INTERVAL:
+            return
+        self.reported_at = now
+        fields = {'progress_done': done, 'progress_total': total, 'heartbeat_at': timezone.now()}
+        if partial:
+            self.job.result = fields['result'] = json.dumps(partial, separators=(',', ':'))
+        self.worker.jobs().filter(pk=self.job.pk, status=Job.RUNNING, worker=self.worker.name).update(**fields)
+
+
+class Worker:
+
+    def __init__(self, name=None, using='default'):
+        self.name = name or '%s:%s' % (socket.gethostname(), os.getpid())
+        self.using = using
+        self.purged_at = None
+        self.checked_lost_at = None
+        load_tasks()
+
+    def jobs(self):
+        return Job.objects.using(self.using)
+
+    def claim(self):
+        "Claim the next job ready to run, and return it, or None when there's none."
+        now = timezone.now()
+        if self.checked_lost_at is None or time.monotonic() - self.checked_lost_at >= LOST_JOBS_INTERVAL:
+            self.checked_lost_at = time.monotonic()
+            self.requeue_lost(now)
+        while True:
+            # served by job_queued_idx
+            pk = self.jobs().filter(status=Job.QUEUED, run_after__lte=now) \
+                .order_by('run_after', 'id').values_list('pk', flat=True).first()
+            if pk is None:
+                return None
+            claimed = self.jobs().filter(pk=pk, status=Job.QUEUED).update(
+                status=Job.RUNNING, worker=self.name, attempts=F('attempts') + 1,
+                started_at=now, heartbeat_at=now, error='')
+            if claimed:
+                return self.jobs().get(pk=pk)
+            # another worker got it first
+
+    def requeue_lost(self, now):
+        "Queue again the running jobs whose worker went silent, or fail those without attempts left."
+        lost = self.jobs().filter(status=Job.RUNNING, heartbeat_at__lt=now - timedelta(seconds=job_timeout()))
+        lost.filter(attempts__lt=F('max_attempts')).update(
+            status=Job.QUEUED, run_after=now, error='Its worker stopped responding')
+        lost.update(status=Job.FAILED, finished_at=now, error='Its worker stopped responding')
+
+    def run(self, job):
+        try:
+            func = TASKS[job.name]
+        except KeyError:
+            return self.failed(job, 'Unknown task %s' % job.name, retry=False)
+        progress = Progress(self, job)
+        try:
+            result = func(job, progress, **job.get_arguments())
+        except JobFailed as e:
+            self.failed(job, str(e), retry=False)
+        except Exception as e:
+            logger.exception('Job %s failed (attempt %s of %s)', job, job.attempts, job.max_attempts)
+            self.failed(job, '%s: %s' % (type(e).__name__, e), retry=True)
+        else:
+            self.finished(job, result)
+
+    def finished(self, job, result):
+        now = timezone.now()
+        job.status, job.finished_at = Job.DONE, now
+        job.result = json.dumps(result, separators=(',', ':'))
+        self.jobs().filter(pk=job.pk, status=Job.RUNNING, worker=self.name).update(
+            status=Job.DONE, result=job.result, finished_at=now, heartbeat_at=now,
+            progress_done=job.progress_done, progress_total=job.progress_total)
+
+    def failed(self, job, error, retry):
+        now = timezone.now()
+        fields = {'error': error, 'heartbeat_at': now}
+        if retry and job.attempts < job.max_attempts:
+            fields.update(status=Job.QUEUED, run_after=now + timedelta(seconds=retry_delay(job.attempts)))
+        else:
+            fields.update(status=Job.FAILED, finished_at=now)
+        for name, value in fields.items():
+            setattr(job, name, value)
+        self.jobs().filter(pk=job.pk, status=Job.RUNNING, worker=self.name).update(**fields)
+
+    def run_pending(self, limit=None):
+        "Run the jobs ready to run, one after the other, until there's none left. Return how many ran."
+        ran = 0
+        while limit is None or ran < limit:
+            job = self.claim()
+            if job is None:
+                break
+            self.run(job)
+            ran += 1
+        return ran
+
+    def run_forever(self, stop, poll_interval=1.0):
+        "Run the jobs as they come, until stop (a threading or multiprocessing Event) is set."
+        while not stop.is_set():
+            # what Django does around each request, for CONN_MAX_AGE and the connections lost meanwhile
+            close_old_connections()
+            job = self.claim()
+            if job is not None:
+                self.run(job)
+                close_old_connections()
+                continue
+            self.purge_finished()
+            stop.wait(poll_interval)
+
+    def purge_finished(self):
+        "At most every PURGE_INTERVAL, delete the jobs finished INSTATEAM_JOB_RETENTION_DAYS ago and their files."
+        now = time.monotonic()
+        if self.purged_at is not None and now - self.purged_at < PURGE_INTERVAL:
+            return
+        self.purged_at = now
+        purge_jobs(timezone.now() - timedelta(days=getattr(settings, 'INSTATEAM_JOB_RETENTION_DAYS', 7)),
+                   using=self.using)
+
+
+def job_files(job):
+    "The names of the files of `job` in files()."
+    arguments, result = job.get_arguments(), job.get_result() or {}
+    return [name for name in (arguments.get('file'), result.get('file') if isinstance(result, dict) else None)
+            if name]
+
+
+def purge_jobs(finished_before, batch_size=500, using='default'):
+    "Delete the jobs finished before `finished_before` with their files, and return how many."
+    storage = files()
+    deleted = 0
+    while True:
+        batch = list(Job.objects.using(using).filter(finished_at__lt=finished_before)
+                     .order_by('finished_at')[:batch_size])
+        if not batch:
+            return deleted
+        for job in batch:
+            for name in job_files(job):
+                storage.delete(name)
+        deleted += Job.objects.using(using).filter(pk__in=[job.pk for job in batch])._raw_delete(using)
@@ -0,0 +1,243 @@
+"""
+A load generator for the load_test command: virtual users, each a thread with
+its own cookie jar, browse a running server through the routes of
+instateam.urls the way a browser does, and time every request.
+
+Each virtual user repeatedly picks a scenario of the mix: a list page, a
+search, a create or an edit (the form page, then its POST with the CSRF token
+and the values found in the form), or a delete (from the edit page, as its
+delete button does). The members it edits and deletes are picked among the
+`members` generated by bench.seed_members(), and the members it creates are
+generated the same way, so that their emails and phone numbers are valid and
+don't collide with the seeded ones.
+"""
+import collections
+import itertools
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from html.parser import HTMLParser
+from http.cookiejar import CookieJar
+
+from . import bench
+
+
+# scenario: relative weight
+DEFAULT_MIX = {'list': 50, 'search': 15, 'create': 10, 'edit': 20, 'delete': 5}
+LIST_SORTS = ('last_name', 'first_name', 'email')
+# not errors under load: the member was deleted, or changed, meanwhile by another virtual user
+GONE = 404
+CONFLICT = 409
+
+
+def parse_mix(text):
+    "Parse 'list=50,edit=20,...' into {'list': 50, 'edit': 20, ...}."
+    mix = {}
+    for item in filter(None, text.split(',')):
+        name, _, weight = item.partition('=')
+        if name not in DEFAULT_MIX:
+            raise ValueError('Unknown scenario %s, expected one of: %s' % (name, ', '.join(DEFAULT_MIX)))
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise ValueError('Invalid weight for %s: %r' % (name, weight))
+    if not any(mix.values()):
+        raise ValueError('The mix has no scenario to run')
+    return mix
+
+
+class FormFields(HTMLParser):
+    "The values a browser would submit with the first form of a page."
+
+    def __init__(self):
+        super().__init__()
+        self.fields = {}
+        self.state = 'before'
+        self.select = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'form' and self.state == 'before':
+            self.state = 'in'
+        if self.state != 'in':
+            return
+        attrs = dict(attrs)
+        name = attrs.get('name')
+        if tag == 'input' and name:
+            if attrs.get('type') in ('checkbox', 'radio') and 'checked' not in attrs:
+                return
+            self.fields[name] = attrs.get('value') or ''
+        elif tag == 'select':
+            self.select = name
+        elif tag == 'option' and self.select and ('selected' in attrs or self.select not in self.fields):
+            self.fields[self.select] = attrs.get('value', '')
+
+    def handle_endtag(self, tag):
+        if tag == 'select':
+            self.select = None
+        elif tag == 'form' and self.state == 'in':
+            self.state = 'after'
+
+
+def form_fields(page):
+    parser = FormFields()
+    parser.feed(page)
+    return parser.fields
+
+
+class NoRedirects(urllib.request.HTTPRedirectHandler):
+    "Keep the redirects after a POST as responses, they're what the POST is timed on."
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Results:
+    "The latencies (in ms) and statuses of the requests of a virtual user, per request name."
+
+    def __init__(self):
+        self.samples = collections.defaultdict(list)
+        self.statuses = collections.defaultdict(collections.Counter)
+        self.errors = collections.Counter()
+
+    def record(self, name, status, milliseconds, error):
+        self.samples[name].append(milliseconds)
+        self.statuses[name][str(status or 'failed')] += 1
+        if error:
+            self.errors[name] += 1
+
+    def merge(self, other):
+        for name, samples in other.samples.items():
+            self.samples[name].extend(samples)
+            self.statuses[name].update(other.statuses[name])
+        self.errors.update(other.errors)
+
+
+class VirtualUser:
+
+    def __init__(self, base_url, members, rng, new_members, timeout=30.0):
+        self.base_url = base_url.rstrip('/')
+        self.members = members
+        self.rng = rng
+        self.new_members = new_members
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()), NoRedirects)
+        self.results = Results()
+
+    def request(self, name, path, data=None, ok=(200,)):
+        """
+        Send a GET, or a POST of the form `data`, record it under `name` and return
+        its status (None when it couldn't be sent) and content.
+        """
+        body = None if data is None else urllib.parse.urlencode(data).encode()
+        request = urllib.request.Request(self.base_url + path, data=body,
+                                         headers={'Referer': self.base_url + path})
+        start = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                status, content = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, content = e.code, e.read()
+        except OSError:
+            # refused, reset or timed out
+            status, content = None, b''
+        self.results.record(name, status, (time.perf_counter() - start) * 1000, status not in ok)
+        return status, content.decode('utf-8', 'replace')
+
+    def member_pk(self):
+        return self.rng.randrange(self.members) + 1
+
+    def list(self):
+        params = {'sort': self.rng.choice(LIST_SORTS)}
+        if self.rng.random() < 0.3:
+            params['name'] = self.rng.choice(bench.LAST_NAMES)[:2]
+        self.request('list', '/teammembers/?' + urllib.parse.urlencode(params))
+
+    def search(self):
+        query = self.rng.choice(bench.FIRST_NAMES + bench.LAST_NAMES)[:self.rng.randint(2, 4)]
+        self.request('search', '/teammembers/search?' + urllib.parse.urlencode({'q': query}))
+
+    def create(self):
+        status, page = self.request('create_form', '/teammembers/new')
+        if status != 200:
+            return
+        fields = form_fields(page)
+        attributes = bench.member_attributes(self.new_members())
+        fields.update((name, attributes[name]) for name in ('first_name', 'last_name', 'email', 'phone', 'role'))
+        self.request('create_post', '/teammembers/new', fields, ok=(302,))
+
+    def edit(self):
+        path = '/teammembers/%s/edit' % self.member_pk()
+        status, page = self.request('edit_form', path, ok=(200, GONE))
+        if status != 200:
+            return
+        fields = form_fields(page)
+        fields['first_name'] = self.rng.choice(bench.FIRST_NAMES)
+        self.request('edit_post', path, fields, ok=(302, CONFLICT, GONE))
+
+    def delete(self):
+        pk = self.member_pk()
+        status, page = self.request('edit_form', '/teammembers/%s/edit' % pk, ok=(200, GONE))
+        if status != 200:
+            return
+        token = form_fields(page).get('csrfmiddlewaretoken', '')
+        self.request('delete_post', '/teammembers/%s/delete' % pk, {'csrfmiddlewaretoken': token}, ok=(302, GONE))
+
+    def run(self, mix, deadline, think_time=0.0):
+        scenarios, weights = zip(*mix.items())
+        while time.monotonic() < deadline:
+            getattr(self, self.rng.choices(scenarios, weights)[0])()
+            if think_time:
+                time.sleep(think_time)
+
+
+def run(base_url, members, clients=8, seconds=30.0, mix=None, think_time=0.0, seed=0):
+    """
+    Run `clients` virtual users against the server at `base_url`, whose database holds
+    the first `members` members of bench.seed_members(), for `seconds`, and return a report.
+    """
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    # indexes of bench.member_attributes() after the seeded ones, shared by the users; random, so that
+    # runs against the same database don't create the same members again
+    new_members = itertools.count(members + rng.randrange(bench.NUMBERS_PER_AREA_CODE))
+    lock = threading.Lock()
+
+    def new_member():
+        with lock:
+            return next(new_members)
+
+    users = [VirtualUser(base_url, members, random.Random(rng.random()), new_member) for _ in range(clients)]
+    deadline = time.monotonic() + seconds
+    threads = [threading.Thread(target=user.run, args=(mix, deadline, think_time)) for user in users]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    results = Results()
+    for user in users:
+        results.merge(user.results)
+    requests = sum(len(samples) for samples in results.samples.values())
+    errors = sum(results.errors.values())
+    return {
+        'clients': clients,
+        'seconds': round(elapsed, 1),
+        'mix': mix,
+        'requests': requests,
+        'requests_per_second': round(requests / elapsed, 1),
+        'errors': errors,
+        'error_rate': round(errors / requests, 4) if requests else 0.0,
+        'requests_by_name': {
+            name: {
+                'statuses': dict(results.statuses[name]),
+                'errors': results.errors[name],
+                'latency_ms': bench.percentiles(samples),
+            }
+            for name, samples in sorted(results.samples.items())
+        },
+    }
@@ -0,0 +1,20 @@
+from django.db.models import CharField, Lookup
+
+
+@CharField.register_lookup
+class Prefix(Lookup):
+    """
+    field__prefix='abc' matches the values starting with 'abc', like startswith, but as
+    a range ('abc' <= field < 'abd') which any B-tree index on the column can serve.
+    LIKE can't use an index on most backends. The match is case-sensitive, and the
+    value is compared as is, without going through the field's get_prep_value().
+    """
+    lookup_name = 'prefix'
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        if not self.rhs:
+            return '%s IS NOT NULL' % lhs, lhs_params
+        upper = self.rhs[:-1] + chr(ord(self.rhs[-1]) + 1)
+        return '%s >= %%s AND %s < %%s' % (lhs, lhs), lhs_params + [self.rhs] + lhs_params + [upper]
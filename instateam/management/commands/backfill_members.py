@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from instateam.models import DENORMALIZED_FIELDS, TeamMember
+
+
+class Command(BaseCommand):
+    help = ("Fill in the denormalized TeamMember columns (%s) of existing rows, "
+            "in pk order and one batch at a time." % ', '.join(DENORMALIZED_FIELDS))
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--after-pk', type=int, default=0,
+            help='Resume after this pk, as printed by a previous run.')
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Recompute every row, not only the ones with empty columns.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = TeamMember.objects.only('pk', 'first_name', 'last_name', 'phone')
+        if not options['all']:
+            missing = Q()
+            for column in DENORMALIZED_FIELDS:
+                missing |= Q(**{column: ''})
+            queryset = queryset.filter(missing)
+
+        last_pk = options['after_pk']
+        total = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                TeamMember.objects.bulk_update(batch, list(DENORMALIZED_FIELDS))
+            last_pk = batch[-1].pk
+            total += len(batch)
+            self.stdout.write('Backfilled %s rows (last pk %s)' % (total, last_pk))
+        self.stdout.write(self.style.SUCCESS('Done, %s rows backfilled.' % total))
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+
+from InstateamProject.asgi import AsgiHandler
+from instateam import bench
+
+
+class Command(BaseCommand):
+    help = ("Compare the WSGI application run by a fixed number of synchronous workers with the ASGI "
+            "application in a single event loop, under concurrent clients that each take --client-delay-ms "
+            "to send their request. Runs in-process against a temporary database, without sockets: to "
+            "measure real servers, serve InstateamProject.asgi:application with an ASGI server such as "
+            "uvicorn and InstateamProject.wsgi:application with a WSGI one.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=5000)
+        parser.add_argument('--clients', type=int, default=64, help='Concurrent clients.')
+        parser.add_argument('--workers', type=int, default=4, help='Synchronous WSGI workers.')
+        parser.add_argument('--threads', type=int, default=settings.ASGI_THREADS, help='ASGI thread pool size.')
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument('--client-delay-ms', type=float, default=50.0)
+        parser.add_argument('--paths', default='/teammembers/,/api/teammembers?page_size=20,/teammembers/search?q=ma')
+
+    def environ(self, path):
+        url = urlsplit(path)
+        return {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': url.path, 'QUERY_STRING': url.query, 'SCRIPT_NAME': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'REMOTE_ADDR': '127.0.0.1',
+            'HTTP_HOST': 'localhost', 'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': None,
+            'wsgi.errors': self.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+        }
+
+    def run_wsgi(self, paths, options):
+        "Each client waits for a free worker, which then spends the client delay on it before handling the request."
+        application = get_wsgi_application()
+        workers = threading.BoundedSemaphore(options['workers'])
+        delay = options['client_delay_ms'] / 1000
+        deadline = time.monotonic() + options['seconds']
+        samples, statuses = [], {}
+
+        def client(i):
+            n = i
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                with workers:
+                    time.sleep(delay)
+                    status = []
+                    response = application(self.environ(paths[n % len(paths)]), lambda s, h: status.append(s[:3]))
+                    b''.join(response)
+                    response.close()
+                samples.append((time.perf_counter() - start) * 1000)
+                statuses[status[0]] = statuses.get(status[0], 0) + 1
+                n += 1
+
+        with ThreadPoolExecutor(max_workers=options['clients']) as executor:
+            list(executor.map(client, range(options['clients'])))
+        return samples, statuses
+
+    def run_asgi(self, paths, options):
+        "Each client's delay is spent in the event loop, the pool threads only run the views."
+        application = AsgiHandler(get_wsgi_application(), threads=options['threads'])
+        delay = options['client_delay_ms'] / 1000
+        samples, statuses = [], {}
+
+        async def client(i, deadline):
+            n = i
+            while time.monotonic() < deadline:
+                url = urlsplit(paths[n % len(paths)])
+                scope = {
+                    'type': 'http', 'method': 'GET', 'path': url.path, 'query_string': url.query.encode(),
+                    'headers': [(b'host', b'localhost')], 'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+                }
+                messages = []
+
+                async def receive():
+                    await asyncio.sleep(delay)
+                    return {'type': 'http.request', 'body': b''}
+
+                async def send(message):
+                    messages.append(message)
+
+                start = time.perf_counter()
+                await application(scope, receive, send)
+                samples.append((time.perf_counter() - start) * 1000)
+                status = str(messages[0]['status'])
+                statuses[status] = statuses.get(status, 0) + 1
+                n += 1
+
+        async def main():
+            deadline = time.monotonic() + options['seconds']
+            await asyncio.gather(*(client(i, deadline) for i in range(options['clients'])))
+
+        asyncio.run(main())
+        application.executor.shutdown()
+        return samples, statuses
+
+    def handle(self, *args, **options):
+        paths = options['paths'].split(',')
+        report = {'clients': options['clients'], 'client_delay_ms': options['client_delay_ms']}
+        with bench.temporary_database(on_disk=True):
+            bench.seed_members(options['members'])
+            for name, run, concurrency in (('wsgi', self.run_wsgi, options['workers']),
+                                           ('asgi', self.run_asgi, options['threads'])):
+                self.stdout.write('Running %s...' % name)
+                start = time.monotonic()
+                samples, statuses = run(paths, options)
+                elapsed = time.monotonic() - start
+                report[name] = {
+                    'concurrency': concurrency,
+                    'requests_per_second': round(len(samples) / elapsed, 1),
+                    'statuses': statuses,
+                    'latency_ms': bench.percentiles(samples),
+                }
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,100 @@
+import json
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connections
+
+from instateam import bench
+from instateam.models import TeamMember
+from instateam.pagination import KeysetPaginator, encode_cursor
+
+
+class Command(BaseCommand):
+    help = ("Seed a temporary database with generated members and measure the throughput of the configured "
+            "database (see DB_PROFILE) under list, detail and update requests from concurrent threads.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=20000)
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=10.0)
+        parser.add_argument('--write-ratio', type=float, default=0.1)
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def list_page(self, rng):
+        i = rng.randrange(self.members)
+        attrs = bench.member_attributes(i)
+        cursor = encode_cursor([attrs['last_name'], attrs['first_name'], i + 1], 'n')
+        return list(KeysetPaginator(TeamMember.objects.all(), self.page_size).page(cursor))
+
+    def detail(self, rng):
+        member = TeamMember.objects.get(pk=rng.randrange(self.members) + 1)
+        return member.formatted_phone_national()
+
+    def update(self, rng):
+        # what TeamMembersUpdate does
+        member = TeamMember.objects.get(pk=rng.randrange(self.members) + 1)
+        member.role = 'regular' if member.is_admin() else 'admin'
+        member.save()
+
+    def worker(self, seed, deadline, results):
+        rng = random.Random(seed)
+        operations = {'list': self.list_page, 'detail': self.detail, 'update': self.update}
+        samples = {name: [] for name in operations}
+        errors = 0
+        while time.monotonic() < deadline:
+            name = 'update' if rng.random() < self.write_ratio else rng.choice(['list', 'detail'])
+            # what Django does around each request, so that CONN_MAX_AGE and the pool apply
+            close_old_connections()
+            try:
+                seconds, _ = bench.timed(operations[name], rng)
+                samples[name].append(seconds * 1000)
+            except DatabaseError as e:
+                errors += 1
+                self.stderr.write('%s failed: %s' % (name, e))
+            finally:
+                close_old_connections()
+        connections.close_all()
+        results.append((samples, errors))
+
+    def handle(self, *args, **options):
+        self.members = options['members']
+        self.page_size = options['page_size']
+        self.write_ratio = options['write_ratio']
+        connection = connections['default']
+        results = []
+        with bench.temporary_database(on_disk=True):
+            self.stdout.write('Seeding %s members...' % self.members)
+            bench.seed_members(self.members)
+            connection.close()
+            deadline = time.monotonic() + options['seconds']
+            threads = [
+                threading.Thread(target=self.worker, args=(options['seed'] + i, deadline, results))
+                for i in range(options['threads'])
+            ]
+            start = time.monotonic()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.monotonic() - start
+
+        samples = {name: [] for name in results[0][0]}
+        for thread_samples, _ in results:
+            for name, values in thread_samples.items():
+                samples[name].extend(values)
+        requests = sum(len(values) for values in samples.values())
+        self.stdout.write(json.dumps({
+            'profile': settings.DB_PROFILE,
+            'engine': connection.settings_dict['ENGINE'],
+            'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+            'pool_size': connection.settings_dict.get('POOL_SIZE', 0),
+            'threads': options['threads'],
+            'requests': requests,
+            'errors': sum(errors for _, errors in results),
+            'requests_per_second': round(requests / elapsed, 1),
+            'latency_ms': {name: bench.percentiles(values) for name, values in samples.items()},
+        }, indent=2))
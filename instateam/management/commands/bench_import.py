@@ -0,0 +1,48 @@
+import csv
+import json
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand
+
+from instateam import bench
+from instateam.importers import FORMATS, IMPORT_FIELDS, MemberImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Measure the throughput of import_members on a generated file, against a temporary database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+
+    def write_file(self, f, rows, file_format):
+        if file_format == 'csv':
+            writer = csv.DictWriter(f, IMPORT_FIELDS)
+            writer.writeheader()
+            for i in range(rows):
+                writer.writerow(bench.member_attributes(i))
+        else:
+            for i in range(rows):
+                f.write(json.dumps(bench.member_attributes(i)) + '\n')
+
+    def handle(self, *args, **options):
+        fd, path = tempfile.mkstemp(suffix='.' + options['format'])
+        try:
+            with os.fdopen(fd, 'w', newline='') as f:
+                self.write_file(f, options['rows'], options['format'])
+            with bench.temporary_database(), open(path, newline='') as f:
+                importer = MemberImporter(batch_size=options['batch_size'])
+                seconds, result = bench.timed(importer.run, read_rows(f, options['format']))
+        finally:
+            os.remove(path)
+
+        self.stdout.write(json.dumps({
+            'rows': result.rows,
+            'created': result.created,
+            'rejected': result.rejected,
+            'batch_size': options['batch_size'],
+            'seconds': round(seconds, 2),
+            'rows_per_second': round(result.rows / seconds),
+        }, indent=2))
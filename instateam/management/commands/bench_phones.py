@@ -0,0 +1,81 @@
+import json
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+import phonenumbers
+from phonenumber_field.phonenumber import to_python
+
+from instateam import bench, phones
+
+
+# the first number of a region, in a fresh interpreter, with or without preloading it as phones.preload_metadata() does
+FIRST_NUMBER = '''
+import time, phonenumbers
+if %(preload)r:
+    example = phonenumbers.example_number(%(region)r)
+    phonenumbers.is_valid_number(example)
+    for number_format in (phonenumbers.PhoneNumberFormat.E164, phonenumbers.PhoneNumberFormat.NATIONAL):
+        phonenumbers.format_number(example, number_format)
+    phonenumbers.parse(phonenumbers.format_number(example, phonenumbers.PhoneNumberFormat.NATIONAL), %(region)r)
+start = time.perf_counter()
+phonenumbers.format_number(phonenumbers.parse(%(number)r, %(region)r), phonenumbers.PhoneNumberFormat.NATIONAL)
+print((time.perf_counter() - start) * 1000)
+'''
+
+
+class Command(BaseCommand):
+    help = ("Measure phone number parsing and formatting with and without the caches of "
+            "instateam.phones, and the first number of a region with and without its metadata preloaded.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--numbers', type=int, default=1000, help='Distinct numbers.')
+        parser.add_argument('--repeat', type=int, default=5, help='Passes over the numbers.')
+        parser.add_argument('--page-size', type=int, default=50)
+
+    def per_call_us(self, func, values, repeat):
+        "Best pass of func over values, in microseconds per call."
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for value in values:
+                func(value)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return round(best / len(values) * 1e6, 2)
+
+    def first_number_ms(self, preload):
+        code = FIRST_NUMBER % {'preload': preload, 'region': 'US', 'number': '4159375555'}
+        return round(float(subprocess.check_output([sys.executable, '-c', code])), 2)
+
+    def handle(self, *args, **options):
+        strings = [bench.member_attributes(i)['phone'] for i in range(options['numbers'])]
+        numbers = [to_python(string) for string in strings]
+        national = phonenumbers.PhoneNumberFormat.NATIONAL
+        pages = [numbers[i:i + options['page_size']] for i in range(0, len(numbers), options['page_size'])]
+        repeat = options['repeat']
+
+        phones.clear()
+        report = {
+            'parse_us': {
+                'uncached': self.per_call_us(to_python, strings, repeat),
+                'cached': self.per_call_us(phones.parse, strings, repeat),
+            },
+            'format_national_us': {
+                'uncached': self.per_call_us(lambda phone: phonenumbers.format_number(phone, national), numbers, repeat),
+                'cached': self.per_call_us(lambda phone: phones.format_number(phone, national), numbers, repeat),
+            },
+            'format_page_us': {
+                'uncached': self.per_call_us(
+                    lambda page: [phonenumbers.format_number(phone, national) for phone in page], pages, repeat),
+                'format_many': self.per_call_us(lambda page: phones.format_many(page, national), pages, repeat),
+            },
+            'first_number_ms': {
+                'lazy_metadata': self.first_number_ms(preload=False),
+                'preloaded_metadata': self.first_number_ms(preload=True),
+            },
+            'cache_stats': phones.stats(),
+        }
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,55 @@
+import json
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+
+from instateam import bench
+from instateam.search import search_members
+
+
+class Command(BaseCommand):
+    help = ("Seed a temporary database with generated members and measure the latency of "
+            "/teammembers/search lookups. Fails if the p99 is above --target-p99-ms.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=500000)
+        parser.add_argument('--queries', type=int, default=2000)
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--target-p99-ms', type=float, default=20.0)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def queries(self, members, count, rng):
+        "Prefixes of generated names, emails and phone numbers, as a user would type them."
+        for _ in range(count):
+            attrs = bench.member_attributes(rng.randrange(members))
+            kind = rng.choice(['first_name', 'last_name', 'full_name', 'email', 'phone'])
+            if kind == 'full_name':
+                yield '%s %s' % (attrs['first_name'], attrs['last_name'][:rng.randint(1, 3)])
+            elif kind == 'phone':
+                yield attrs['phone'][2:rng.randint(5, 10)]
+            else:
+                yield attrs[kind][:rng.randint(2, 6)]
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with bench.temporary_database():
+            self.stdout.write('Seeding %s members...' % options['members'])
+            seconds, _ = bench.timed(bench.seed_members, options['members'])
+            self.stdout.write('Seeded in %.1fs' % seconds)
+
+            queries = list(self.queries(options['members'], options['queries'], rng))
+            # warm up the page cache and the connection
+            for query in queries[:50]:
+                search_members(query, limit=options['limit'])
+            samples = []
+            for query in queries:
+                seconds, _ = bench.timed(search_members, query, limit=options['limit'])
+                samples.append(seconds * 1000)
+
+        stats = bench.percentiles(samples)
+        self.stdout.write(json.dumps({'members': options['members'], 'latency_ms': stats}, indent=2))
+        if stats['p99'] > options['target_p99_ms']:
+            raise CommandError('p99 of %.2fms is above the %.2fms target' % (
+                stats['p99'], options['target_p99_ms']))
+        self.stdout.write(self.style.SUCCESS('p99 of %.2fms is within the %.2fms target' % (
+            stats['p99'], options['target_p99_ms'])))
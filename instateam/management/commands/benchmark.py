@@ -0,0 +1,125 @@
+import json
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from instateam import bench
+from instateam.models import TeamMember
+from instateam.pagination import encode_cursor
+
+
+# created members get their attributes from there, far from the seeded ones
+CREATED_OFFSET = 10000000
+
+
+class Command(BaseCommand):
+    help = ("Run the benchmark suite (list page rendering, create/update/delete through the forms, phone "
+            "formatting) against temporary databases of each --sizes members, and print the latencies as JSON. "
+            "With --compare, fail if a latency regressed by more than --threshold against a stored report.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000')
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Also write the report to this file, e.g. to use it as a baseline.')
+        parser.add_argument('--compare', metavar='BASELINE', help='A report written by --output.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Regression allowed before --compare fails, as a fraction (default: 0.2).')
+        parser.add_argument('--stats', default='p50,p95', help='Percentiles compared by --compare.')
+
+    def measure(self, func, args_list):
+        "Latencies, in ms, of func(*args) for each args of args_list."
+        samples = []
+        for args in args_list:
+            seconds, _ = bench.timed(func, *args)
+            samples.append(seconds * 1000)
+        stats = bench.percentiles(samples)
+        stats['per_second'] = round(len(samples) / (sum(samples) / 1000), 1) if samples else 0
+        return stats
+
+    def get(self, url, params=None):
+        response = self.client.get(url, params or {})
+        if response.status_code != 200:
+            raise CommandError('GET %s answered %s' % (url, response.status_code))
+
+    def post(self, url, data):
+        response = self.client.post(url, data)
+        if response.status_code != 302:
+            raise CommandError('POST %s answered %s' % (url, response.status_code))
+
+    def run_suite(self, size, iterations, rng):
+        results = {}
+        seeded = rng.sample(range(size), min(size, iterations * 2))
+        to_update, to_delete = seeded[:len(seeded) // 2], seeded[len(seeded) // 2:]
+
+        # list pages starting at random members, so that every render is a new page
+        cursors = []
+        for i in (rng.randrange(size) for _ in range(iterations)):
+            attrs = bench.member_attributes(i)
+            cursors.append((reverse('team_members_list'),
+                            {'cursor': encode_cursor([attrs['last_name'], attrs['first_name'], i + 1], 'n')}))
+        results['list_render'] = self.measure(self.get, cursors)
+
+        results['edit_page_render'] = self.measure(self.get, [
+            (reverse('team_members_update', kwargs={'pk': i + 1}),) for i in to_update])
+
+        created = [bench.member_attributes(CREATED_OFFSET + self.created + n) for n in range(iterations)]
+        self.created += iterations
+        results['create_post'] = self.measure(self.post, [(reverse('team_members_create'), data) for data in created])
+
+        updates = []
+        for i in to_update:
+            data = bench.member_attributes(i)
+            data['first_name'] = 'Edited'
+            updates.append((reverse('team_members_update', kwargs={'pk': i + 1}), data))
+        results['update_post'] = self.measure(self.post, updates)
+
+        members = list(TeamMember.objects.filter(pk__in=[i + 1 for i in to_update]))
+
+        def format_phone(member):
+            # as a member freshly loaded from the database
+            member.__dict__.pop('_formatted_phones', None)
+            return member.formatted_phone_national()
+        results['formatted_phone_national'] = self.measure(format_phone, [(member,) for member in members])
+
+        results['delete_post'] = self.measure(self.post, [
+            (reverse('team_members_delete', kwargs={'pk': i + 1}), {}) for i in to_delete])
+        return results
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        report = {}
+        self.client = Client()
+        self.created = 0
+        # render every page instead of serving it from the page cache, and don't keep the queries as DEBUG does
+        with override_settings(ALLOWED_HOSTS=['testserver'], DEBUG=False, INSTATEAM_PAGE_CACHE=None):
+            for size in sizes:
+                with bench.temporary_database():
+                    self.stdout.write('Seeding %s members...' % size)
+                    bench.seed_members(size)
+                    report[str(size)] = self.run_suite(size, min(options['iterations'], size // 2), rng)
+
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        if options['compare']:
+            self.compare(report, options)
+
+    def compare(self, report, options):
+        with open(options['compare']) as f:
+            baseline = json.load(f)
+        rows = bench.compare_results(baseline, report, options['threshold'], options['stats'].split(','))
+        regressions = 0
+        for size, name, stat, old, new, regressed in rows:
+            regressions += regressed
+            self.stdout.write('%8s %-26s %-4s %9.3fms -> %9.3fms %+7.1f%%%s' % (
+                size, name, stat, old, new, 100 * (new - old) / old if old else 0.0,
+                '  REGRESSION' if regressed else ''))
+        if regressions:
+            raise CommandError('%s measure(s) regressed by more than %.0f%%' % (regressions, 100 * options['threshold']))
+        self.stdout.write(self.style.SUCCESS('No regression above %.0f%%' % (100 * options['threshold'])))
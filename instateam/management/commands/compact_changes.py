@@ -0,0 +1,33 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from instateam.models import MemberChange
+
+
+class Command(BaseCommand):
+    help = ("Delete the changes of the roster's change log older than --days "
+            "(INSTATEAM_CHANGES_RETENTION_DAYS by default), one batch at a time. Clients of "
+            "/api/teammembers/changes with an older cursor then have to fetch the whole roster again.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=getattr(settings, 'INSTATEAM_CHANGES_RETENTION_DAYS', 7))
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--pause', type=float, default=0.0,
+            help='Seconds to wait between batches, to leave the database to the requests.')
+
+    def handle(self, *args, **options):
+        changed_before = timezone.now() - timedelta(days=options['days'])
+        total = 0
+        while True:
+            deleted = MemberChange.compact_batch(changed_before, batch_size=options['batch_size'])
+            if not deleted:
+                break
+            total += deleted
+            self.stdout.write('Deleted %s changes' % total)
+            time.sleep(options['pause'])
+        self.stdout.write(self.style.SUCCESS('Done, %s changes deleted.' % total))
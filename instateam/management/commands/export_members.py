@@ -0,0 +1,33 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from instateam.exporters import FORMATS, export_members, gzip_chunks
+
+
+class Command(BaseCommand):
+    help = 'Export every team member as CSV, JSON Lines or vCard, streaming them in chunks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(FORMATS), default='csv')
+        parser.add_argument('--output', default='-', help="The file to write, or '-' for the standard output.")
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip.')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        chunks = export_members(options['format'], chunk_size=options['chunk_size'])
+        if options['gzip']:
+            output = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+            chunks = gzip_chunks(chunks)
+        elif options['output'] == '-':
+            output = sys.stdout
+        else:
+            output = open(options['output'], 'w', encoding='utf-8', newline='')
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if output in (sys.stdout, sys.stdout.buffer):
+                output.flush()
+            else:
+                output.close()
@@ -0,0 +1,52 @@
+import csv
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from instateam.importers import FORMATS, ImportFormatError, MemberImporter, guess_format, read_rows
+
+
+class Command(BaseCommand):
+    help = ('Import team members from a CSV file (with a first_name,last_name,email,phone[,role] '
+            'header) or a JSON Lines file, in batches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="The file to import, or '-' for the standard input.")
+        parser.add_argument('--format', choices=FORMATS, help='Guessed from the file extension by default.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--errors', help='Write the rejected rows to this CSV file (line,field,message).')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            file_format = options['format'] or guess_format(path)
+        except ImportFormatError as e:
+            raise CommandError('%s, use --format' % e)
+        importer = MemberImporter(batch_size=options['batch_size'], using=options['database'])
+
+        def progress(result):
+            if options['verbosity'] >= 2:
+                self.stdout.write('%s rows read, %s members created' % (result.rows, result.created))
+
+        stream = sys.stdin if path == '-' else open(path, encoding='utf-8', newline='')
+        try:
+            result = importer.run(read_rows(stream, file_format), progress=progress)
+        except ImportFormatError as e:
+            raise CommandError(str(e))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        if options['errors']:
+            with open(options['errors'], 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['line', 'field', 'message'])
+                writer.writerows(result.errors)
+        else:
+            for error in result.errors:
+                self.stderr.write('line %s: %s: %s' % (error.line, error.field or '-', error.message))
+
+        self.stdout.write(self.style.SUCCESS('%s rows read, %s members created, %s rows rejected.' % (
+            result.rows, result.created, result.rejected)))
@@ -0,0 +1,105 @@
+import json
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from instateam import bench, loadtest, search
+
+
+class Command(BaseCommand):
+    help = ("Load test the site over HTTP: --clients virtual users (threads) browse it for --seconds, "
+            "following the --mix of scenarios (list pages, searches, create and edit forms with their POSTs, "
+            "deletes), and the throughput, error rate and latency percentiles of each request are printed as "
+            "JSON. Without --url, a temporary database is seeded with --members generated members and "
+            "served by --server; with --url, the server's database must hold the --members first members "
+            "of seed_members.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='A running server to load, e.g. http://127.0.0.1:8000.')
+        parser.add_argument('--members', type=int, default=10000)
+        parser.add_argument('--clients', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=30.0)
+        parser.add_argument('--mix', default=','.join('%s=%s' % item for item in loadtest.DEFAULT_MIX.items()),
+                            help='Relative weights of the scenarios.')
+        parser.add_argument('--think-ms', type=float, default=0.0, help='Pause of a virtual user between scenarios.')
+        parser.add_argument('--server', default='{python} {manage} runserver --noreload {address}',
+                            help='Command starting the server to load, without --url, e.g. '
+                                 '"gunicorn -w 4 -b {address} InstateamProject.wsgi".')
+        parser.add_argument('--server-workers', type=int, default=1,
+                            help='Worker processes of --server, for the throughput per worker.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Also write the report to this JSON file.')
+
+    def handle(self, *args, **options):
+        try:
+            mix = loadtest.parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['url']:
+            report = self.load(options['url'], mix, options)
+        else:
+            with bench.temporary_database(on_disk=True) as connection:
+                self.stdout.write('Seeding %s members...' % options['members'])
+                bench.seed_members(options['members'])
+                search.rebuild()
+                # the server gets the database to itself
+                connections.close_all()
+                url, server = self.start_server(connection, options)
+                try:
+                    report = self.load(url, mix, options)
+                finally:
+                    server.terminate()
+                    server.wait()
+            report['requests_per_second_per_worker'] = round(
+                report['requests_per_second'] / options['server_workers'], 1)
+        self.stdout.write(json.dumps(report, indent=2))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+    def load(self, url, mix, options):
+        self.stdout.write('Loading %s with %s clients for %ss...' % (url, options['clients'], options['seconds']))
+        report = loadtest.run(url, options['members'], clients=options['clients'], seconds=options['seconds'],
+                              mix=mix, think_time=options['think_ms'] / 1000, seed=options['seed'])
+        report['members'] = options['members']
+        return report
+
+    def start_server(self, connection, options):
+        "Start --server on a free port against the temporary database, and return its URL once it answers."
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        command = options['server'].format(
+            python=sys.executable, manage=os.path.join(settings.BASE_DIR, 'manage.py'), address='127.0.0.1:%s' % port)
+        env = dict(os.environ, DB_NAME=connection.settings_dict['NAME'], DB_REPLICAS='')
+        if connection.vendor == 'sqlite':
+            # the dev profile doesn't read DB_NAME
+            env['DB_PROFILE'] = 'sqlite'
+        # its access log would flood the output
+        output = None if options['verbosity'] > 1 else subprocess.DEVNULL
+        server = subprocess.Popen(shlex.split(command), env=env, stdout=output, stderr=output)
+        url = 'http://127.0.0.1:%s' % port
+        deadline = time.monotonic() + 30
+        while True:
+            if server.poll() is not None:
+                raise CommandError('The server exited with %s, run with -v 2 to see why.' % server.returncode)
+            try:
+                urllib.request.urlopen(url + '/teammembers/', timeout=1).close()
+                return url, server
+            except urllib.error.HTTPError:
+                # it answers
+                return url, server
+            except OSError:
+                if time.monotonic() > deadline:
+                    server.terminate()
+                    raise CommandError('The server didn\'t answer within 30s.')
+                time.sleep(0.2)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from instateam.pagecache import PageCache
+
+
+class Command(BaseCommand):
+    help = 'Show the counters of the list page cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after showing them.')
+
+    def handle(self, *args, **options):
+        page_cache = PageCache.from_settings()
+        if page_cache is None:
+            raise CommandError('The list page cache is turned off (INSTATEAM_PAGE_CACHE = None).')
+        stats = page_cache.stats()
+        served = stats['hits'] + stats['stale_hits'] + stats['misses']
+        for name, value in stats.items():
+            self.stdout.write('%-12s %s' % (name, value))
+        if served:
+            self.stdout.write('hit ratio    %.1f%%' % (100 * (stats['hits'] + stats['stale_hits']) / served))
+        if stats['rebuilds']:
+            self.stdout.write('mean rebuild %.1f ms' % (stats['rebuild_us'] / stats['rebuilds'] / 1000))
+        if options['reset']:
+            page_cache.reset_stats()
@@ -0,0 +1,33 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from instateam.models import TeamMember
+
+
+class Command(BaseCommand):
+    help = ("Delete for good the team members soft-deleted more than --days ago "
+            "(INSTATEAM_PURGE_AFTER_DAYS by default), one batch at a time. Meant to run "
+            "periodically, e.g. from cron, while INSTATEAM_SOFT_DELETE is on.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=getattr(settings, 'INSTATEAM_PURGE_AFTER_DAYS', 30))
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'INSTATEAM_BULK_DELETE_BATCH_SIZE', 500))
+        parser.add_argument(
+            '--pause', type=float, default=0.0,
+            help='Seconds to wait between batches, to leave the database to the requests.')
+
+    def handle(self, *args, **options):
+        deleted_before = timezone.now() - timedelta(days=options['days'])
+        total = 0
+        while True:
+            purged = TeamMember.all_objects.purge_batch(deleted_before, batch_size=options['batch_size'])
+            if not purged:
+                break
+            total += purged
+            self.stdout.write('Purged %s rows' % total)
+            time.sleep(options['pause'])
+        self.stdout.write(self.style.SUCCESS('Done, %s rows purged.' % total))
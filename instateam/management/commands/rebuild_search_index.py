@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from instateam import jobs, search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the team-member search index from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--background', action='store_true', help='Queue it for run_worker instead.')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if not search.uses_fts(using):
+            self.stdout.write('The %s database is searched through its own indexes, nothing to rebuild.' % using)
+            return
+        if options['background']:
+            job = jobs.enqueue('rebuild_search_index', using=using, batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS('Queued as job %s.' % job.pk))
+            return
+        total = search.rebuild(using=using, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Indexed %s team members.' % total))
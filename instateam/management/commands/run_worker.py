@@ -0,0 +1,69 @@
+import multiprocessing
+import os
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from instateam.jobs import Worker
+
+
+def work(options):
+    "A worker process: runs the jobs until it gets a SIGTERM, finishing the one it's running."
+    stop = threading.Event()
+    # Ctrl-C reaches the whole process group, the parent passes it on as a SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    if options['nice']:
+        # so that the web server's processes get the CPU first
+        os.nice(options['nice'])
+    Worker(using=options['database']).run_forever(stop, poll_interval=options['poll_interval'])
+
+
+class Command(BaseCommand):
+    help = ("Run the background jobs (imports, exports, bulk deletes, search index rebuilds) "
+            "queued in the database, in a pool of --processes worker processes, until stopped "
+            "with SIGTERM or Ctrl-C. With --once, run the jobs ready to run and exit, e.g. from cron.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds between two looks for new jobs when there are none.')
+        parser.add_argument('--nice', type=int, default=10,
+                            help='Niceness added to the worker processes, 0 to leave it.')
+        parser.add_argument('--once', action='store_true')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        if options['once']:
+            ran = Worker(using=options['database']).run_pending()
+            self.stdout.write(self.style.SUCCESS('Ran %s jobs.' % ran))
+            return
+
+        stopping = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+        # the workers are forked, they mustn't share the parent's connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+
+        def start(name):
+            process = context.Process(target=work, args=(options,), name=name)
+            process.start()
+            return process
+
+        processes = [start('worker-%s' % number) for number in range(options['processes'])]
+        self.stdout.write('Started %s worker processes.' % len(processes))
+        while not stopping.wait(1.0):
+            # a worker process that died (e.g. killed by the OOM killer) is replaced, its job is run again
+            for i, process in enumerate(processes):
+                if not process.is_alive():
+                    self.stderr.write('%s exited with %s, restarting it.' % (process.name, process.exitcode))
+                    processes[i] = start(process.name)
+        self.stdout.write('Stopping, waiting for the running jobs to finish.')
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+        self.stdout.write(self.style.SUCCESS('Stopped.'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from instateam import bench, search
+
+
+class Command(BaseCommand):
+    help = ("Add --count generated members (see instateam.bench.member_attributes) after those already "
+            "in the configured database, in batches, and rebuild the search index: data for load_test --url. "
+            "Members are generated in order, an empty database seeded with N members holds the N first ones.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('count', type=int)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        seconds, _ = bench.timed(bench.seed_members, options['count'], batch_size=options['batch_size'])
+        self.stdout.write('Added %s members in %.1fs.' % (options['count'], seconds))
+        indexed = search.rebuild()
+        self.stdout.write(self.style.SUCCESS('Done, %s members indexed for the search.' % indexed))
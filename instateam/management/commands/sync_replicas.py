@@ -0,0 +1,43 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = ("Copy the default sqlite3 database to the INSTATEAM_READ_REPLICAS sqlite3 files (see DB_REPLICAS), "
+            "once or every --interval seconds: the replication of a PostgreSQL server, for trying "
+            "replicas locally. The replicas lag behind by up to --interval seconds.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Seconds between two copies, keeps copying until interrupted.')
+
+    def handle(self, *args, **options):
+        aliases = getattr(settings, 'INSTATEAM_READ_REPLICAS', [])
+        if not aliases:
+            raise CommandError('No replicas, set DB_REPLICAS.')
+        for alias in [DEFAULT_DB_ALIAS] + aliases:
+            if connections[alias].vendor != 'sqlite':
+                raise CommandError('%s isn\'t a sqlite3 database, its replication is the server\'s.' % alias)
+        while True:
+            start = time.perf_counter()
+            for alias in aliases:
+                self.copy(connections[DEFAULT_DB_ALIAS].settings_dict['NAME'],
+                          connections[alias].settings_dict['NAME'])
+            self.stdout.write('Copied to %s in %.0fms' % (', '.join(aliases), (time.perf_counter() - start) * 1000))
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
+
+    def copy(self, source, target):
+        source_connection, target_connection = sqlite3.connect(source), sqlite3.connect(target)
+        try:
+            target_connection.execute('PRAGMA busy_timeout = 5000')
+            # a consistent snapshot, while the requests go on writing to the source
+            source_connection.backup(target_connection)
+        finally:
+            source_connection.close()
+            target_connection.close()
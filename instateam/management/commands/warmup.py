@@ -0,0 +1,91 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from instateam.warmup import warm_up
+
+
+# run in a fresh interpreter: load the WSGI application as a server would, then time its first requests
+FIRST_REQUESTS = '''
+import io, json, time
+start = time.perf_counter()
+from InstateamProject.wsgi import application
+loaded = time.perf_counter()
+
+def request():
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': %(path)r, 'QUERY_STRING': '', 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': 'localhost',
+        'REMOTE_ADDR': '127.0.0.1', 'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+        'wsgi.errors': io.StringIO(), 'wsgi.multithread': False, 'wsgi.multiprocess': True, 'wsgi.run_once': False,
+    }
+    status = []
+    request_start = time.perf_counter()
+    response = application(environ, lambda s, h: status.append(s[:3]))
+    b''.join(response)
+    response.close()
+    return status[0], (time.perf_counter() - request_start) * 1000
+
+first_status, first_ms = request()
+second_status, second_ms = request()
+print(json.dumps({
+    'load_ms': (loaded - start) * 1000, 'first_request_ms': first_ms, 'second_request_ms': second_ms,
+    'statuses': [first_status, second_status],
+}))
+'''
+
+
+class Command(BaseCommand):
+    help = ("Warm up this process (templates, URL resolver, phone metadata) and show how long each step "
+            "took. With --measure, load the WSGI application in fresh interpreters with and without the "
+            "warmup instead, and compare their load time, first requests and slowest packages to import.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--measure', action='store_true')
+        parser.add_argument('--path', default='/teammembers/new', help='Path of the requests measured.')
+        parser.add_argument('--imports', type=int, default=10, help='Heaviest packages shown.')
+
+    def run(self, path, warmup):
+        env = dict(os.environ, WARMUP='1' if warmup else '0', CACHED_TEMPLATES='1',
+                   DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'InstateamProject.settings'))
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', FIRST_REQUESTS % {'path': path}],
+            env=env, cwd=settings.BASE_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, check=True)
+        report = json.loads(process.stdout.strip().splitlines()[-1])
+        report['imports_ms'] = self.top_imports(process.stderr)
+        return report
+
+    def top_imports(self, importtime):
+        "Total import time, and the packages that took the longest to import, from python -X importtime."
+        packages = {}
+        for line in importtime.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            own, _, name = line[len('import time:'):].split('|')
+            package = name.strip().split('.')[0]
+            packages[package] = packages.get(package, 0) + int(own) / 1000
+        heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:self.imports]
+        return {
+            'total': round(sum(packages.values()), 1),
+            'heaviest_packages': [[package, round(ms, 1)] for package, ms in heaviest],
+        }
+
+    def handle(self, *args, **options):
+        if not options['measure']:
+            for step, seconds in warm_up():
+                self.stdout.write('%-10s %7.1fms' % (step, seconds * 1000))
+            return
+        self.imports = options['imports']
+        report = {
+            'without_warmup': self.run(options['path'], warmup=False),
+            'with_warmup': self.run(options['path'], warmup=True),
+        }
+        for run in report.values():
+            for key in ('load_ms', 'first_request_ms', 'second_request_ms'):
+                run[key] = round(run[key], 1)
+        self.stdout.write(json.dumps(report, indent=2))
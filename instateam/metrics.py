@@ -0,0 +1,140 @@
+"""
+In-process metrics, rendered in the Prometheus text format at /metrics.
+
+Every process keeps its own values, so with several workers each of them has
+to be scraped (or its values summed by whoever scrapes them).
+"""
+import threading
+
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1000, 10000, 100000, 1000000, 10000000)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # label values: [count per bucket..., sum, count]
+        self.values = {}
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.values.get(label_values)
+            if series is None:
+                series = self.values[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self, label_values):
+        "(bucket upper bounds, cumulative counts, sum, count) of one series."
+        with self.lock:
+            series = list(self.values.get(label_values) or [0] * (len(self.buckets) + 2))
+        return self.buckets, series[:-2], series[-2], series[-1]
+
+    def render(self):
+        with self.lock:
+            values = sorted((key, list(series)) for key, series in self.values.items())
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        for label_values, series in values:
+            for bound, count in zip(self.buckets, series):
+                lines.append('%s_bucket%s %s' % (
+                    self.name, _labels(self.labels, label_values, [('le', _number(bound))]), count))
+            lines.append('%s_bucket%s %s' % (self.name, _labels(self.labels, label_values, [('le', '+Inf')]), series[-1]))
+            lines.append('%s_sum%s %s' % (self.name, _labels(self.labels, label_values), _number(series[-2])))
+            lines.append('%s_count%s %s' % (self.name, _labels(self.labels, label_values), series[-1]))
+        return lines
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+
+class Collector:
+    "Values kept elsewhere, read when rendered: collect() returns [(label values, value)]."
+
+    def __init__(self, name, help, type, labels=(), collect=list):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s %s' % (self.name, self.type)]
+        for label_values, value in sorted(self.collect()):
+            lines.append('%s%s %s' % (self.name, _labels(self.labels, label_values), _number(value)))
+        return lines
+
+    def clear(self):
+        # the values belong to whoever collect() reads them from
+        pass
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, *args, **kwargs):
+        metric = Collector(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = REGISTRY.histogram(
+    'instateam_request_duration_seconds', 'Time spent handling requests, by view.',
+    labels=('view', 'method', 'status'))
+DB_QUERIES = REGISTRY.histogram(
+    'instateam_request_db_queries', 'Database queries per request, by view.',
+    labels=('view',), buckets=QUERY_COUNT_BUCKETS)
+DB_DURATION = REGISTRY.histogram(
+    'instateam_request_db_duration_seconds', 'Time spent in database queries per request, by view.',
+    labels=('view',))
+TEMPLATE_DURATION = REGISTRY.histogram(
+    'instateam_request_template_duration_seconds', 'Time spent rendering the response template, by view.',
+    labels=('view',))
+RESPONSE_SIZE = REGISTRY.histogram(
+    'instateam_response_size_bytes', 'Size of the response bodies, by view.',
+    labels=('view',), buckets=SIZE_BUCKETS)
@@ -0,0 +1,154 @@
+import contextlib
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+from .db import replicas
+
+
+slow_request_logger = logging.getLogger('instateam.slow_requests')
+
+# the SQL kept for the slow request log, per request
+MAX_RECORDED_QUERIES = 200
+
+
+class QueryRecorder:
+    "A connection.execute_wrapper() counting the queries of a request and timing them."
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            if len(self.queries) < MAX_RECORDED_QUERIES:
+                self.queries.append((duration, context['connection'].alias, sql))
+
+
+class RequestMetrics:
+
+    def __init__(self, request):
+        self.request = request
+        self.start = time.perf_counter()
+        self.duration = None
+        self.queries = QueryRecorder()
+        self.template_start = None
+        self.template_duration = None
+
+    @contextlib.contextmanager
+    def recording(self):
+        with contextlib.ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self.queries))
+            yield
+
+    @property
+    def view(self):
+        match = self.request.resolver_match
+        return (match.url_name or match.view_name) if match else 'unmatched'
+
+
+class RequestMetricsMiddleware:
+    """
+    Record, per view, the time spent handling each request, its database queries
+    and their duration, the template render time and the size of the response
+    (see instateam.metrics). With INSTATEAM_SERVER_TIMING, responses tell the
+    same in a Server-Timing header; requests slower than INSTATEAM_SLOW_REQUEST_MS
+    are logged along with their slowest SQL queries.
+
+    It should come first in MIDDLEWARE, so that it times the other middlewares too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_metrics = request.instateam_metrics = RequestMetrics(request)
+        with request_metrics.recording():
+            response = self.get_response(request)
+        if response.streaming:
+            # the queries and the size are only known once the content has been sent
+            response.streaming_content = self.stream(response.streaming_content, request_metrics, response)
+        else:
+            self.finish(request_metrics, response, len(response.content))
+        return response
+
+    def process_template_response(self, request, response):
+        # called right before the response gets rendered, as long as this middleware comes first
+        request.instateam_metrics.template_start = time.perf_counter()
+        response.add_post_render_callback(lambda response: self.rendered(request.instateam_metrics))
+        return response
+
+    def rendered(self, request_metrics):
+        request_metrics.template_duration = time.perf_counter() - request_metrics.template_start
+
+    def stream(self, content, request_metrics, response):
+        size = 0
+        try:
+            with request_metrics.recording():
+                for chunk in content:
+                    size += len(chunk)
+                    yield chunk
+        finally:
+            self.finish(request_metrics, response, size)
+
+    def finish(self, request_metrics, response, size):
+        request_metrics.duration = time.perf_counter() - request_metrics.start
+        view, queries = request_metrics.view, request_metrics.queries
+        metrics.REQUEST_DURATION.observe(
+            request_metrics.duration, view, request_metrics.request.method, str(response.status_code))
+        metrics.DB_QUERIES.observe(queries.count, view)
+        metrics.DB_DURATION.observe(queries.duration, view)
+        metrics.RESPONSE_SIZE.observe(size, view)
+        if request_metrics.template_duration is not None:
+            metrics.TEMPLATE_DURATION.observe(request_metrics.template_duration, view)
+        if getattr(settings, 'INSTATEAM_SERVER_TIMING', False) and not response.streaming:
+            response['Server-Timing'] = self.server_timing(request_metrics)
+        threshold = getattr(settings, 'INSTATEAM_SLOW_REQUEST_MS', None)
+        if threshold is not None and request_metrics.duration * 1000 >= threshold:
+            self.log_slow_request(request_metrics, response)
+
+    def server_timing(self, request_metrics):
+        timings = ['db;dur=%.1f;desc="%s queries"' % (request_metrics.queries.duration * 1000, request_metrics.queries.count)]
+        if request_metrics.template_duration is not None:
+            timings.append('tpl;dur=%.1f' % (request_metrics.template_duration * 1000))
+        timings.append('total;dur=%.1f' % (request_metrics.duration * 1000))
+        return ', '.join(timings)
+
+    def log_slow_request(self, request_metrics, response):
+        queries = request_metrics.queries
+        slowest = sorted(queries.queries, key=lambda query: query[0], reverse=True)[:10]
+        slow_request_logger.warning(
+            'Slow request: %s %s (%s) answered %s in %.0fms, %s queries in %.0fms. Slowest queries:\n%s',
+            request_metrics.request.method, request_metrics.request.get_full_path(), request_metrics.view,
+            response.status_code, request_metrics.duration * 1000, queries.count, queries.duration * 1000,
+            '\n'.join('%8.1fms [%s] %s' % (duration * 1000, alias, sql) for duration, alias, sql in slowest),
+            extra={'request': request_metrics.request})
+
+
+class ReadYourWritesMiddleware:
+    """
+    Keep the reads of a client on the primary database for INSTATEAM_REPLICA_STICKY_SECONDS
+    after each of its write requests, so that it sees its own changes on the pages reading
+    from a replica (see instateam.db.replicas). Nothing to do without replicas.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in replicas.READ_METHODS and replicas.read_replicas():
+            response.set_cookie(replicas.STICKY_COOKIE, '1', max_age=replicas.sticky_seconds(),
+                                httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,42 @@
+# Generated by Django 2.2.3 on 2026-10-18 10:21
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('instateam', '0005_auto_20190703_1853'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='teammember',
+            name='full_name_sort',
+            field=models.CharField(blank=True, default='', editable=False, max_length=121),
+        ),
+        migrations.AddField(
+            model_name='teammember',
+            name='phone_national',
+            field=models.CharField(blank=True, default='', editable=False, max_length=30),
+        ),
+        migrations.AlterField(
+            model_name='teammember',
+            name='first_name',
+            field=models.CharField(max_length=60, validators=[django.core.validators.RegexValidator(message="A first name can contain only letters, -, ' and white spaces.", regex="^[a-zA-Z\\-\\s']{1,60}$")]),
+        ),
+        migrations.AlterField(
+            model_name='teammember',
+            name='last_name',
+            field=models.CharField(max_length=60, validators=[django.core.validators.RegexValidator(message="A last name can contain only letters, -, ' and white spaces.", regex="^[a-zA-Z\\-\\s']{1,60}$")]),
+        ),
+        migrations.AddIndex(
+            model_name='teammember',
+            index=models.Index(fields=['last_name', 'first_name', 'id'], name='teammember_name_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='teammember',
+            index=models.Index(fields=['full_name_sort', 'id'], name='teammember_name_sort_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+from django.db import migrations
+
+
+FTS_TABLE = 'instateam_teammember_fts'
+
+POSTGRESQL_INDEXES = [
+    ('teammember_name_trgm_idx', 'full_name_sort'),
+    ('teammember_email_trgm_idx', 'UPPER(email)'),
+]
+
+
+def create_search_index(apps, schema_editor):
+    """
+    SQLite gets an FTS5 table of names and emails, indexing every prefix of 2 and
+    3 characters so that short prefix queries stay fast, filled with the existing
+    members. PostgreSQL gets trigram indexes on the same columns.
+    Phone numbers are searched through the phone column's unique index.
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE %s USING fts5(name, email, "
+            "tokenize='unicode61', prefix='2 3')" % FTS_TABLE)
+        TeamMember = apps.get_model('instateam', 'TeamMember')
+        for mb in TeamMember.objects.iterator():
+            schema_editor.execute(
+                'INSERT INTO %s (rowid, name, email) VALUES (%%s, %%s, %%s)' % FTS_TABLE,
+                (mb.pk, mb.first_name + ' ' + mb.last_name, mb.email))
+    elif vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for name, column in POSTGRESQL_INDEXES:
+            schema_editor.execute(
+                'CREATE INDEX %s ON instateam_teammember USING gin (%s gin_trgm_ops)' % (name, column))
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE %s' % FTS_TABLE)
+    elif vendor == 'postgresql':
+        for name, column in POSTGRESQL_INDEXES:
+            schema_editor.execute('DROP INDEX %s' % name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('instateam', '0006_teammember_denormalized_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
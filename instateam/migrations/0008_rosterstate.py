@@ -0,0 +1,27 @@
+# Generated by Django 2.2.3 on 2026-10-18 10:30
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def create_roster_state(apps, schema_editor):
+    RosterState = apps.get_model('instateam', 'RosterState')
+    RosterState.objects.using(schema_editor.connection.alias).create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('instateam', '0007_teammember_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RosterState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('modified_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(create_roster_state, migrations.RunPython.noop),
+    ]
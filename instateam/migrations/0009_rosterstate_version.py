@@ -0,0 +1,18 @@
+# Generated by Django 2.2.3 on 2026-10-18 10:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('instateam', '0008_rosterstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rosterstate',
+            name='version',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 2.2.3 on 2026-10-18 10:59
+
+from django.db import migrations, models
+import phonenumber_field.modelfields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('instateam', '0009_rosterstate_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='teammember',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='teammember',
+            name='email',
+            field=models.EmailField(max_length=254),
+        ),
+        migrations.AlterField(
+            model_name='teammember',
+            name='phone',
+            field=phonenumber_field.modelfields.PhoneNumberField(error_messages={'unique': 'This phone number is already associated with a member'}, max_length=128, region=None),
+        ),
+        migrations.AddIndex(
+            model_name='teammember',
+            index=models.Index(condition=models.Q(deleted_at__isnull=False), fields=['deleted_at'], name='teammember_deleted_at_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='teammember',
+            constraint=models.UniqueConstraint(condition=models.Q(deleted_at__isnull=True), fields=('email',), name='teammember_email_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='teammember',
+            constraint=models.UniqueConstraint(condition=models.Q(deleted_at__isnull=True), fields=('phone',), name='teammember_phone_uniq'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.3 on 2026-10-18 11:02
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('instateam', '0010_teammember_soft_delete'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MemberChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('member_id', models.IntegerField()),
+                ('action', models.CharField(choices=[('create', 'create'), ('update', 'update'), ('delete', 'delete')], max_length=6)),
+                ('data', models.TextField(blank=True, default='')),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='rosterstate',
+            name='changes_compacted_through',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='memberchange',
+            index=models.Index(fields=['changed_at'], name='memberchange_changed_at_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 2.2.3 on 2026-10-18 11:05
+
+from django.db import migrations, models
+
+
+# Django 2.2 can't copy a table with partial indexes, as SQLite adds and drops
+# columns (fixed in Django 3.0): they're dropped around the AddField.
+REMOVE_PARTIAL_INDEXES = [
+    migrations.RemoveIndex(
+        model_name='teammember',
+        name='teammember_deleted_at_idx',
+    ),
+    migrations.RemoveConstraint(
+        model_name='teammember',
+        name='teammember_email_uniq',
+    ),
+    migrations.RemoveConstraint(
+        model_name='teammember',
+        name='teammember_phone_uniq',
+    ),
+]
+
+
+ADD_PARTIAL_INDEXES = [
+    migrations.AddIndex(
+        model_name='teammember',
+        index=models.Index(condition=models.Q(deleted_at__isnull=False), fields=['deleted_at'],
+                           name='teammember_deleted_at_idx'),
+    ),
+    migrations.AddConstraint(
+        model_name='teammember',
+        constraint=models.UniqueConstraint(condition=models.Q(deleted_at__isnull=True), fields=('email',),
+                                           name='teammember_email_uniq'),
+    ),
+    migrations.AddConstraint(
+        model_name='teammember',
+        constraint=models.UniqueConstraint(condition=models.Q(deleted_at__isnull=True), fields=('phone',),
+                                           name='teammember_phone_uniq'),
+    ),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('instateam', '0011_member_changes'),
+    ]
+
+    operations = REMOVE_PARTIAL_INDEXES + [
+        migrations.AddField(
+            model_name='teammember',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ] + ADD_PARTIAL_INDEXES
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.3 on 2026-10-18 11:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('instateam', '0012_teammember_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='teammember',
+            index=models.Index(fields=['first_name', 'last_name', 'id'], name='teammember_first_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='teammember',
+            index=models.Index(fields=['role', 'last_name', 'first_name', 'id'], name='teammember_role_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='teammember',
+            index=models.Index(fields=['role', 'first_name', 'last_name', 'id'], name='teammember_role_first_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='teammember',
+            index=models.Index(fields=['role', 'email', 'id'], name='teammember_role_email_idx'),
+        ),
+    ]
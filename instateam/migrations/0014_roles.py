@@ -0,0 +1,146 @@
+# Generated by Django 2.2.3 on 2026-10-18 12:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+ROLES = (
+    # (id, name, label, can_delete_members)
+    (1, 'regular', "Regular - Can't delete members", False),
+    (2, 'admin', 'Admin - Can delete members', True),
+)
+# members converted by each UPDATE
+BATCH_SIZE = 2000
+
+
+def create_roles(apps, schema_editor):
+    "The two roles of the forms, and one without permissions for any other string found in the role column."
+    Role = apps.get_model('instateam', 'Role')
+    db = schema_editor.connection.alias
+    roles = [Role(id=id, name=name, label=label, can_delete_members=can_delete)
+             for id, name, label, can_delete in ROLES]
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT DISTINCT role FROM instateam_teammember')
+        names = sorted({row[0] for row in cursor.fetchall() if row[0]} - {role.name for role in roles})
+    roles += [Role(id=len(ROLES) + i, name=name, label=name) for i, name in enumerate(names, 1)]
+    Role.objects.using(db).bulk_create(roles)
+
+
+def convert_roles(apps, schema_editor):
+    "Set role_id from the role strings, a batch of ids at a time."
+    Role = apps.get_model('instateam', 'Role')
+    connection = schema_editor.connection
+    roles = list(Role.objects.using(connection.alias).values_list('name', 'id'))
+    # empty strings become regular members, as role_id's default
+    case = 'CASE role_name %s ELSE 1 END' % ' '.join('WHEN %s THEN %s' for _ in roles)
+    case_params = [value for role in roles for value in role]
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT MIN(id), MAX(id) FROM instateam_teammember')
+        low, high = cursor.fetchone()
+        if low is not None:
+            for start in range(low, high + 1, BATCH_SIZE):
+                cursor.execute(
+                    'UPDATE instateam_teammember SET role_id = %s WHERE id >= %%s AND id < %%s' % case,
+                    case_params + [start, start + BATCH_SIZE])
+
+
+def unconvert_roles(apps, schema_editor):
+    "The other way round: copy the role names back to the role strings."
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT MIN(id), MAX(id) FROM instateam_teammember')
+        low, high = cursor.fetchone()
+        if low is not None:
+            for start in range(low, high + 1, BATCH_SIZE):
+                cursor.execute(
+                    'UPDATE instateam_teammember SET role_name = (SELECT name FROM instateam_role '
+                    'WHERE instateam_role.id = instateam_teammember.role_id) WHERE id >= %s AND id < %s',
+                    [start, start + BATCH_SIZE])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('instateam', '0013_list_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Role',
+            fields=[
+                ('id', models.PositiveSmallIntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=25, unique=True)),
+                ('label', models.CharField(blank=True, default='', max_length=60)),
+                ('can_delete_members', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.RunPython(create_roles, migrations.RunPython.noop),
+        # on the string column, created again on role_id below
+        migrations.RemoveIndex(
+            model_name='teammember',
+            name='teammember_role_name_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='teammember',
+            name='teammember_role_first_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='teammember',
+            name='teammember_role_email_idx',
+        ),
+        # as in 0012, Django 2.2 can't copy the table with them, as SQLite adds and drops columns
+        migrations.RemoveIndex(
+            model_name='teammember',
+            name='teammember_deleted_at_idx',
+        ),
+        migrations.RemoveConstraint(
+            model_name='teammember',
+            name='teammember_email_uniq',
+        ),
+        migrations.RemoveConstraint(
+            model_name='teammember',
+            name='teammember_phone_uniq',
+        ),
+        migrations.RenameField(
+            model_name='teammember',
+            old_name='role',
+            new_name='role_name',
+        ),
+        migrations.AddField(
+            model_name='teammember',
+            name='role',
+            field=models.ForeignKey(db_index=False, default=1, on_delete=django.db.models.deletion.PROTECT,
+                                    related_name='+', to='instateam.Role'),
+        ),
+        migrations.RunPython(convert_roles, unconvert_roles),
+        migrations.RemoveField(
+            model_name='teammember',
+            name='role_name',
+        ),
+        migrations.AddIndex(
+            model_name='teammember',
+            index=models.Index(condition=models.Q(deleted_at__isnull=False), fields=['deleted_at'],
+                               name='teammember_deleted_at_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='teammember',
+            constraint=models.UniqueConstraint(condition=models.Q(deleted_at__isnull=True), fields=('email',),
+                                               name='teammember_email_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='teammember',
+            constraint=models.UniqueConstraint(condition=models.Q(deleted_at__isnull=True), fields=('phone',),
+                                               name='teammember_phone_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='teammember',
+            index=models.Index(fields=['role', 'last_name', 'first_name', 'id'], name='teammember_role_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='teammember',
+            index=models.Index(fields=['role', 'first_name', 'last_name', 'id'], name='teammember_role_first_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='teammember',
+            index=models.Index(fields=['role', 'email', 'id'], name='teammember_role_email_idx'),
+        ),
+    ]
@@ -1,11 +1,338 @@
+import json
+import operator
 import re
+import threading
+import time
+import uuid
+from collections import namedtuple
+from functools import reduce
 
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
-from django.db import models
+from django.db import DatabaseError, connections, models, router, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.expressions import Expression
+from django.db.models.fields.related_descriptors import ForwardManyToOneDescriptor
+from django.db.models.functions import Cast, Greatest
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 import phonenumbers
-from phonenumber_field.modelfields import PhoneNumberField
+from phonenumber_field.modelfields import PhoneNumberDescriptor, PhoneNumberField
+from phonenumber_field.phonenumber import PhoneNumber
+
+from . import lookups  # noqa: F401 (registers the __prefix lookup)
+from . import phones, validation
+from .signals import members_bulk_created, members_bulk_deleted, members_bulk_updated
+
+
+# columns kept in sync with the fields they're derived from, see TeamMember.refresh_denormalized_fields
+DENORMALIZED_FIELDS = {
+    'phone_national': ('phone',),
+    'full_name_sort': ('first_name', 'last_name'),
+}
+
+
+# the fields whose changes bump TeamMember.version (and are recorded by MemberChange)
+VERSIONED_FIELDS = ('first_name', 'last_name', 'email', 'phone', 'role')
+
+
+class ConcurrentUpdate(DatabaseError):
+    "A member was changed, or deleted, since the version being saved was read."
+
+
+def versioned(fields):
+    "Whether saving `fields` (None for all of them) bumps the version."
+    return fields is None or any(field in VERSIONED_FIELDS for field in fields)
+
+
+# members without a pk (bulk_create on SQLite) are fetched back by email, this many at a time
+REFETCH_BATCH_SIZE = 500
+
+
+def soft_delete_enabled():
+    return getattr(settings, 'INSTATEAM_SOFT_DELETE', False)
+
+
+def bulk_delete_batch_size():
+    return getattr(settings, 'INSTATEAM_BULK_DELETE_BATCH_SIZE', 500)
+
+
+class TeamMemberQuerySet(models.QuerySet):
+    """
+    Bulk operations bypass TeamMember.save(), so they refresh the denormalized
+    columns themselves and send a signal for the whole batch (see instateam.signals).
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.refresh_denormalized_fields()
+        # the receivers write to the same transaction, see instateam.receivers
+        with transaction.atomic(using=self.db):
+            created = super().bulk_create(objs, *args, **kwargs)
+            if created:
+                members_bulk_created.send(sender=self.model, members=created, using=self.db)
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        fields = list(fields)
+        for obj in objs:
+            obj.refresh_denormalized_fields()
+        for column, sources in DENORMALIZED_FIELDS.items():
+            if column not in fields and any(source in fields for source in sources):
+                fields.append(column)
+        with transaction.atomic(using=self.db):
+            if versioned(fields):
+                updated = self._compare_and_swap(objs, fields, *args, **kwargs)
+            else:
+                updated = super().bulk_update(objs, fields, *args, **kwargs)
+            if objs:
+                members_bulk_updated.send(sender=self.model, members=objs, fields=fields, using=self.db)
+        return updated
+
+    def _compare_and_swap(self, objs, fields, batch_size=None):
+        """
+        bulk_update(), but each batch is an UPDATE of the members still at the version
+        they were read at, which bumps it: raise ConcurrentUpdate (and roll back) if
+        one of them changed meanwhile. Django's bulk_update() doesn't tell how many
+        rows it updated, hence the same CASE statements built here.
+        """
+        connection = connections[self.db]
+        fields = [self.model._meta.get_field(name) for name in fields if name != 'version']
+        # the pk twice (the WHEN and the filter), and the version in the filter
+        max_batch_size = connection.ops.bulk_batch_size(['pk', 'pk', 'version'] + fields, objs)
+        batch_size = min(batch_size, max_batch_size) if batch_size else max_batch_size
+        for i in range(0, len(objs), batch_size):
+            batch = objs[i:i + batch_size]
+            update_kwargs = {}
+            for field in fields:
+                whens = []
+                for obj in batch:
+                    value = getattr(obj, field.attname)
+                    if not isinstance(value, Expression):
+                        value = Value(value, output_field=field)
+                    whens.append(When(pk=obj.pk, then=value))
+                case = Case(*whens, output_field=field)
+                if connection.features.requires_casted_case_in_updates:
+                    case = Cast(case, output_field=field)
+                update_kwargs[field.attname] = case
+            read = reduce(operator.or_, (Q(pk=obj.pk, version=obj.version) for obj in batch))
+            updated = self.model.all_objects.using(self.db).filter(read).update(version=F('version') + 1, **update_kwargs)
+            if updated != len(batch):
+                raise ConcurrentUpdate('%s of these members changed since they were read' % (len(batch) - updated))
+        for obj in objs:
+            obj.version += 1
+
+    def bulk_delete(self, soft=None, batch_size=None, progress=None):
+        """
+        Delete the members of this queryset, `batch_size` at a time, each batch with
+        a single statement: an UPDATE of deleted_at when soft (INSTATEAM_SOFT_DELETE
+        by default), a DELETE otherwise. Unlike delete(), the members aren't loaded
+        nor sent pre/post_delete one by one, members_bulk_deleted is sent per batch
+        instead. progress(deleted, total) is called after each batch. Return the
+        number of members deleted.
+        """
+        soft = soft_delete_enabled() if soft is None else soft
+        batch_size = batch_size or bulk_delete_batch_size()
+        pks = list(self.values_list('pk', flat=True))
+        deleted_at = timezone.now()
+        for i in range(0, len(pks), batch_size):
+            batch = pks[i:i + batch_size]
+            with transaction.atomic(using=self.db):
+                batch_queryset = self.model.all_objects.using(self.db).filter(pk__in=batch)
+                if soft:
+                    batch_queryset.update(deleted_at=deleted_at)
+                else:
+                    # nothing references team members, so there's nothing to cascade to
+                    batch_queryset._raw_delete(self.db)
+                members_bulk_deleted.send(sender=self.model, pks=batch, soft=soft, using=self.db)
+            if progress:
+                progress(i + len(batch), len(pks))
+        return len(pks)
+
+    def purge_batch(self, deleted_before, batch_size=None):
+        """
+        Delete for good up to `batch_size` of the members of this queryset soft-deleted
+        before `deleted_before`, oldest first, and return how many. They're already
+        gone from the roster, so no signal is sent.
+        """
+        batch_size = batch_size or bulk_delete_batch_size()
+        # served by the partial index on deleted_at
+        batch = list(self.filter(deleted_at__lt=deleted_before).order_by('deleted_at')
+                     .values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return 0
+        with transaction.atomic(using=self.db):
+            return self.model.all_objects.using(self.db).filter(pk__in=batch)._raw_delete(self.db)
+
+
+def with_pks(members, using='default'):
+    """
+    `members`, after setting the pks that bulk_create couldn't set (on SQLite)
+    from the members fetched back by email.
+    """
+    members = list(members)
+    unsaved = [member for member in members if member.pk is None]
+    for i in range(0, len(unsaved), REFETCH_BATCH_SIZE):
+        batch = unsaved[i:i + REFETCH_BATCH_SIZE]
+        pks = dict(TeamMember.objects.using(using).filter(email__in=[member.email for member in batch])
+                   .values_list('email', 'pk'))
+        for member in batch:
+            member.pk = pks.get(member.email)
+    return [member for member in members if member.pk is not None]
+
+
+class TeamMemberManager(models.Manager.from_queryset(TeamMemberQuerySet)):
+    "The members that haven't been (soft) deleted."
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+class Role(models.Model):
+    """
+    What a team member may do. The table is tiny and rarely changes, so each
+    process reads it once (see Role.table) instead of joining it or querying it
+    for each member. The instances it returns are shared, they mustn't be modified.
+    """
+    REGULAR, ADMIN = 1, 2
+    # bumped by every change of the roles, so that the other processes read them again
+    VERSION_CACHE_KEY = 'instateam:roles-version'
+
+    id = models.PositiveSmallIntegerField(primary_key=True)
+    name = models.CharField(max_length=25, unique=True)
+    # shown by the member forms
+    label = models.CharField(max_length=60, blank=True, default='')
+    can_delete_members = models.BooleanField(default=False)
+
+    _table = None
+    # the shared version the table was read at, and when
+    _table_version = None
+    _table_read_at = None
+    _table_lock = threading.Lock()
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def table(cls):
+        """
+        {id: Role}, read from the database the first time it's needed, and again
+        once check_table() finds it stale.
+        """
+        table = cls._table
+        if table is None:
+            with cls._table_lock:
+                if cls._table is None:
+                    # read before the roles, a change made meanwhile is noticed by the next check
+                    cls._table_version = roster_cache().get(cls.VERSION_CACHE_KEY)
+                    cls._table_read_at = time.monotonic()
+                    cls._table = {role.pk: role for role in cls.objects.order_by('pk')}
+                table = cls._table
+        return table
+
+    @classmethod
+    def forget_table(cls):
+        cls._table = None
+
+    @classmethod
+    def check_table(cls):
+        """
+        Forget the table if the roles changed since it was read, in any process, or if
+        it's older than INSTATEAM_ROLE_TABLE_TIMEOUT seconds: the version is only shared
+        by caches shared between the processes. Called at the start of each request.
+        """
+        if cls._table is None:
+            return
+        timeout = getattr(settings, 'INSTATEAM_ROLE_TABLE_TIMEOUT', 60)
+        if (time.monotonic() - cls._table_read_at >= timeout
+                or roster_cache().get(cls.VERSION_CACHE_KEY) != cls._table_version):
+            cls.forget_table()
+
+    @classmethod
+    def roles_changed(cls, using='default'):
+        "Have every process read the roles again, this one at once."
+        cls.forget_table()
+        roster_cache().set(cls.VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+        # another process may read the old roles again before this transaction commits
+        transaction.on_commit(lambda: roster_cache().set(cls.VERSION_CACHE_KEY, uuid.uuid4().hex, None),
+                              using=using)
+
+    @classmethod
+    def cached(cls, role_id):
+        try:
+            return cls.table()[role_id]
+        except KeyError:
+            raise cls.DoesNotExist('There is no role %s' % role_id)
+
+    @classmethod
+    def names(cls):
+        return [role.name for role in cls.table().values()]
+
+    @classmethod
+    def named(cls, name):
+        for role in cls.table().values():
+            if role.name == name:
+                return role
+        raise cls.DoesNotExist('There is no role named %s' % name)
+
+
+class CachedRoleDescriptor(ForwardManyToOneDescriptor):
+    "Gets the Role from the cached role table, and takes a role name as well as a Role."
+
+    def get_object(self, instance):
+        return Role.cached(getattr(instance, self.field.attname))
+
+    def __set__(self, instance, value):
+        if isinstance(value, str):
+            try:
+                value = Role.named(value)
+            except Role.DoesNotExist as e:
+                raise ValueError(str(e))
+        super().__set__(instance, value)
+
+
+class RoleField(models.ForeignKey):
+    "A foreign key to Role, read through the cached role table. Migrations see a ForeignKey."
+    forward_related_accessor_class = CachedRoleDescriptor
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        return name, 'django.db.models.ForeignKey', args, kwargs
+
+
+class CachedPhoneNumberDescriptor(PhoneNumberDescriptor):
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.name] = phones.parse(value, region=self.field.region)
+        # the member's formatted numbers were those of the previous one
+        instance.__dict__.pop('_formatted_phones', None)
+
+
+class CachedPhoneNumberField(PhoneNumberField):
+    """
+    A PhoneNumberField parsing, checking and formatting numbers through the caches
+    of instateam.phones, e.g. the E.164 strings of all the rows read from the
+    database. Migrations see it as the PhoneNumberField it behaves like.
+    """
+    descriptor_class = CachedPhoneNumberDescriptor
+
+    def get_prep_value(self, value):
+        if value and not isinstance(value, PhoneNumber):
+            value = phones.parse(value)
+        if isinstance(value, PhoneNumber) and not validation.is_empty(value):
+            if not phones.is_valid(value):
+                raise ValueError("“%s” is not a valid phone number." % value.raw_input)
+            value = phones.format_number(value, PhoneNumber.format_map[getattr(settings, 'PHONENUMBER_DB_FORMAT', 'E164')])
+        return super(PhoneNumberField, self).get_prep_value(value)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        return name, 'phonenumber_field.modelfields.PhoneNumberField', args, kwargs
 
 
 class TeamMember(models.Model):
@@ -16,13 +343,48 @@ class TeamMember(models.Model):
         regex="^[a-zA-Z\-\s']{1,60}$", 
         message="A last name can contain only letters, -, ' and white spaces.")])
     # A CharField that uses an EmailValidator for checking (max_length=254)
-    email = models.EmailField(unique=True)
+    # unique among the members that aren't deleted, see Meta.constraints
+    email = models.EmailField()
     # https://github.com/stefanfoulis/django-phonenumber-field
-    phone = PhoneNumberField(
+    phone = CachedPhoneNumberField(
         # different users can't have the same phone number
-        unique=True, 
         error_messages={'unique': 'This phone number is already associated with a member'})
-    role = models.CharField(max_length=25, default='regular')
+    # indexed by the (role, ...) indexes of Meta rather than on its own
+    role = RoleField(Role, on_delete=models.PROTECT, default=Role.REGULAR, related_name='+', db_index=False)
+    # denormalized columns, so that the list and search pages can sort and filter on an index
+    phone_national = models.CharField(max_length=30, blank=True, default='', editable=False)
+    full_name_sort = models.CharField(max_length=121, blank=True, default='', editable=False)
+    # set by soft deletes (INSTATEAM_SOFT_DELETE), the purge_members command deletes the rows for good
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # bumped by every change to the VERSIONED_FIELDS, saves compare-and-swap on it (see save())
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = TeamMemberManager()
+    # including the soft-deleted members
+    all_objects = TeamMemberQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # the list page's keyset pagination, for each of its sorts (see views.LIST_SORTS)
+            # and each of them filtered by role; the email sort is served by teammember_email_uniq
+            models.Index(fields=['last_name', 'first_name', 'id'], name='teammember_name_order_idx'),
+            models.Index(fields=['first_name', 'last_name', 'id'], name='teammember_first_name_idx'),
+            models.Index(fields=['role', 'last_name', 'first_name', 'id'], name='teammember_role_name_idx'),
+            models.Index(fields=['role', 'first_name', 'last_name', 'id'], name='teammember_role_first_idx'),
+            models.Index(fields=['role', 'email', 'id'], name='teammember_role_email_idx'),
+            # case-insensitive name prefix search
+            models.Index(fields=['full_name_sort', 'id'], name='teammember_name_sort_idx'),
+            # the purge of the soft-deleted members, only them
+            models.Index(fields=['deleted_at'], name='teammember_deleted_at_idx',
+                         condition=Q(deleted_at__isnull=False)),
+        ]
+        constraints = [
+            # soft-deleted members don't hold on to their email and phone
+            models.UniqueConstraint(fields=['email'], name='teammember_email_uniq',
+                                    condition=Q(deleted_at__isnull=True)),
+            models.UniqueConstraint(fields=['phone'], name='teammember_phone_uniq',
+                                    condition=Q(deleted_at__isnull=True)),
+        ]
 
     def __repr__(self):
         return self.last_name + ', ' + self.first_name
@@ -34,10 +396,276 @@ class TeamMember(models.Model):
         return self.first_name + ' ' + self.last_name
 
     def is_admin(self):
-        return self.role == 'admin'
+        return self.role_id == Role.ADMIN
+
+    def clean_fields(self, exclude=None):
+        errors = validation.clean_fields(self, exclude)
+        if errors:
+            raise ValidationError(errors)
+
+    def validate_unique(self, exclude=None):
+        exclude = list(exclude or ())
+        # a single query for both the email and the phone
+        errors = validation.unique_errors([self], exclude=exclude, using=self._state.db)[0]
+        try:
+            super().validate_unique(exclude=exclude + list(validation.UNIQUE_FIELDS))
+        except ValidationError as e:
+            errors.update(e.error_dict)
+        if errors:
+            raise ValidationError(errors)
+
+    def delete(self, using=None, keep_parents=False, soft=None):
+        "With soft (INSTATEAM_SOFT_DELETE by default), only set deleted_at, with a single UPDATE."
+        if not (soft_delete_enabled() if soft is None else soft):
+            return super().delete(using=using, keep_parents=keep_parents)
+        using = using or router.db_for_write(type(self), instance=self)
+        self.deleted_at = timezone.now()
+        with transaction.atomic(using=using):
+            type(self).all_objects.using(using).filter(pk=self.pk).update(deleted_at=self.deleted_at)
+            members_bulk_deleted.send(sender=type(self), pks=[self.pk], soft=True, using=using)
+        return 1, {self._meta.label: 1}
+
+    # the version an update is conditioned on, see _do_update()
+    _read_version = None
+
+    def save(self, *args, **kwargs):
+        """
+        Updates are a compare-and-swap: the row is only updated if it's still at the
+        version this member was read at (or was given, e.g. by TeamMemberForm),
+        otherwise ConcurrentUpdate is raised. No lock is held meanwhile.
+        """
+        self.refresh_denormalized_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            for column, sources in DENORMALIZED_FIELDS.items():
+                if update_fields.intersection(sources):
+                    update_fields.add(column)
+            if versioned(update_fields):
+                update_fields.add('version')
+            kwargs['update_fields'] = update_fields
+        read_version = self.version
+        if not self._state.adding and versioned(update_fields):
+            self._read_version = read_version
+            self.version = read_version + 1
+        try:
+            # post_save's receivers (the search index, the change log) write to the same transaction
+            with transaction.atomic(using=kwargs.get('using') or router.db_for_write(type(self), instance=self)):
+                super().save(*args, **kwargs)
+        except ConcurrentUpdate:
+            self.version = read_version
+            raise
+        finally:
+            self._read_version = None
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        if self._read_version is None:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        if not super()._do_update(base_qs.filter(version=self._read_version), using, pk_val, values,
+                                  update_fields, forced_update):
+            # changed or deleted meanwhile: it mustn't be overwritten, nor inserted again
+            raise ConcurrentUpdate('This member changed since version %s was read' % self._read_version)
+        return True
+
+    def refresh_denormalized_fields(self):
+        # from the phone about to be written, never from a number formatted before it changed
+        self._clear_formatted_phones()
+        self.phone_national = self.formatted_phone_national() if self.phone else ''
+        self.full_name_sort = ('%s %s' % (self.last_name, self.first_name)).lower()
+
+    def refresh_from_db(self, *args, **kwargs):
+        self._clear_formatted_phones()
+        super().refresh_from_db(*args, **kwargs)
+
+    def _clear_formatted_phones(self):
+        self.__dict__.pop('_formatted_phones', None)
+
+    def _format_phone(self, number_format):
+        # kept per member and format, on top of the process-wide cache of instateam.phones
+        formatted = self.__dict__.setdefault('_formatted_phones', {})
+        if number_format not in formatted:
+            formatted[number_format] = phones.format_number(self.phone, number_format)
+        return formatted[number_format]
 
     def formatted_phone_national(self):
-        return phonenumbers.format_number(self.phone, phonenumbers.PhoneNumberFormat.NATIONAL)
+        return self._format_phone(phonenumbers.PhoneNumberFormat.NATIONAL)
     
     def formatted_phone_e164(self):
-        return phonenumbers.format_number(self.phone, phonenumbers.PhoneNumberFormat.E164)
\ No newline at end of file
+        return self._format_phone(phonenumbers.PhoneNumberFormat.E164)
+
+
+RosterVersion = namedtuple('RosterVersion', ['version', 'modified_at'])
+
+
+def roster_cache():
+    return caches[getattr(settings, 'INSTATEAM_CACHE', 'default')]
+
+
+class RosterState(models.Model):
+    """
+    A single row recording the version of the roster, bumped by every change (see
+    instateam.receivers), so that readers can tell clients their copy is still
+    current without reading the members again.
+    """
+    version = models.BigIntegerField(default=0)
+    modified_at = models.DateTimeField(default=timezone.now)
+    # the highest MemberChange id deleted by MemberChange.compact_batch
+    changes_compacted_through = models.BigIntegerField(default=0)
+
+    ROW_ID = 1
+    CACHE_KEY = 'instateam:roster-version:%s'
+
+    @classmethod
+    def touch(cls, using='default'):
+        now = timezone.now()
+        updated = cls.objects.using(using).filter(pk=cls.ROW_ID).update(version=F('version') + 1, modified_at=now)
+        if not updated:
+            cls.objects.using(using).update_or_create(pk=cls.ROW_ID, defaults={'modified_at': now, 'version': 1})
+        cls.forget_current(using)
+        # a reader may cache the old version again before this transaction commits
+        transaction.on_commit(lambda: cls.forget_current(using), using=using)
+
+    @classmethod
+    def forget_current(cls, using='default'):
+        roster_cache().delete(cls.CACHE_KEY % using)
+
+    @classmethod
+    def current(cls, using='default'):
+        """
+        The RosterVersion, from the cache when possible. Writers clear the cached
+        value, but with per-process caches (local memory) other processes only
+        notice after INSTATEAM_ROSTER_VERSION_TIMEOUT seconds.
+        """
+        cache = roster_cache()
+        state = cache.get(cls.CACHE_KEY % using)
+        if state is None:
+            row = cls.objects.using(using).filter(pk=cls.ROW_ID).values_list('version', 'modified_at').first()
+            state = RosterVersion(*row) if row else RosterVersion(0, None)
+            cache.set(cls.CACHE_KEY % using, state, getattr(settings, 'INSTATEAM_ROSTER_VERSION_TIMEOUT', 5))
+        return state
+
+
+class MemberChange(models.Model):
+    """
+    The change log of the roster: a row per member created, updated or deleted,
+    written by instateam.receivers in the transaction of the change itself, so
+    that it has every committed change and nothing else. Its ids are the cursors
+    of /api/teammembers/changes.
+    """
+    CREATE, UPDATE, DELETE = 'create', 'update', 'delete'
+    ACTIONS = ((CREATE, 'create'), (UPDATE, 'update'), (DELETE, 'delete'))
+    # the TeamMember fields whose changes are recorded, with their values (and the version) after the change
+    FIELDS = VERSIONED_FIELDS
+
+    id = models.BigAutoField(primary_key=True)
+    # not a foreign key, deleted members keep their changes
+    member_id = models.IntegerField()
+    action = models.CharField(max_length=6, choices=ACTIONS)
+    # the FIELDS and version of the member after the change, as JSON, empty for deletes
+    data = models.TextField(blank=True, default='')
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # the compaction of the oldest changes
+            models.Index(fields=['changed_at'], name='memberchange_changed_at_idx'),
+        ]
+
+    @classmethod
+    def member_data(cls, member):
+        data = {field: getattr(member, field) for field in cls.FIELDS}
+        data['phone'] = member.formatted_phone_e164() if member.phone else ''
+        data['role'] = member.role.name
+        data['version'] = member.version
+        return json.dumps(data, separators=(',', ':'))
+
+    @classmethod
+    def record_saved(cls, members, created, using='default'):
+        now = timezone.now()
+        action = cls.CREATE if created else cls.UPDATE
+        cls.objects.using(using).bulk_create([
+            cls(member_id=member.pk, action=action, data=cls.member_data(member), changed_at=now)
+            for member in with_pks(members, using=using)
+        ])
+
+    @classmethod
+    def record_deleted(cls, pks, using='default'):
+        now = timezone.now()
+        cls.objects.using(using).bulk_create([
+            cls(member_id=pk, action=cls.DELETE, changed_at=now) for pk in pks
+        ])
+
+    @classmethod
+    def compacted_through(cls, using='default'):
+        "The cursor before which changes may be missing."
+        value = RosterState.objects.using(using).filter(pk=RosterState.ROW_ID) \
+            .values_list('changes_compacted_through', flat=True).first()
+        return value or 0
+
+    @classmethod
+    def compact_batch(cls, changed_before, batch_size=1000, using='default'):
+        """
+        Delete up to `batch_size` of the changes older than `changed_before`,
+        oldest first, and return how many.
+        """
+        ids = list(cls.objects.using(using).filter(changed_at__lt=changed_before)
+                   .order_by('changed_at').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return 0
+        with transaction.atomic(using=using):
+            deleted = cls.objects.using(using).filter(id__in=ids)._raw_delete(using)
+            RosterState.objects.using(using).filter(pk=RosterState.ROW_ID).update(
+                changes_compacted_through=Greatest('changes_compacted_through', max(ids)))
+        return deleted
+
+
+class Job(models.Model):
+    """
+    A slow operation (an import, an export, a bulk delete...) run by a run_worker
+    process rather than by the request asking for it, with its progress and
+    outcome. See instateam.jobs.
+    """
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+    STATUSES = ((QUEUED, 'queued'), (RUNNING, 'running'), (DONE, 'done'), (FAILED, 'failed'))
+
+    id = models.BigAutoField(primary_key=True)
+    # the task it runs, see instateam.tasks
+    name = models.CharField(max_length=50)
+    # the task's keyword arguments, as JSON
+    arguments = models.TextField(default='{}')
+    status = models.CharField(max_length=7, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    # not claimed before then, retries back off
+    run_after = models.DateTimeField(default=timezone.now)
+    worker = models.CharField(max_length=100, blank=True, default='')
+    # the last sign of life of its worker while it runs: set when it's claimed and by each progress report
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    progress_done = models.PositiveIntegerField(default=0)
+    progress_total = models.PositiveIntegerField(null=True, blank=True)
+    # what the task returned as JSON, or the partial result of its last progress report
+    result = models.TextField(blank=True, default='')
+    # the last attempt's exception
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # what the workers poll, only the queued jobs
+            models.Index(fields=['run_after', 'id'], name='job_queued_idx', condition=Q(status='queued')),
+            # the running jobs whose worker went away
+            models.Index(fields=['heartbeat_at'], name='job_running_idx', condition=Q(status='running')),
+            # the purge of the finished jobs
+            models.Index(fields=['finished_at'], name='job_finished_idx', condition=Q(finished_at__isnull=False)),
+        ]
+
+    def __str__(self):
+        return '%s #%s' % (self.name, self.pk)
+
+    def get_arguments(self):
+        return json.loads(self.arguments)
+
+    def get_result(self):
+        return json.loads(self.result) if self.result else None
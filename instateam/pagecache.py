@@ -0,0 +1,122 @@
+"""
+Cache of the rendered team-members list pages, on any configured cache backend
+(INSTATEAM_PAGE_CACHE names the CACHES alias, None turns it off).
+
+Each cached page records the roster version it was rendered at (see
+RosterState.current), so every member change makes the cached pages stale
+without deleting anything. A stale page is rebuilt by a single worker, the one
+getting the rebuild lock, while the other workers keep serving the stale copy
+(stale-while-revalidate) or, when there's no copy at all, wait a little for it.
+"""
+import hashlib
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.http import http_date, quote_etag
+
+
+KEY_PREFIX = 'instateam:page:'
+STATS_KEY = 'instateam:page-stats:%s'
+# hits: fresh pages served, stale_hits: stale pages served during a rebuild,
+# misses: requests finding no usable page, rebuilds and rebuild_us: pages rendered and the time it took
+STATS = ('hits', 'stale_hits', 'misses', 'rebuilds', 'rebuild_us')
+
+CachedPage = namedtuple('CachedPage', ['version', 'modified_at', 'content', 'content_type'])
+
+
+class PageCache:
+
+    def __init__(self, cache, timeout=600, lock_timeout=10, wait=2.0, poll_interval=0.05):
+        self.cache = cache
+        self.timeout = timeout
+        self.lock_timeout = lock_timeout
+        self.wait = wait
+        self.poll_interval = poll_interval
+
+    @classmethod
+    def from_settings(cls):
+        "The configured PageCache, or None when pages aren't cached."
+        alias = getattr(settings, 'INSTATEAM_PAGE_CACHE', 'default')
+        if alias is None:
+            return None
+        return cls(
+            caches[alias],
+            timeout=getattr(settings, 'INSTATEAM_PAGE_CACHE_TIMEOUT', 600),
+            lock_timeout=getattr(settings, 'INSTATEAM_PAGE_CACHE_LOCK_TIMEOUT', 10),
+            wait=getattr(settings, 'INSTATEAM_PAGE_CACHE_WAIT', 2.0),
+        )
+
+    def page_key(self, request):
+        return KEY_PREFIX + hashlib.sha1(request.get_full_path().encode()).hexdigest()
+
+    def respond(self, request, render, state):
+        """
+        Return the page of `request` for the RosterVersion `state`, calling `render`
+        (which returns a rendered response) only when it has to be rebuilt.
+        """
+        key = self.page_key(request)
+        page = self.cache.get(key)
+        if page is not None and page.version >= state.version:
+            self.count('hits')
+            return self.response(page, 'hit')
+
+        lock_key = key + ':lock'
+        if self.cache.add(lock_key, 1, self.lock_timeout):
+            self.count('misses')
+            try:
+                return self.rebuild(key, render, state)
+            finally:
+                self.cache.delete(lock_key)
+        if page is not None:
+            # another worker is rebuilding it, serve the copy we have meanwhile
+            self.count('stale_hits')
+            return self.response(page, 'stale')
+
+        self.count('misses')
+        deadline = time.monotonic() + self.wait
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            page = self.cache.get(key)
+            if page is not None and page.version >= state.version:
+                return self.response(page, 'hit')
+        # the other worker is too slow, or died holding the lock
+        return self.rebuild(key, render, state)
+
+    def rebuild(self, key, render, state):
+        start = time.perf_counter()
+        response = render()
+        self.count('rebuilds')
+        self.count('rebuild_us', int((time.perf_counter() - start) * 1e6))
+        if response.status_code == 200:
+            page = CachedPage(state.version, state.modified_at, response.content, response['Content-Type'])
+            self.cache.set(key, page, self.timeout)
+        response['X-Page-Cache'] = 'miss'
+        return response
+
+    def response(self, page, status):
+        response = HttpResponse(page.content, content_type=page.content_type)
+        # validators of the version actually served, not of the current one
+        response['ETag'] = quote_etag('v%s' % page.version)
+        if page.modified_at is not None:
+            response['Last-Modified'] = http_date(page.modified_at.timestamp())
+        response['X-Page-Cache'] = status
+        return response
+
+    def count(self, name, delta=1):
+        # incr isn't atomic on every backend (file-based), so the counters are approximate there
+        key = STATS_KEY % name
+        try:
+            self.cache.incr(key, delta)
+        except ValueError:
+            if not self.cache.add(key, delta, None):
+                self.cache.incr(key, delta)
+
+    def stats(self):
+        values = self.cache.get_many([STATS_KEY % name for name in STATS])
+        return {name: values.get(STATS_KEY % name, 0) for name in STATS}
+
+    def reset_stats(self):
+        self.cache.delete_many([STATS_KEY % name for name in STATS])
@@ -0,0 +1,143 @@
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values, direction):
+    "Serialize a page boundary into an opaque, url-safe token."
+    raw = json.dumps([direction] + list(values), separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    "Return (direction, values) from a token built by encode_cursor."
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw.decode())
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise InvalidCursor('That cursor is not valid')
+    if not isinstance(data, list) or len(data) != size + 1 or data[0] not in ('n', 'p'):
+        raise InvalidCursor('That cursor is not valid')
+    return data[0], data[1:]
+
+
+def requested_page_size(request):
+    """
+    The page size asked for with ?page_size, INSTATEAM_PAGE_SIZE by default, capped
+    by INSTATEAM_MAX_PAGE_SIZE. Raises ValueError when it isn't a number.
+    """
+    page_size = int(request.GET.get('page_size', getattr(settings, 'INSTATEAM_PAGE_SIZE', 50)))
+    return max(1, min(page_size, getattr(settings, 'INSTATEAM_MAX_PAGE_SIZE', 500)))
+
+
+class KeysetPage:
+    """
+    One page of a KeysetPaginator. Exposes the same has_next/has_previous API as
+    django.core.paginator.Page, but links to its neighbours through cursors
+    instead of page numbers.
+    """
+
+    def __init__(self, object_list, paginator, next_values=None, previous_values=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._next_values = next_values
+        self._previous_values = previous_values
+
+    def __repr__(self):
+        return '<KeysetPage of %s items>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._next_values is not None
+
+    def has_previous(self):
+        return self._previous_values is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def next_cursor(self):
+        if self.has_next():
+            return encode_cursor(self._next_values, 'n')
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous():
+            return encode_cursor(self._previous_values, 'p')
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset on a unique, ordered key instead of OFFSET, so that every
+    page costs one indexed range scan whatever its position in the table.
+    The last ordering field must be unique (usually 'pk').
+    """
+
+    def __init__(self, queryset, per_page, ordering=('last_name', 'first_name', 'pk')):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+
+    @cached_property
+    def count(self):
+        return self.queryset.count()
+
+    def _key(self, obj):
+        return [getattr(obj, field) for field in self.ordering]
+
+    def _after(self, values, reverse=False):
+        """
+        Build the (a, b, c) > (x, y, z) filter as a disjunction of prefixes, along
+        with a >= x, which is redundant but lets the database seek to the start of
+        the page in the index rather than scanning it from its first entry.
+        """
+        lookup = 'lt' if reverse else 'gt'
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            clause = Q(**{'%s__%s' % (field, lookup): values[i]})
+            for prev_field, prev_value in zip(self.ordering[:i], values[:i]):
+                clause &= Q(**{prev_field: prev_value})
+            condition |= clause
+        return Q(**{'%s__%se' % (self.ordering[0], lookup): values[0]}) & condition
+
+    def page(self, cursor=None):
+        direction, values = 'n', None
+        if cursor:
+            direction, values = decode_cursor(cursor, len(self.ordering))
+
+        if direction == 'n':
+            queryset = self.queryset.order_by(*self.ordering)
+        else:
+            queryset = self.queryset.order_by(*['-' + field for field in self.ordering])
+        if values is not None:
+            queryset = queryset.filter(self._after(values, reverse=direction == 'p'))
+
+        # fetch one extra row to know whether there's another page after this one
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if direction == 'p':
+            rows.reverse()
+            next_values = self._key(rows[-1]) if rows else values
+            previous_values = self._key(rows[0]) if has_more else None
+        else:
+            next_values = self._key(rows[-1]) if has_more else None
+            previous_values = self._key(rows[0]) if values is not None and rows else None
+        return KeysetPage(rows, self, next_values, previous_values)
@@ -0,0 +1,64 @@
+"""
+What the user of a request may do, from the role of their team member: the
+member with the signed-in user's email.
+
+The role comes from the cached role table (see Role.table), and for_request()
+keeps the result on the request, so a request checks its permissions with one
+query at most, however many members it deletes. Roles are only enforced when
+INSTATEAM_ENFORCE_ROLES is on: until the app is deployed behind a sign-in,
+everybody may do anything, as before.
+
+These are checks of the views, the API and bulk_delete, not of the database:
+it doesn't know who signed in, and a delete made around them (the shell, raw
+SQL) isn't checked. The role foreign key's PROTECT only keeps a Role from being
+deleted while members have it.
+"""
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+
+from .models import Role, TeamMember
+
+
+DELETE_MEMBERS = 'can_delete_members'
+PERMISSIONS = (DELETE_MEMBERS,)
+
+
+def roles_enforced():
+    return getattr(settings, 'INSTATEAM_ENFORCE_ROLES', False)
+
+
+class Permissions:
+
+    def __init__(self, role=None, everything=False):
+        self.role = role
+        self.everything = everything
+
+    def has(self, permission):
+        if permission not in PERMISSIONS:
+            raise ValueError('Unknown permission %s' % permission)
+        return self.everything or (self.role is not None and getattr(self.role, permission))
+
+    def require(self, permission):
+        if not self.has(permission):
+            raise PermissionDenied('Your role doesn\'t allow this')
+
+
+def acting_role(user):
+    "The Role of the team member signed in as `user`, None if there's none."
+    if not user.is_authenticated or not user.email:
+        return None
+    role_id = TeamMember.objects.filter(email=user.email).values_list('role', flat=True).first()
+    return None if role_id is None else Role.cached(role_id)
+
+
+def for_request(request):
+    "The Permissions of the request's user, worked out once per request."
+    permissions = getattr(request, '_instateam_permissions', None)
+    if permissions is None:
+        user = getattr(request, 'user', None)
+        if not roles_enforced() or (user is not None and user.is_superuser):
+            permissions = Permissions(everything=True)
+        else:
+            permissions = Permissions(acting_role(user) if user is not None else None)
+        request._instateam_permissions = permissions
+    return permissions
@@ -0,0 +1,180 @@
+"""
+Parsing, validation and formatting of phone numbers, cached.
+
+phonenumbers parses and formats numbers with the regular expressions of each
+region's metadata, which it loads the first time the region is used. Here the
+results are kept in bounded LRU caches of INSTATEAM_PHONE_CACHE_SIZE entries:
+parsed numbers by input string (E.164 for the numbers read from the database),
+their validity and formats by number. The metadata of INSTATEAM_PHONE_REGIONS
+is loaded when the app is ready (see preload_metadata), so that it isn't the
+first requests that pay for it.
+
+The PhoneNumber instances returned are shared, they mustn't be modified. Every
+process has its own caches, their hit rates are in /metrics.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+import phonenumbers
+from phonenumber_field.phonenumber import to_python
+
+from . import metrics
+
+
+class LRUCache:
+
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        "The value of `key`, computed by compute() and stored on a miss."
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+        value = compute()
+        self.store([(key, value)])
+        return value
+
+    def get_many(self, keys, compute):
+        "The values of `keys`, those missing computed by compute(key), in a single pass over the lock."
+        values, missing = [], {}
+        with self.lock:
+            for key in keys:
+                if key in self.entries:
+                    self.hits += 1
+                    self.entries.move_to_end(key)
+                    values.append(self.entries[key])
+                else:
+                    self.misses += 1
+                    missing[key] = None
+                    values.append(None)
+        if missing:
+            for key in missing:
+                missing[key] = compute(key)
+            values = [missing[key] if key in missing else value for key, value in zip(keys, values)]
+            self.store(missing.items())
+        return values
+
+    def store(self, items):
+        with self.lock:
+            for key, value in items:
+                self.entries[key] = value
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+            }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = 0
+
+
+CACHE_SIZE = getattr(settings, 'INSTATEAM_PHONE_CACHE_SIZE', 10000)
+
+PARSED = LRUCache('parse', CACHE_SIZE)
+VALID = LRUCache('valid', CACHE_SIZE)
+FORMATTED = LRUCache('format', CACHE_SIZE)
+CACHES = (PARSED, VALID, FORMATTED)
+
+
+def parse(value, region=None):
+    "phonenumber_field's to_python(), cached for str inputs."
+    if isinstance(value, str) and value:
+        return PARSED.get((value, region), lambda: to_python(value, region=region))
+    return to_python(value, region=region)
+
+
+def number_key(phone):
+    "What identifies a number, as its E.164 form does, without formatting it."
+    if not (phone.country_code and phone.national_number):
+        return None
+    return (phone.country_code, phone.national_number, phone.italian_leading_zero,
+            phone.number_of_leading_zeros, phone.extension)
+
+
+def is_valid(phone):
+    "PhoneNumber.is_valid(), cached by number."
+    key = number_key(phone)
+    if key is None:
+        return phone.is_valid()
+    return VALID.get(key, lambda: phonenumbers.is_valid_number(phone))
+
+
+def format_number(phone, number_format):
+    "phonenumbers.format_number(), cached by number and format."
+    key = number_key(phone)
+    if key is None:
+        return phonenumbers.format_number(phone, number_format)
+    return FORMATTED.get(key + (number_format,), lambda: phonenumbers.format_number(phone, number_format))
+
+
+def format_many(phones, number_format):
+    "The format_number() of each of `phones`, e.g. for a page of the list."
+    phones = list(phones)
+    keys = [number_key(phone) for phone in phones]
+    by_key = {key + (number_format,): phone for key, phone in zip(keys, phones) if key is not None}
+    lookup = dict(zip(by_key, FORMATTED.get_many(
+        list(by_key), lambda key: phonenumbers.format_number(by_key[key], number_format))))
+    # numbers without a key (raw inputs that didn't parse) aren't cached
+    return [lookup[key + (number_format,)] if key is not None else phonenumbers.format_number(phone, number_format)
+            for key, phone in zip(keys, phones)]
+
+
+def preload_metadata(regions):
+    """
+    Load the metadata of `regions` and compile the patterns used to check and
+    format their numbers, by going through it with an example number.
+    """
+    for region in regions:
+        phonenumbers.PhoneMetadata.metadata_for_region(region)
+        example = phonenumbers.example_number(region)
+        if example is not None:
+            phonenumbers.is_valid_number(example)
+            for number_format in (phonenumbers.PhoneNumberFormat.E164, phonenumbers.PhoneNumberFormat.NATIONAL):
+                phonenumbers.format_number(example, number_format)
+            phonenumbers.parse(phonenumbers.format_number(example, phonenumbers.PhoneNumberFormat.NATIONAL), region)
+
+
+def configured_regions():
+    return getattr(settings, 'INSTATEAM_PHONE_REGIONS', None) or [settings.PHONENUMBER_DEFAULT_REGION]
+
+
+def stats():
+    return {cache.name: cache.stats() for cache in CACHES}
+
+
+def clear():
+    for cache in CACHES:
+        cache.clear()
+
+
+metrics.REGISTRY.collector(
+    'instateam_phone_cache_hits_total', 'Phone number cache hits, by cache.', 'counter',
+    labels=('cache',), collect=lambda: [((cache.name,), cache.hits) for cache in CACHES])
+metrics.REGISTRY.collector(
+    'instateam_phone_cache_misses_total', 'Phone number cache misses, by cache.', 'counter',
+    labels=('cache',), collect=lambda: [((cache.name,), cache.misses) for cache in CACHES])
+metrics.REGISTRY.collector(
+    'instateam_phone_cache_entries', 'Phone number cache entries, by cache.', 'gauge',
+    labels=('cache',), collect=lambda: [((cache.name,), len(cache.entries)) for cache in CACHES])
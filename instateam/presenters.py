@@ -0,0 +1,57 @@
+from collections import namedtuple
+
+from django.utils.functional import cached_property
+
+import phonenumbers
+
+from . import phones
+
+
+# what the list templates need to show one member, computed once per member
+MemberRow = namedtuple('MemberRow', [
+    'pk', 'version', 'full_name', 'is_admin', 'email', 'phone_national', 'phone_e164'])
+
+
+def member_row(member, phone_e164=None):
+    return MemberRow(
+        pk=member.pk,
+        version=member.version,
+        full_name=member.get_fullname(),
+        is_admin=member.is_admin(),
+        email=member.email,
+        # rows saved before the column existed may not be backfilled yet
+        phone_national=member.phone_national or member.formatted_phone_national(),
+        phone_e164=phone_e164 or member.formatted_phone_e164(),
+    )
+
+
+def member_rows(members):
+    members = list(members)
+    # a single pass over the phone cache for the whole page
+    formatted = phones.format_many([member.phone for member in members], phonenumbers.PhoneNumberFormat.E164)
+    return [member_row(member, phone_e164) for member, phone_e164 in zip(members, formatted)]
+
+
+class RosterListing:
+    """
+    The rows of one page of the team-members list, and the size of the roster.
+    Both come from the already evaluated page whenever it holds the whole roster,
+    so templates can read them as often as they like without querying again.
+    """
+
+    def __init__(self, members, paginator=None, page=None):
+        self.rows = member_rows(members)
+        self.paginator = paginator
+        self.page = page
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    @cached_property
+    def count(self):
+        if self.page is not None and self.page.has_other_pages():
+            return self.paginator.count
+        return len(self.rows)
@@ -0,0 +1,86 @@
+from django.core.signals import request_started
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import search
+from .models import MemberChange, Role, RosterState, TeamMember, versioned
+from .signals import members_bulk_created, members_bulk_deleted, members_bulk_updated
+
+
+@receiver(post_save, sender=TeamMember)
+def index_saved_member(sender, instance, using, **kwargs):
+    search.index_members([instance], using=using)
+
+
+@receiver(post_delete, sender=TeamMember)
+def unindex_deleted_member(sender, instance, using, **kwargs):
+    search.unindex_members([instance.pk], using=using)
+
+
+@receiver(members_bulk_created, sender=TeamMember)
+def index_bulk_created_members(sender, members, using, **kwargs):
+    search.index_members(members, using=using)
+
+
+@receiver(members_bulk_updated, sender=TeamMember)
+def index_bulk_updated_members(sender, members, fields, using, **kwargs):
+    # not for the backfill of the denormalized columns, whose members may not even have their email loaded
+    if set(fields).intersection(search.INDEXED_FIELDS):
+        search.index_members(members, using=using)
+
+
+@receiver(members_bulk_deleted, sender=TeamMember)
+def unindex_bulk_deleted_members(sender, pks, using, **kwargs):
+    search.unindex_members(pks, using=using)
+
+
+@receiver(post_save, sender=TeamMember)
+@receiver(post_delete, sender=TeamMember)
+@receiver(members_bulk_created, sender=TeamMember)
+@receiver(members_bulk_updated, sender=TeamMember)
+@receiver(members_bulk_deleted, sender=TeamMember)
+def touch_roster(sender, using, **kwargs):
+    RosterState.touch(using=using)
+
+
+# The change log is written after touch_roster: on PostgreSQL, the roster row it
+# updated stays locked until the transaction ends, so that the changes get their
+# ids in commit order and a reader of the feed can't skip one committed late.
+@receiver(post_save, sender=TeamMember)
+def record_saved_member(sender, instance, created, update_fields, using, **kwargs):
+    if versioned(update_fields):
+        MemberChange.record_saved([instance], created, using=using)
+
+
+@receiver(post_delete, sender=TeamMember)
+def record_deleted_member(sender, instance, using, **kwargs):
+    MemberChange.record_deleted([instance.pk], using=using)
+
+
+@receiver(members_bulk_created, sender=TeamMember)
+def record_bulk_created_members(sender, members, using, **kwargs):
+    MemberChange.record_saved(members, True, using=using)
+
+
+@receiver(members_bulk_updated, sender=TeamMember)
+def record_bulk_updated_members(sender, members, fields, using, **kwargs):
+    # not for the backfill of the denormalized columns
+    if versioned(fields):
+        MemberChange.record_saved(members, False, using=using)
+
+
+@receiver(members_bulk_deleted, sender=TeamMember)
+def record_bulk_deleted_members(sender, pks, using, **kwargs):
+    MemberChange.record_deleted(pks, using=using)
+
+
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+def forget_role_table(sender, using, **kwargs):
+    Role.roles_changed(using=using)
+
+
+@receiver(request_started)
+def check_role_table(sender, **kwargs):
+    # a cache read per request, rather than per role looked up
+    Role.check_table()
@@ -0,0 +1,183 @@
+"""
+Prefix search over the team members' names, emails and phone numbers.
+
+On SQLite, names and emails are indexed in an FTS5 table (created by migration
+0007) which is kept in sync by the receivers in instateam.receivers. On
+PostgreSQL the same lookups are served by the pg_trgm indexes created by that
+migration, and other backends fall back to plain LIKE queries.
+
+Phone numbers are unique and stored in E.164 format, so phone queries are
+always served by a range scan on the phone column's (partial) unique index
+instead.
+"""
+import re
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Q
+
+import phonenumbers
+
+from .models import REFETCH_BATCH_SIZE, MemberChange, TeamMember, with_pks
+
+
+FTS_TABLE = 'instateam_teammember_fts'
+# as created by migration 0007
+FTS_DEFINITION = "fts5(name, email, tokenize='unicode61', prefix='2 3')"
+# where rebuild() builds the new index
+FTS_BUILD_TABLE = FTS_TABLE + '_new'
+
+# a query made of digits and phone punctuation only is looked up as a phone number
+PHONE_QUERY_RE = re.compile(r'^\+?[\d\s().-]+$')
+TERM_RE = re.compile(r'\w+')
+# where the words of names and emails start without an index, as FTS5's unicode61 tokenizer splits them
+NAME_SEPARATORS = (' ', "'", '-')
+EMAIL_SEPARATORS = ('@', '.', '-', '_', '+')
+
+
+def uses_fts(using='default'):
+    return connections[using].vendor == 'sqlite'
+
+
+def search_terms(query):
+    return TERM_RE.findall(query.lower())
+
+
+def word_prefix(field, term, separators, lookup=''):
+    "Match the values of `field` having a word that starts with `term`, like an FTS5 prefix query."
+    q = Q(**{'%s__%sstartswith' % (field, lookup): term})
+    for separator in separators:
+        q |= Q(**{'%s__%scontains' % (field, lookup): separator + term})
+    return q
+
+
+def phone_prefixes(query):
+    """
+    The E.164 prefixes a phone query can stand for: the number itself when it
+    starts with a '+', otherwise either a national number of the default region,
+    or an international number typed without its '+'.
+    """
+    digits = re.sub(r'\D', '', query)
+    if not digits:
+        return []
+    if query.lstrip().startswith('+'):
+        return ['+' + digits]
+    country_code = phonenumbers.country_code_for_region(settings.PHONENUMBER_DEFAULT_REGION)
+    return ['+%s%s' % (country_code, digits), '+' + digits]
+
+
+# the member fields document() reads
+INDEXED_FIELDS = ('first_name', 'last_name', 'email')
+
+
+def document(member):
+    "The (name, email) columns indexed for one member."
+    return (member.get_fullname(), member.email)
+
+
+def index_members(members, using='default', table=FTS_TABLE):
+    if not uses_fts(using):
+        return
+    members = with_pks(members, using=using)
+    if not members:
+        return
+    unindex_members([member.pk for member in members], using=using, table=table)
+    with connections[using].cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO %s (rowid, name, email) VALUES (%%s, %%s, %%s)' % table,
+            [(member.pk,) + document(member) for member in members])
+
+
+def unindex_members(pks, using='default', table=FTS_TABLE):
+    if not uses_fts(using):
+        return
+    pks = list(pks)
+    with connections[using].cursor() as cursor:
+        for i in range(0, len(pks), REFETCH_BATCH_SIZE):
+            batch = pks[i:i + REFETCH_BATCH_SIZE]
+            cursor.execute(
+                'DELETE FROM %s WHERE rowid IN (%s)' % (table, ', '.join(['%s'] * len(batch))),
+                batch)
+
+
+def rebuild(using='default', batch_size=2000, progress=None):
+    """
+    Re-index every member into a new FTS table, a batch per transaction, then swap it
+    for the current one in a last transaction, which also re-indexes the members
+    changed meanwhile (from the change log). Searches use the current index until
+    then, and writes are never held up for the whole rebuild. progress(indexed, total)
+    is called after each batch. Returns the number of members indexed.
+    """
+    if not uses_fts(using):
+        return 0
+    members = TeamMember.objects.using(using)
+    with connections[using].cursor() as cursor:
+        # left by an interrupted rebuild
+        cursor.execute('DROP TABLE IF EXISTS %s' % FTS_BUILD_TABLE)
+        cursor.execute('CREATE VIRTUAL TABLE %s USING %s' % (FTS_BUILD_TABLE, FTS_DEFINITION))
+    # the changes made from now on are applied to the new table before the swap
+    last_change = MemberChange.objects.using(using).order_by('-id').values_list('id', flat=True).first() or 0
+    total = members.count()
+    indexed = last_pk = 0
+    while True:
+        with transaction.atomic(using=using):
+            batch = list(members.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+            index_members(batch, using=using, table=FTS_BUILD_TABLE)
+        if not batch:
+            break
+        last_pk = batch[-1].pk
+        indexed += len(batch)
+        if progress:
+            progress(indexed, total)
+    with transaction.atomic(using=using):
+        changed = list(MemberChange.objects.using(using).filter(id__gt=last_change)
+                       .values_list('member_id', flat=True).distinct())
+        # the deleted ones are only unindexed
+        unindex_members(changed, using=using, table=FTS_BUILD_TABLE)
+        for i in range(0, len(changed), REFETCH_BATCH_SIZE):
+            index_members(members.filter(pk__in=changed[i:i + REFETCH_BATCH_SIZE]), using=using,
+                          table=FTS_BUILD_TABLE)
+        with connections[using].cursor() as cursor:
+            cursor.execute('DROP TABLE %s' % FTS_TABLE)
+            cursor.execute('ALTER TABLE %s RENAME TO %s' % (FTS_BUILD_TABLE, FTS_TABLE))
+    return indexed
+
+
+def search_members(query, limit=20, using=None):
+    """
+    Return up to `limit` members whose phone number starts with `query`, or whose
+    name or email has words starting with every term of `query`. Searches the
+    database members are read from, unless `using` says otherwise.
+    """
+    if using is None:
+        using = router.db_for_read(TeamMember)
+    if PHONE_QUERY_RE.match(query):
+        # one query per prefix: each is a bounded range scan, where OR-ing them would
+        # make the database sort every match before applying the limit
+        members = []
+        for prefix in phone_prefixes(query):
+            queryset = TeamMember.objects.using(using).filter(phone__prefix=prefix)
+            members.extend(queryset.order_by('phone')[:limit - len(members)])
+            if len(members) >= limit:
+                break
+        return members
+
+    terms = search_terms(query)
+    if not terms:
+        return []
+    if uses_fts(using):
+        match = ' '.join('"%s"*' % term for term in terms)
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                'SELECT rowid FROM %s WHERE %s MATCH %%s LIMIT %%s' % (FTS_TABLE, FTS_TABLE),
+                [match, limit])
+            pks = [row[0] for row in cursor.fetchall()]
+        members = TeamMember.objects.using(using).in_bulk(pks)
+        return [members[pk] for pk in pks if pk in members]
+
+    queryset = TeamMember.objects.using(using)
+    for term in terms:
+        # full_name_sort is lowercase already
+        queryset = queryset.filter(
+            word_prefix('full_name_sort', term, NAME_SEPARATORS) | word_prefix('email', term, EMAIL_SEPARATORS, 'i'))
+    return list(queryset.order_by('full_name_sort', 'pk')[:limit])
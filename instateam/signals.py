@@ -0,0 +1,10 @@
+from django.dispatch import Signal
+
+
+# TeamMemberQuerySet's bulk operations don't send pre/post_save for each member,
+# these are sent once per call instead. Members created by bulk_create may not
+# have a pk yet (it depends on the database backend).
+members_bulk_created = Signal(providing_args=['members', 'using'])
+members_bulk_updated = Signal(providing_args=['members', 'fields', 'using'])
+# sent by TeamMemberQuerySet.bulk_delete() and soft deletes, with the pks of the deleted members
+members_bulk_deleted = Signal(providing_args=['pks', 'soft', 'using'])
@@ -0,0 +1,91 @@
+"""
+The tasks the run_worker processes run for the jobs of instateam.jobs. Each
+commits its work in batches, as its synchronous version does, so that a request
+never waits long on the worker's transactions, and can be attempted again
+after a failure.
+"""
+import os
+from itertools import islice
+
+from django.conf import settings
+
+from . import exporters, jobs, search
+from .api import ApiError, bulk_delete_queryset
+from .importers import ImportFormatError, MemberImporter, read_rows
+from .models import TeamMember
+
+
+def import_summary(result, previous, max_errors):
+    "The summary of an ImportResult, added to that of the attempts before it."
+    errors = previous.get('errors', []) + [list(error) for error in result.errors]
+    return {
+        'rows': previous.get('rows', 0) + result.rows,
+        'created': previous.get('created', 0) + result.created,
+        'rejected': previous.get('rejected', 0) + result.rejected,
+        'error_count': previous.get('error_count', 0) + len(result.errors),
+        # [line, field, message]
+        'errors': errors[:max_errors],
+    }
+
+
+@jobs.task('import_members')
+def import_members(job, progress, file, file_format, batch_size=None):
+    """
+    Import an uploaded file of jobs.files(). Each batch is reported once it's
+    committed, so that a retry resumes after the rows already imported.
+    """
+    storage = jobs.files()
+    max_errors = getattr(settings, 'INSTATEAM_IMPORT_MAX_DISPLAYED_ERRORS', 100)
+    previous = job.get_result() or {}
+    importer = MemberImporter(batch_size=batch_size or getattr(settings, 'INSTATEAM_IMPORT_BATCH_SIZE', 1000))
+
+    def report(result):
+        summary = import_summary(result, previous, max_errors)
+        progress.report(summary['rows'], force=True, **summary)
+
+    with open(storage.path(file), encoding='utf-8', newline='') as lines:
+        rows = islice(read_rows(lines, file_format), previous.get('rows', 0), None)
+        try:
+            result = importer.run(rows, progress=report)
+        except (ImportFormatError, UnicodeDecodeError) as e:
+            raise jobs.JobFailed(str(e))
+    storage.delete(file)
+    return import_summary(result, previous, max_errors)
+
+
+@jobs.task('export_members')
+def export_members(job, progress, file_format, chunk_size=2000):
+    "Export every member to a file of jobs.files(), served by /api/jobs/<id>/file."
+    content_type, extension = exporters.FORMATS[file_format]
+    storage = jobs.files()
+    name = 'export-%s.%s' % (job.pk, extension)
+    path = storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    total = TeamMember.objects.count()
+    exported = 0
+    # written under another name first, so that the file is never served half done
+    with open(path + '.part', 'w', encoding='utf-8', newline='') as f:
+        for chunk in exporters.export_members(file_format, chunk_size=chunk_size, paged=True):
+            f.write(chunk)
+            exported = min(exported + chunk_size, total)
+            progress.report(exported, total)
+    os.replace(path + '.part', path)
+    return {'file': name, 'filename': 'team-members.%s' % extension, 'size': os.path.getsize(path)}
+
+
+@jobs.task('bulk_delete')
+def bulk_delete(job, progress, ids=None, filter=None):
+    "What /api/teammembers/delete does, in batches of INSTATEAM_BULK_DELETE_BATCH_SIZE members."
+    try:
+        queryset = bulk_delete_queryset(ids, filter)
+    except ApiError as e:
+        raise jobs.JobFailed(str(e))
+    # a retry only finds the members the attempts before it didn't delete
+    return {'deleted': queryset.bulk_delete(progress=lambda done, total: progress.report(done, total))}
+
+
+@jobs.task('rebuild_search_index')
+def rebuild_search_index(job, progress, batch_size=2000):
+    "Searches keep the current index until the new one is built, see search.rebuild()."
+    return {'indexed': search.rebuild(batch_size=batch_size,
+                                      progress=lambda done, total: progress.report(done, total))}
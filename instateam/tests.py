@@ -1,9 +1,40 @@
+import asyncio
+import gzip
+import json
+import itertools
+import os
+import re
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+import phonenumbers
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.test import TestCase, Client
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.http import HttpResponse
+from django.template import engines
+from django.core.wsgi import get_wsgi_application
+from django.test import LiveServerTestCase, TestCase, TransactionTestCase, Client, RequestFactory, override_settings
 from django.urls import reverse
 
-from .models import TeamMember
+from InstateamProject.asgi import AsgiHandler
+from .models import ConcurrentUpdate, Job, MemberChange, Role, RosterState, RosterVersion, TeamMember
 from .forms import TeamMemberForm
+from .db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from .db.pool import ConnectionPool, PoolExhausted
+from .db.replicas import STICKY_COOKIE, ReplicaRouter
+from .importers import MemberImporter, read_rows
+from .pagecache import PageCache
+from .pagination import KeysetPaginator, encode_cursor
+from . import api, assets, bench, jobs, loadtest, metrics, permissions, phones, search, validation, views, warmup
 
 
 class UrlsTestCase(TestCase):
@@ -21,6 +52,8 @@ class UrlsTestCase(TestCase):
     
 
     def setUp(self):
+        # the roster version and rendered rows outlive each test's transaction
+        cache.clear()
         mb = TeamMember.objects.create(
             first_name="Eugenie", 
             last_name="Le Moulec", 
@@ -47,8 +80,8 @@ class UrlsTestCase(TestCase):
         resp = self.client.get(reverse('team_members_list'))
         self.assertTemplateUsed(resp, 'instateam/teammembers_list.html')
         self.assertIs(resp.is_rendered, True)
-        self.assertEqual(resp.context_data['object_list'].count(), 1)
-        self.assertEqual(resp.context_data['object_list'].first().first_name, 'Eugenie')
+        self.assertEqual(len(resp.context_data['object_list']), 1)
+        self.assertEqual(resp.context_data['object_list'][0].first_name, 'Eugenie')
         
 
     def test_teammember_add_view(self):
@@ -253,4 +286,1740 @@ class UrlsTestCase(TestCase):
         form_data = self.default_attributes.copy()
         form_data['phone'] = '+33296283522'
         form = TeamMemberForm(data=form_data)
-        self.assertTrue(form.is_valid())
\ No newline at end of file
+        self.assertTrue(form.is_valid())
+
+
+class PaginationTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        # 7 members whose last names collide so that the pk tie-breaker gets exercised
+        for i in range(7):
+            TeamMember.objects.create(
+                first_name='Member',
+                last_name='Team' if i % 2 else 'Abbott',
+                phone='+1415937%04d' % i,
+                email='member%s@example.com' % i)
+
+
+    def test_keyset_paginator_walks_forward_and_back(self):
+        ordered = list(TeamMember.objects.order_by('last_name', 'first_name', 'pk'))
+        paginator = KeysetPaginator(TeamMember.objects.all(), 3)
+        page1 = paginator.page()
+        self.assertEqual(list(page1), ordered[:3])
+        self.assertFalse(page1.has_previous())
+        page2 = paginator.page(page1.next_cursor)
+        self.assertEqual(list(page2), ordered[3:6])
+        page3 = paginator.page(page2.next_cursor)
+        self.assertEqual(list(page3), ordered[6:])
+        self.assertFalse(page3.has_next())
+        # and back again
+        self.assertEqual(list(paginator.page(page3.previous_cursor)), ordered[3:6])
+        back = paginator.page(page2.previous_cursor)
+        self.assertEqual(list(back), ordered[:3])
+        self.assertFalse(back.has_previous())
+        self.assertEqual(paginator.count, 7)
+
+
+    def test_list_view_pagination(self):
+        resp = self.client.get(reverse('team_members_list'), {'page_size': 5})
+        self.assertEqual(len(resp.context_data['team_members']), 5)
+        self.assertTrue(resp.context_data['is_paginated'])
+        self.assertContains(resp, 'You have 7 team members.')
+        next_cursor = resp.context_data['page_obj'].next_cursor
+        self.assertContains(resp, next_cursor)
+        resp = self.client.get(reverse('team_members_list'), {'page_size': 5, 'cursor': next_cursor})
+        self.assertEqual(len(resp.context_data['team_members']), 2)
+
+
+    def test_list_view_invalid_parameters(self):
+        resp = self.client.get(reverse('team_members_list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(resp.status_code, 404)
+        resp = self.client.get(reverse('team_members_list'), {'cursor': encode_cursor(['x'], 'n')})
+        self.assertEqual(resp.status_code, 404)
+        resp = self.client.get(reverse('team_members_list'), {'page_size': 'all'})
+        self.assertEqual(resp.status_code, 404)
+
+
+    @override_settings(INSTATEAM_STREAM_CHUNK_SIZE=2)
+    def test_list_view_streaming(self):
+        resp = self.client.get(reverse('team_members_list'), {'stream': 1})
+        self.assertTrue(resp.streaming)
+        content = b''.join(resp.streaming_content).decode()
+        self.assertIn('You have 7 team members.', content)
+        self.assertEqual(content.count('class="memberInfo"'), 7)
+        self.assertNotIn('instateam:rows', content)
+        self.assertTrue(content.rstrip().endswith('</html>'))
+
+
+
+class ListPresentationTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+
+    def create_members(self, count):
+        for i in range(TeamMember.objects.count(), count):
+            TeamMember.objects.create(
+                first_name='Member', last_name='Number', phone='+1415937%04d' % i,
+                email='member%s@example.com' % i, role='admin' if i % 3 else 'regular')
+
+
+    @override_settings(INSTATEAM_PAGE_CACHE=None)
+    def test_list_query_count_is_constant(self):
+        "The list page runs the same number of queries whatever the roster size"
+        for size in (1, 10, 40):
+            self.create_members(size)
+            # the roster version is read from the cache
+            RosterState.current()
+            with self.assertNumQueries(1):
+                resp = self.client.get(reverse('team_members_list'))
+            self.assertContains(resp, 'You have %s team member' % size)
+        # once the roster spans several pages, it only adds the COUNT query
+        with self.settings(INSTATEAM_PAGE_SIZE=5):
+            for size in (40, 120):
+                self.create_members(size)
+                RosterState.current()
+                with self.assertNumQueries(2):
+                    resp = self.client.get(reverse('team_members_list'))
+                self.assertContains(resp, 'You have %s team members.' % size)
+                self.assertEqual(resp.content.count(b'class="memberInfo"'), 5)
+
+
+    def test_list_rows(self):
+        self.create_members(3)
+        resp = self.client.get(reverse('team_members_list'))
+        self.assertContains(resp, '(415) 937-0000')
+        self.assertContains(resp, 'Member Number (admin)', count=2)
+
+
+    def test_formatted_phones_are_cached_until_the_phone_changes(self):
+        self.create_members(1)
+        member = TeamMember.objects.get()
+        self.assertEqual(member.formatted_phone_national(), '(415) 937-0000')
+        self.assertEqual(member.formatted_phone_e164(), '+14159370000')
+        self.assertIs(member.formatted_phone_e164(), member.formatted_phone_e164())
+        member.phone = '+14159377777'
+        # unsaved, as a member edited before a bulk_update()
+        self.assertEqual(member.formatted_phone_e164(), '+14159377777')
+        self.assertEqual(member.formatted_phone_national(), '(415) 937-7777')
+        member.phone = '+33296283522'
+        member.save()
+        self.assertEqual(member.formatted_phone_national(), '02 96 28 35 22')
+        self.assertEqual(member.formatted_phone_e164(), '+33296283522')
+
+
+
+class DenormalizedColumnsTestCase(TestCase):
+
+    def setUp(self):
+        self.member = TeamMember.objects.create(
+            first_name='Eugenie', last_name='Le Moulec', phone='4159375555', email='eugenie@example.com')
+
+
+    def test_columns_follow_save(self):
+        self.assertEqual(self.member.phone_national, '(415) 937-5555')
+        self.assertEqual(self.member.full_name_sort, 'le moulec eugenie')
+        self.member.phone = '+33296283522'
+        self.member.first_name = 'Marie'
+        self.member.save(update_fields=['phone', 'first_name'])
+        member = TeamMember.objects.get(pk=self.member.pk)
+        self.assertEqual(member.phone_national, '02 96 28 35 22')
+        self.assertEqual(member.full_name_sort, 'le moulec marie')
+
+
+    def test_columns_follow_bulk_operations(self):
+        TeamMember.objects.bulk_create([TeamMember(
+            first_name='Bulk', last_name='Created', phone='4159376666', email='bulk@example.com')])
+        member = TeamMember.objects.get(email='bulk@example.com')
+        self.assertEqual(member.phone_national, '(415) 937-6666')
+        self.assertEqual(member.full_name_sort, 'created bulk')
+        member.last_name = 'Updated'
+        TeamMember.objects.bulk_update([member], ['last_name'])
+        self.assertEqual(TeamMember.objects.get(pk=member.pk).full_name_sort, 'updated bulk')
+
+
+    def test_phone_national_follows_bulk_update(self):
+        member = TeamMember.objects.get(pk=self.member.pk)
+        self.assertEqual(member.formatted_phone_national(), '(415) 937-5555')
+        member.phone = '+14159376666'
+        TeamMember.objects.bulk_update([member], ['phone'])
+        member = TeamMember.objects.get(pk=self.member.pk)
+        self.assertEqual((str(member.phone), member.phone_national), ('+14159376666', '(415) 937-6666'))
+
+
+    def test_backfill_command(self):
+        for i in range(5):
+            TeamMember.objects.create(
+                first_name='Member', last_name='Number', phone='+1415937%04d' % i,
+                email='member%s@example.com' % i)
+        TeamMember.objects.update(phone_national='', full_name_sort='')
+        out = StringIO()
+        # per batch of 2: its SELECT, UPDATE, the roster's UPDATE and two savepoints (4 statements), then
+        # the SELECT finding nothing left; the search index isn't rewritten, which would load the deferred emails
+        with self.assertNumQueries(3 * 7 + 1):
+            call_command('backfill_members', batch_size=2, stdout=out)
+        self.assertIn('Done, 6 rows backfilled.', out.getvalue())
+        self.assertFalse(TeamMember.objects.filter(phone_national='').exists())
+        self.assertFalse(TeamMember.objects.filter(full_name_sort='').exists())
+        # nothing is left to do on a second run
+        out = StringIO()
+        call_command('backfill_members', stdout=out)
+        self.assertIn('Done, 0 rows backfilled.', out.getvalue())
+
+
+
+class SearchTestCase(TestCase):
+
+    def setUp(self):
+        self.eugenie = TeamMember.objects.create(
+            first_name='Eugenie', last_name='Le Moulec', phone='4159375555', email='eugenie@example.com')
+        self.john = TeamMember.objects.create(
+            first_name='John', last_name='Doe', phone='+33296283522', email='jdoe@example.org')
+
+
+    def search(self, query):
+        resp = self.client.get(reverse('team_members_search'), {'q': query})
+        self.assertEqual(resp.status_code, 200)
+        return [result['email'] for result in resp.json()['results']]
+
+
+    def test_prefix_search(self):
+        self.assertEqual(self.search('eug'), ['eugenie@example.com'])
+        self.assertEqual(self.search('moul'), ['eugenie@example.com'])
+        self.assertEqual(self.search('jdoe@ex'), ['jdoe@example.org'])
+        self.assertEqual(self.search('(415) 937'), ['eugenie@example.com'])
+        self.assertEqual(self.search('+3329'), ['jdoe@example.org'])
+        self.assertEqual(self.search('33 2 96'), ['jdoe@example.org'])
+        self.assertEqual(self.search('415 000'), [])
+        self.assertEqual(sorted(self.search('example')), ['eugenie@example.com', 'jdoe@example.org'])
+        self.assertEqual(self.search('john le'), [])
+        self.assertEqual(self.search(''), [])
+
+
+    def test_prefix_search_without_fts(self):
+        queries = ['eug', 'moul', 'oulec', 'jdoe@ex', 'doe', 'example', 'xample', 'org', 'john le', 'le mou']
+        expected = [sorted(self.search(query)) for query in queries]
+        with mock.patch.object(search, 'uses_fts', return_value=False):
+            # the same words match, not any substring
+            self.assertEqual([sorted(self.search(query)) for query in queries], expected)
+        self.assertEqual(expected[2], [])
+
+
+    def test_index_follows_writes(self):
+        self.john.first_name = 'Jack'
+        self.john.save()
+        self.assertEqual(self.search('john'), [])
+        self.assertEqual(self.search('jack'), ['jdoe@example.org'])
+        self.john.delete()
+        self.assertEqual(self.search('jack'), [])
+        TeamMember.objects.bulk_create([TeamMember(
+            first_name='Bulk', last_name='Created', phone='4159376666', email='bulk@example.com')])
+        self.assertEqual(self.search('bulk'), ['bulk@example.com'])
+
+
+    def test_rebuild_command(self):
+        with search.connections['default'].cursor() as cursor:
+            cursor.execute('DELETE FROM %s' % search.FTS_TABLE)
+        self.assertEqual(self.search('eug'), [])
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 2 team members.', out.getvalue())
+        self.assertEqual(self.search('eug'), ['eugenie@example.com'])
+
+
+    def test_rebuild_catches_up_with_changes(self):
+        reported = []
+
+        def progress(indexed, total):
+            reported.append((indexed, total))
+            if indexed == 1:
+                # already copied to the new index, changed before it's swapped in
+                self.eugenie.first_name = 'Marie'
+                self.eugenie.save()
+                self.john.delete()
+
+        self.assertEqual(search.rebuild(batch_size=1, progress=progress), 1)
+        self.assertEqual(reported, [(1, 2)])
+        self.assertEqual(self.search('marie'), ['eugenie@example.com'])
+        self.assertEqual(self.search('doe'), [])
+
+
+    def test_invalid_limit(self):
+        resp = self.client.get(reverse('team_members_search'), {'q': 'eug', 'limit': 'ten'})
+        self.assertEqual(resp.status_code, 400)
+
+
+
+class ImportTestCase(TestCase):
+
+    csv_content = (
+        'first_name,last_name,email,phone,role\n'
+        'Ada,Lovelace,ada@example.com,4159370001,admin\n'
+        'Alan,Turing,alan@example.com,+33296283522,\n'
+        'Bad2,Name,bad@example.com,4159370002,regular\n'
+        'Taken,Email,eugenie@example.com,4159370003,regular\n'
+        'Taken,Phone,other@example.com,(415) 937-5555,regular\n'
+        'Same,Batch,ada@example.com,4159370004,regular\n'
+        'Wrong,Role,role@example.com,4159370005,owner\n'
+    )
+
+    def setUp(self):
+        TeamMember.objects.create(
+            first_name='Eugenie', last_name='Le Moulec', phone='4159375555', email='eugenie@example.com')
+
+
+    def test_importer(self):
+        importer = MemberImporter(batch_size=3)
+        result = importer.run(read_rows(StringIO(self.csv_content), 'csv'))
+        self.assertEqual(result.rows, 7)
+        self.assertEqual(result.created, 2)
+        self.assertEqual(result.rejected, 5)
+        self.assertEqual({(e.line, e.field) for e in result.errors}, {
+            (4, 'first_name'), (5, 'email'), (6, 'phone'), (7, 'email'), (8, 'role')})
+        self.assertIn('This phone number is already associated with a member', [e.message for e in result.errors])
+        ada = TeamMember.objects.get(email='ada@example.com')
+        self.assertTrue(ada.is_admin())
+        self.assertEqual(ada.phone_national, '(415) 937-0001')
+        self.assertEqual(TeamMember.objects.get(email='alan@example.com').role.name, 'regular')
+
+
+    def test_importer_queries_per_batch(self):
+        "Validation costs one query per batch, whatever the batch size"
+        importer = MemberImporter(batch_size=100)
+        rows = ''.join(
+            'Member,Number,member%s@example.com,+1415937%04d,regular\n' % (i, i) for i in range(50))
+        with self.assertNumQueries(1):
+            members, errors = importer.validate_batch(list(read_rows(StringIO('first_name,last_name,email,phone,role\n' + rows), 'csv')))
+        self.assertEqual((len(members), errors), (50, []))
+
+
+    def test_importer_concurrent_inserts(self):
+        importer = MemberImporter()
+        queryset_class = type(TeamMember.objects.all())
+        bulk_create, validate_batch = queryset_class.bulk_create, importer.validate_batch
+        inserts = []
+
+        def fail_first_insert(queryset, members, *args, **kwargs):
+            inserts.append(len(members))
+            if len(inserts) == 1:
+                # as if another request had taken an email or phone since the batch was checked
+                raise IntegrityError('UNIQUE constraint failed')
+            return bulk_create(queryset, members, *args, **kwargs)
+
+        def take_phone_after_check(batch):
+            result = validate_batch(batch)
+            if len(inserts) == 1:
+                # and took Alan's phone again right after the batch was checked again
+                TeamMember.objects.create(
+                    first_name='Other', last_name='Member', phone='+33296283522', email='other@example.com')
+            return result
+
+        rows = ''.join(self.csv_content.splitlines(keepends=True)[:3])
+        with mock.patch.object(queryset_class, 'bulk_create', fail_first_insert), \
+                mock.patch.object(importer, 'validate_batch', take_phone_after_check):
+            result = importer.run(read_rows(StringIO(rows), 'csv'))
+        # the retry inserts the members one by one
+        self.assertEqual(inserts, [2, 1, 1])
+        self.assertEqual((result.created, result.rejected), (1, 1))
+        self.assertEqual([tuple(error) for error in result.errors], [
+            (3, 'phone', 'This phone number is already associated with a member')])
+        self.assertTrue(TeamMember.objects.filter(email='ada@example.com').exists())
+
+
+    def test_jsonl_and_command(self):
+        content = '\n'.join([
+            json.dumps({'first_name': 'Ada', 'last_name': 'Lovelace', 'email': 'ada@example.com', 'phone': '4159370001'}),
+            '',
+            'not json',
+        ])
+        importer = MemberImporter()
+        result = importer.run(read_rows(StringIO(content), 'jsonl'))
+        self.assertEqual((result.created, result.rejected), (1, 1))
+        self.assertEqual(result.errors[0].line, 3)
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write(self.csv_content.replace('ada@', 'ada2@').replace('4159370001', '4159370011'))
+        try:
+            out, err = StringIO(), StringIO()
+            call_command('import_members', f.name, stdout=out, stderr=err)
+        finally:
+            os.remove(f.name)
+        self.assertIn('7 rows read, 2 members created, 5 rows rejected.', out.getvalue())
+        self.assertIn('line 4: first_name:', err.getvalue())
+
+
+    def test_import_view(self):
+        resp = self.client.get(reverse('team_members_import'))
+        self.assertTemplateUsed(resp, 'instateam/teammembers_import.html')
+        upload = SimpleUploadedFile('members.csv', self.csv_content.encode())
+        resp = self.client.post(reverse('team_members_import'), {'file': upload})
+        self.assertContains(resp, '2 members created out of 7 rows, 5 rows rejected.')
+        self.assertContains(resp, 'line 4 (first_name)')
+        self.assertEqual(TeamMember.objects.count(), 3)
+        # unknown file type
+        upload = SimpleUploadedFile('members.xls', b'first_name')
+        resp = self.client.post(reverse('team_members_import'), {'file': upload})
+        self.assertFormError(resp, 'form', 'file', 'Unknown file format, expected a .csv or .jsonl file')
+
+
+
+class ExportTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        TeamMember.objects.create(
+            first_name='Eugenie', last_name='Le Moulec', phone='4159375555', email='eugenie@example.com')
+        TeamMember.objects.create(
+            first_name='Jean', last_name='Dupont, Jr', phone='+33296283522', email='jean@example.com', role='admin')
+
+
+    def export(self, **kwargs):
+        resp = self.client.get(reverse('team_members_export'), kwargs.pop('params', {}), **kwargs)
+        if resp.status_code != 200:
+            return resp, None
+        content = b''.join(resp.streaming_content)
+        if resp.get('Content-Encoding') == 'gzip':
+            content = gzip.decompress(content)
+        return resp, content.decode()
+
+
+    def test_formats(self):
+        resp, content = self.export()
+        self.assertEqual(resp['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(content.splitlines(), [
+            'id,first_name,last_name,email,phone,role',
+            '%s,Eugenie,Le Moulec,eugenie@example.com,+14159375555,regular' % TeamMember.objects.get(first_name='Eugenie').pk,
+            '%s,Jean,"Dupont, Jr",jean@example.com,+33296283522,admin' % TeamMember.objects.get(first_name='Jean').pk,
+        ])
+        resp, content = self.export(params={'format': 'jsonl'})
+        records = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([r['phone'] for r in records], ['+14159375555', '+33296283522'])
+        resp, content = self.export(params={'format': 'vcard'})
+        self.assertEqual(content.count('BEGIN:VCARD'), 2)
+        self.assertIn('N:Dupont\\, Jr;Jean;;;\r\n', content)
+        self.assertIn('TEL;TYPE=CELL:+33296283522\r\n', content)
+        resp, content = self.export(params={'format': 'xml'})
+        self.assertEqual(resp.status_code, 400)
+
+
+    def test_vcard_line_breaks(self):
+        # allowed by the name validators, as whitespace
+        TeamMember.objects.create(
+            first_name='Ann', last_name='Smith\r\nNOTE', phone='4159375556', email='ann@example.com')
+        resp, content = self.export(params={'format': 'vcard'})
+        self.assertIn('\r\nN:Smith\\nNOTE;Ann;;;\r\n', content)
+        self.assertIn('\r\nFN:Ann Smith\\nNOTE\r\n', content)
+        self.assertNotIn('\nNOTE', content)
+
+
+    def test_gzip(self):
+        resp, content = self.export(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(resp['Content-Encoding'], 'gzip')
+        self.assertEqual(resp['Vary'], 'Accept-Encoding')
+        self.assertEqual(len(content.splitlines()), 3)
+
+
+    def test_conditional_get(self):
+        resp, content = self.export()
+        self.assertTrue(resp.has_header('Last-Modified'))
+        resp, content = self.export(HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp.status_code, 304)
+        resp, content = self.export(HTTP_IF_MODIFIED_SINCE=resp['Last-Modified'])
+        self.assertEqual(resp.status_code, 304)
+        etag = resp['ETag']
+        # any write makes the export current again
+        TeamMember.objects.get(first_name='Jean').delete()
+        resp, content = self.export(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(content.splitlines()), 2)
+
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'members.jsonl.gz')
+            call_command('export_members', format='jsonl', output=path, gzip=True)
+            with gzip.open(path, 'rt') as f:
+                self.assertEqual(len(f.readlines()), 2)
+
+
+
+class ApiTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.member = TeamMember.objects.create(
+            first_name='Eugenie', last_name='Le Moulec', phone='4159375555', email='eugenie@example.com')
+
+
+    def send(self, method, url, data):
+        return getattr(self.client, method)(url, json.dumps(data), content_type='application/json')
+
+
+    def test_list(self):
+        for i in range(4):
+            TeamMember.objects.create(
+                first_name='Member', last_name='Number', phone='+1415937%04d' % i, email='member%s@example.com' % i)
+        resp = self.client.get(reverse('api_team_members'), {'page_size': 3, 'fields': 'id,email'})
+        data = resp.json()
+        self.assertEqual(data['results'][0], {'id': self.member.pk, 'email': 'eugenie@example.com'})
+        self.assertEqual(len(data['results']), 3)
+        self.assertIsNone(data['previous'])
+        resp = self.client.get(reverse('api_team_members'), {'page_size': 3, 'cursor': data['next']})
+        self.assertEqual(len(resp.json()['results']), 2)
+        self.assertEqual(resp.json()['results'][0]['phone'], '+14159370002')
+        resp = self.client.get(reverse('api_team_members'), {'fields': 'id,password'})
+        self.assertEqual(resp.status_code, 400)
+
+
+    def test_etag(self):
+        resp = self.client.get(reverse('api_team_members'))
+        resp2 = self.client.get(reverse('api_team_members'), HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp2.status_code, 304)
+        url = reverse('api_team_member', kwargs={'pk': self.member.pk})
+        resp = self.client.get(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=resp['ETag']).status_code, 304)
+        self.send('patch', url, {'first_name': 'Marie'})
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['first_name'], 'Marie')
+
+
+    def test_crud(self):
+        attributes = {
+            'first_name': 'Ada', 'last_name': 'Lovelace', 'email': 'ada@example.com',
+            'phone': '4159370001', 'role': 'admin'}
+        resp = self.send('post', reverse('api_team_members'), attributes)
+        self.assertEqual(resp.status_code, 201)
+        url = resp['Location']
+        self.assertEqual(self.client.get(url).json()['phone'], '+14159370001')
+        # same email and phone again
+        resp = self.send('post', reverse('api_team_members'), attributes)
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(set(resp.json()['errors']), {'email', 'phone'})
+        # full and partial updates
+        resp = self.send('put', url, dict(attributes, first_name='Augusta'))
+        self.assertEqual(resp.json()['first_name'], 'Augusta')
+        resp = self.send('put', url, {'first_name': 'Ada'})
+        self.assertEqual(resp.status_code, 400)
+        resp = self.send('patch', url, {'role': 'regular'})
+        self.assertEqual(resp.json()['role'], 'regular')
+        self.assertEqual(resp.json()['first_name'], 'Augusta')
+        resp = self.client.delete(url)
+        self.assertEqual(resp.status_code, 204)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+    def test_bad_requests(self):
+        resp = self.client.post(reverse('api_team_members'), {'first_name': 'Ada'})
+        self.assertEqual(resp.status_code, 415)
+        resp = self.client.post(reverse('api_team_members'), '{', content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
+        resp = self.send('post', reverse('api_team_members_batch'), {'delete': ['x']})
+        self.assertEqual(resp.status_code, 400)
+
+
+    def test_batch(self):
+        other = TeamMember.objects.create(
+            first_name='Other', last_name='Member', phone='4159370009', email='other@example.com')
+        batch = {
+            'upsert': [
+                {'id': self.member.pk, 'first_name': 'Marie', 'last_name': 'Le Moulec',
+                 'email': 'eugenie@example.com', 'phone': '4159375555', 'role': 'admin'},
+                {'first_name': 'Ada', 'last_name': 'Lovelace', 'email': 'ada@example.com',
+                 'phone': '4159370001', 'role': 'regular'},
+                # takes the phone of the deleted member
+                {'first_name': 'Alan', 'last_name': 'Turing', 'email': 'alan@example.com',
+                 'phone': '4159370009', 'role': 'regular'},
+            ],
+            'delete': [other.pk],
+        }
+        with self.assertNumQueries(3):
+            # lookups of the upserted members by id and by email, and the uniqueness check
+            forms, errors = api.TeamMembersBatchApi().validate(batch['upsert'], set(batch['delete']))
+        self.assertEqual((len(forms), errors), (3, {}))
+        resp = self.send('post', reverse('api_team_members_batch'), batch)
+        self.assertEqual(resp.json(), {'created': 2, 'updated': 1, 'deleted': 1})
+        self.assertEqual(TeamMember.objects.get(pk=self.member.pk).first_name, 'Marie')
+        self.assertEqual(TeamMember.objects.get(phone='+14159370009').first_name, 'Alan')
+
+        # any error rolls the whole batch back
+        batch = {
+            'upsert': [
+                {'email': 'ada@example.com', 'first_name': 'Ada', 'last_name': 'King',
+                 'phone': '4159370001', 'role': 'regular'},
+                {'first_name': 'Grace', 'last_name': 'Hopper', 'email': 'grace@example.com',
+                 'phone': '4159375555', 'role': 'regular'},
+                {'first_name': 'Bad2', 'last_name': 'Name', 'email': 'bad@example.com',
+                 'phone': '4159370003', 'role': 'regular'},
+            ],
+        }
+        resp = self.send('post', reverse('api_team_members_batch'), batch)
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json()['errors'], {
+            '1': {'phone': ['This phone number is already associated with a member']},
+            '2': {'first_name': ["A first name can contain only letters, -, ' and white spaces."]},
+        })
+        self.assertEqual(TeamMember.objects.get(email='ada@example.com').last_name, 'Lovelace')
+
+
+
+class ConditionalGetTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.member = TeamMember.objects.create(
+            first_name='Eugenie', last_name='Le Moulec', phone='4159375555', email='eugenie@example.com')
+
+
+    def test_roster_version(self):
+        version = RosterState.current().version
+        self.member.save()
+        self.assertEqual(RosterState.current().version, version + 1)
+        TeamMember.objects.bulk_create([])
+        self.assertEqual(RosterState.current().version, version + 1)
+        self.member.delete()
+        self.assertEqual(RosterState.current().version, version + 2)
+
+
+    def test_list_not_modified(self):
+        url = reverse('team_members_list')
+        resp = self.client.get(url)
+        self.assertEqual(resp['ETag'], '"v%s"' % RosterState.current().version)
+        self.assertIn('no-cache', resp['Cache-Control'])
+        # current clients are answered without touching the database
+        with self.assertNumQueries(0):
+            resp2 = self.client.get(url, HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp2.status_code, 304)
+        with self.assertNumQueries(0):
+            resp2 = self.client.get(url, HTTP_IF_MODIFIED_SINCE=resp['Last-Modified'])
+        self.assertEqual(resp2.status_code, 304)
+        self.member.first_name = 'Marie'
+        self.member.save()
+        resp2 = self.client.get(url, HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp2.status_code, 200)
+        self.assertContains(resp2, 'Marie Le Moulec')
+
+
+    def test_edit_page_not_modified(self):
+        url = reverse('team_members_update', kwargs={'pk': self.member.pk})
+        # the first visit sets the CSRF cookie
+        self.client.get(url)
+        resp = self.client.get(url)
+        with self.assertNumQueries(0):
+            resp2 = self.client.get(url, HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp2.status_code, 304)
+        # the page's CSRF token goes with the client's CSRF cookie
+        self.client.cookies['csrftoken'] = 'x' * 64
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=resp['ETag']).status_code, 200)
+        self.client.post(url, {
+            'first_name': 'Marie', 'last_name': 'Le Moulec', 'phone': '4159375555',
+            'email': 'eugenie@example.com', 'role': 'regular'})
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=resp['ETag']).status_code, 200)
+
+
+    def test_rows_are_cached_per_member_version(self):
+        url = reverse('team_members_list')
+        self.client.get(url)
+        # a change that bypasses the model isn't seen until the member's version changes
+        TeamMember.objects.filter(pk=self.member.pk).update(first_name='Marie')
+        self.assertContains(self.client.get(url), 'Eugenie Le Moulec')
+        # the other members' changes keep its row
+        TeamMember.objects.create(first_name='John', last_name='Doe', phone='4159376666', email='john@example.com')
+        resp = self.client.get(url)
+        self.assertContains(resp, 'Eugenie Le Moulec')
+        self.assertContains(resp, 'John Doe')
+        TeamMember.objects.filter(pk=self.member.pk).update(version=F('version') + 1)
+        RosterState.touch()
+        self.assertContains(self.client.get(url), 'Marie Le Moulec')
+
+
+
+class PageCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        TeamMember.objects.create(
+            first_name='Eugenie', last_name='Le Moulec', phone='4159375555', email='eugenie@example.com')
+        self.page_cache = PageCache.from_settings()
+
+
+    def test_hits_and_invalidation(self):
+        url = reverse('team_members_list')
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'miss')
+        RosterState.current()
+        with self.assertNumQueries(0):
+            resp = self.client.get(url)
+        self.assertEqual(resp['X-Page-Cache'], 'hit')
+        self.assertContains(resp, 'Eugenie Le Moulec')
+        self.assertEqual(resp['ETag'], '"v%s"' % RosterState.current().version)
+        TeamMember.objects.update(first_name='Marie', version=F('version') + 1)
+        RosterState.touch()
+        resp = self.client.get(url)
+        self.assertEqual(resp['X-Page-Cache'], 'miss')
+        self.assertContains(resp, 'Marie Le Moulec')
+        stats = self.page_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['rebuilds']), (1, 2, 2))
+
+
+    def test_stale_while_revalidate(self):
+        url = reverse('team_members_list')
+        resp = self.client.get(url)
+        old_etag = resp['ETag']
+        TeamMember.objects.update(first_name='Marie')
+        RosterState.touch()
+        # another worker holds the rebuild lock
+        self.page_cache.cache.add(self.page_cache.page_key(resp.wsgi_request) + ':lock', 1)
+        resp = self.client.get(url)
+        self.assertEqual(resp['X-Page-Cache'], 'stale')
+        self.assertContains(resp, 'Eugenie Le Moulec')
+        # the stale page comes with its own validators
+        self.assertEqual(resp['ETag'], old_etag)
+        self.assertEqual(self.page_cache.stats()['stale_hits'], 1)
+
+
+    @override_settings(INSTATEAM_PAGE_CACHE_WAIT=0)
+    def test_single_flight(self):
+        url = reverse('team_members_list')
+        resp = self.client.get(url)
+        renders = []
+        render = lambda: renders.append(1) or HttpResponse('page')
+        key = self.page_cache.page_key(resp.wsgi_request)
+        self.page_cache.cache.add(key + ':lock', 1)
+        page_cache = PageCache.from_settings()
+        state = RosterVersion(RosterState.current().version + 1, None)
+        # stale copy and the lock taken: served without rendering
+        self.assertEqual(page_cache.respond(resp.wsgi_request, render, state)['X-Page-Cache'], 'stale')
+        self.assertEqual(renders, [])
+        # no copy at all: renders it once the wait is over
+        page_cache.cache.delete(key)
+        self.assertEqual(page_cache.respond(resp.wsgi_request, render, state).content, b'page')
+        self.assertEqual(renders, [1])
+
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                           'LOCATION': tempfile.gettempdir() + '/instateam-test-cache'}})
+    def test_file_based_backend(self):
+        cache.clear()
+        url = reverse('team_members_list')
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'miss')
+        resp = self.client.get(url)
+        self.assertEqual(resp['X-Page-Cache'], 'hit')
+        self.assertContains(resp, 'Eugenie Le Moulec')
+        cache.clear()
+
+
+
+class DatabaseBackendTestCase(TestCase):
+
+    def test_sqlite_pragmas(self):
+        with tempfile.TemporaryDirectory() as directory:
+            settings_dict = dict(connection.settings_dict, NAME=os.path.join(directory, 'db.sqlite3'),
+                                 PRAGMAS={'cache_size': -1000})
+            wrapper = SQLiteDatabaseWrapper(settings_dict, alias='pragmas')
+            try:
+                with wrapper.cursor() as cursor:
+                    pragmas = {}
+                    for name in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size'):
+                        cursor.execute('PRAGMA %s' % name)
+                        pragmas[name] = cursor.fetchone()[0]
+            finally:
+                wrapper.close()
+        self.assertEqual(pragmas, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000, 'cache_size': -1000})
+
+
+    def test_connection_pool(self):
+
+        class Connection:
+            alive = True
+            closed = False
+
+            def close(self):
+                self.closed = True
+
+        pool = ConnectionPool(2, timeout=0.01)
+        first, second = pool.acquire(Connection), pool.acquire(Connection)
+        with self.assertRaises(PoolExhausted):
+            pool.acquire(Connection)
+        pool.release(first)
+        self.assertIs(pool.acquire(Connection), first)
+        # broken connections are discarded, on release or when checked before reuse
+        pool.release(first, discard=True)
+        self.assertTrue(first.closed)
+        second.alive = False
+        pool.release(second)
+        third = pool.acquire(Connection, check=lambda connection: connection.alive)
+        self.assertIsNot(third, second)
+        self.assertTrue(second.closed)
+
+
+
+class AsgiTestCase(TransactionTestCase):
+    "The ASGI application runs the views in its own threads, which can't see a TestCase's transaction."
+    # the roles created by the migrations, which each test's flush deletes
+    serialized_rollback = True
+
+    def setUp(self):
+        cache.clear()
+        self.application = AsgiHandler(get_wsgi_application(), threads=2)
+
+
+    def tearDown(self):
+        self.application.executor.shutdown()
+
+
+    def request(self, method, path, query_string=b'', body_parts=(b'',), headers=()):
+        scope = {
+            'type': 'http', 'method': method, 'path': path, 'query_string': query_string,
+            'headers': [(b'host', b'testserver')] + list(headers),
+        }
+        received = [{'type': 'http.request', 'body': part, 'more_body': i < len(body_parts) - 1}
+                    for i, part in enumerate(body_parts)]
+        sent = []
+
+        async def receive():
+            return received.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(self.application(scope, receive, send))
+        return sent[0]['status'], dict(sent[0]['headers']), b''.join(message.get('body', b'') for message in sent[1:])
+
+
+    def test_requests(self):
+        body = json.dumps({
+            'first_name': 'Ada', 'last_name': 'Lovelace', 'email': 'ada@example.com', 'phone': '4159370001',
+            'role': 'admin'}).encode()
+        # a body sent in several messages
+        status, headers, content = self.request(
+            'POST', '/api/teammembers', body_parts=(body[:10], body[10:]),
+            headers=[(b'content-type', b'application/json')])
+        self.assertEqual(status, 201)
+        status, headers, content = self.request('GET', '/api/teammembers', b'fields=email')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(content.decode())['results'], [{'email': 'ada@example.com'}])
+        status, headers, content = self.request('GET', '/teammembers/', headers=[(b'if-none-match', headers[b'etag'])])
+        self.assertEqual(status, 304)
+
+
+    def test_streaming_response(self):
+        TeamMember.objects.create(first_name='Ada', last_name='Lovelace', email='ada@example.com', phone='4159370001')
+        status, headers, content = self.request('GET', '/teammembers/export', b'format=jsonl')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'content-type'], b'application/x-ndjson; charset=utf-8')
+        self.assertEqual(json.loads(content.decode())['email'], 'ada@example.com')
+
+
+
+class RequestMetricsTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        metrics.REGISTRY.clear()
+        TeamMember.objects.create(
+            first_name='Eugenie', last_name='Le Moulec', phone='4159375555', email='eugenie@example.com')
+
+
+    def test_histograms(self):
+        self.client.get(reverse('team_members_list'))
+        self.client.get(reverse('team_members_list'))
+        buckets, counts, total, count = metrics.REQUEST_DURATION.samples(('team_members_list', 'GET', '200'))
+        self.assertEqual(count, 2)
+        # the second request is served by the page cache
+        buckets, counts, total, count = metrics.DB_QUERIES.samples(('team_members_list',))
+        self.assertEqual((count, total), (2, 2))
+        self.assertEqual(counts[buckets.index(0)], 1)
+        self.assertEqual(metrics.TEMPLATE_DURATION.samples(('team_members_list',))[3], 1)
+        resp = self.client.get(reverse('metrics'))
+        self.assertEqual(resp['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertContains(
+            resp, 'instateam_request_duration_seconds_count{view="team_members_list",method="GET",status="200"} 2')
+        self.assertContains(resp, 'instateam_request_db_queries_bucket{view="team_members_list",le="0"} 1')
+        self.assertContains(resp, 'instateam_request_db_queries_bucket{view="team_members_list",le="+Inf"} 2')
+
+
+    def test_streaming_response_size(self):
+        resp = self.client.get(reverse('team_members_export'), {'format': 'jsonl'})
+        size = len(b''.join(resp.streaming_content))
+        buckets, counts, total, count = metrics.RESPONSE_SIZE.samples(('team_members_export',))
+        self.assertEqual((count, total), (1, size))
+        # the queries run while streaming count too
+        self.assertGreaterEqual(metrics.DB_QUERIES.samples(('team_members_export',))[2], 1)
+
+
+    @override_settings(INSTATEAM_SERVER_TIMING=True)
+    def test_server_timing(self):
+        resp = self.client.get(reverse('team_members_update', kwargs={'pk': TeamMember.objects.get().pk}))
+        self.assertRegex(resp['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, total;dur=[\d.]+$')
+        self.assertNotIn('Server-Timing', self.client.get(reverse('team_members_export'), {'format': 'csv'}))
+
+
+    @override_settings(INSTATEAM_SLOW_REQUEST_MS=0)
+    def test_slow_request_log(self):
+        with self.assertLogs('instateam.slow_requests', 'WARNING') as logs:
+            self.client.get(reverse('team_members_search'), {'q': 'eug'})
+        self.assertIn('GET /teammembers/search?q=eug (team_members_search)', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+
+
+class BenchmarkComparisonTestCase(TestCase):
+
+    def test_compare_results(self):
+        baseline = {'1000': {'list_render': {'p50': 10.0, 'p95': 20.0}, 'delete_post': {'p50': 2.0}}}
+        current = {
+            '1000': {'list_render': {'p50': 11.9, 'p95': 24.1}, 'delete_post': {'p50': 1.0}, 'new': {'p50': 1.0}},
+            '10000': {'list_render': {'p50': 50.0}},
+        }
+        self.assertEqual(bench.compare_results(baseline, current, threshold=0.2), [
+            ('1000', 'delete_post', 'p50', 2.0, 1.0, False),
+            ('1000', 'list_render', 'p50', 10.0, 11.9, False),
+            ('1000', 'list_render', 'p95', 20.0, 24.1, True),
+        ])
+
+
+
+class ValidationTestCase(TestCase):
+
+    def setUp(self):
+        self.member = TeamMember.objects.create(
+            first_name='Eugenie', last_name='Le Moulec', phone='4159375555', email='eugenie@example.com')
+
+
+    def test_form_checks_uniqueness_with_one_query(self):
+        form = TeamMemberForm(data={
+            'first_name': 'Marie', 'last_name': 'Curie', 'email': 'eugenie@example.com',
+            'phone': '+1 415-937-5555', 'role': 'regular'})
+        with self.assertNumQueries(1):
+            self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors['email'], ['Team member with this Email already exists.'])
+        self.assertEqual(form.errors['phone'], ['This phone number is already associated with a member'])
+        # the member itself can keep its email and phone
+        form = TeamMemberForm(instance=self.member, data={
+            'first_name': 'Marie', 'last_name': 'Le Moulec', 'email': 'eugenie@example.com',
+            'phone': '4159375555', 'role': 'admin'})
+        self.assertTrue(form.is_valid())
+
+
+    def test_validate_many(self):
+        members = [
+            TeamMember(first_name='Ada', last_name='Lovelace', email='ada@example.com', phone='4159370001'),
+            TeamMember(first_name='Ada 2', last_name='Lovelace', email='ada2@example.com', phone='4159370002'),
+            TeamMember(first_name='Grace', last_name='Hopper', email='ada@example.com', phone='4159370003'),
+            TeamMember(first_name='Alan', last_name='Turing', email='alan@example.com', phone='+14159375555'),
+            TeamMember(first_name='Jean', last_name='Dupont', email='jean@example.com', phone='123'),
+        ]
+        with self.assertNumQueries(1):
+            errors = validation.validate_many(members)
+        self.assertEqual(errors, [
+            {},
+            {'first_name': ["A first name can contain only letters, -, ' and white spaces."]},
+            {'email': ['Team member with this Email already exists.']},
+            {'phone': ['This phone number is already associated with a member']},
+            {'phone': ['The phone number entered is not valid.']},
+        ])
+        # unless they're being deleted
+        self.assertEqual(validation.validate_many(members[3:4], exclude_pks=[self.member.pk]), [{}])
+
+
+
+class PhoneServiceTestCase(TestCase):
+
+    def setUp(self):
+        phones.clear()
+
+
+    def test_parsing_and_checks_are_cached(self):
+        self.assertIs(phones.parse('415 937 0001'), phones.parse('415 937 0001'))
+        self.assertTrue(phones.is_valid(phones.parse('415 937 0001')))
+        self.assertFalse(phones.is_valid(phones.parse('+1 415 000 0000')))
+        self.assertEqual(phones.parse(''), '')
+        self.assertEqual(phones.stats()['parse'], {'size': 2, 'maxsize': phones.CACHE_SIZE, 'hits': 2, 'misses': 2, 'hit_rate': 0.5})
+
+
+    def test_members_read_from_the_database_share_their_phones(self):
+        TeamMember.objects.create(first_name='Eugenie', last_name='Le Moulec', phone='4159375555', email='eugenie@example.com')
+        first, second = TeamMember.objects.get(), TeamMember.objects.get()
+        self.assertIs(first.phone, second.phone)
+        self.assertEqual(first.formatted_phone_national(), '(415) 937-5555')
+
+
+    def test_format_many(self):
+        numbers = [phones.parse(number) for number in ('4159375555', '+33296283522', '4159375555', 'not a phone')]
+        self.assertEqual(phones.format_many(numbers, phonenumbers.PhoneNumberFormat.NATIONAL),
+                         ['(415) 937-5555', '02 96 28 35 22', '(415) 937-5555',
+                          phonenumbers.format_number(numbers[3], phonenumbers.PhoneNumberFormat.NATIONAL)])
+        self.assertEqual(phones.FORMATTED.stats()['misses'], 2)
+        self.assertEqual(phones.format_number(numbers[1], phonenumbers.PhoneNumberFormat.NATIONAL), '02 96 28 35 22')
+        self.assertEqual(phones.FORMATTED.stats()['hits'], 1)
+
+
+    def test_lru_eviction(self):
+        lru = phones.LRUCache('test', maxsize=2)
+        lru.get('a', lambda: 1)
+        lru.get('b', lambda: 2)
+        lru.get('a', lambda: None)
+        lru.get('c', lambda: 3)
+        self.assertEqual(list(lru.entries), ['a', 'c'])
+        self.assertEqual(lru.get_many(['a', 'b', 'c'], lambda key: key * 2), [1, 'bb', 3])
+        self.assertEqual(list(lru.entries), ['c', 'b'])
+
+
+    def test_metrics(self):
+        phones.parse('4159375555')
+        resp = self.client.get(reverse('metrics'))
+        self.assertContains(resp, 'instateam_phone_cache_misses_total{cache="parse"} 1')
+        self.assertContains(resp, '# TYPE instateam_phone_cache_entries gauge')
+
+
+
+class WarmupTestCase(TestCase):
+
+    @override_settings(TEMPLATES=[{
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'OPTIONS': {'loaders': [('django.template.loaders.cached.Loader', [
+            'django.template.loaders.app_directories.Loader'])]},
+    }])
+    def test_templates_are_compiled(self):
+        self.assertIn('instateam/teammembers_list.html', list(warmup.app_templates()))
+        with self.assertNumQueries(0):
+            steps = warmup.warm_up()
+        self.assertEqual([step for step, seconds in steps], ['templates', 'urls', 'phones'])
+        cached = engines['django'].engine.template_loaders[0].get_template_cache
+        self.assertIn('instateam/teammembers_rows.html', cached)
+
+
+    def test_command(self):
+        out = StringIO()
+        call_command('warmup', stdout=out)
+        self.assertIn('templates', out.getvalue())
+
+
+
+class StaticAssetsTestCase(TestCase):
+
+    def test_minify_css(self):
+        css = '/* comment */\na :hover,\nb > i {\n    color: red;\n    margin: 0 auto;\n}\n'
+        self.assertEqual(assets.minify_css(css), 'a :hover,b>i{color:red;margin:0 auto}')
+
+
+    def test_pages_need_no_external_assets(self):
+        TeamMember.objects.create(first_name='Eugenie', last_name='Le Moulec', phone='4159375555', email='eugenie@example.com')
+        resp = self.client.get(reverse('team_members_list'))
+        self.assertNotContains(resp, 'https://')
+        self.assertContains(resp, '/static/instateam/icons.svg#user')
+
+
+    def test_collect_and_serve(self):
+        with tempfile.TemporaryDirectory() as root, override_settings(
+                STATIC_ROOT=root, STATICFILES_STORAGE='instateam.assets.CompressedManifestStaticFilesStorage'):
+            call_command('collectstatic', interactive=False, verbosity=0, ignore_patterns=['admin'])
+            with open(os.path.join(root, 'staticfiles.json')) as f:
+                hashed = json.load(f)['paths']['instateam/main.css']
+            self.assertRegex(hashed, r'^instateam/main\.[0-9a-f]{12}\.css$')
+            with open(os.path.join(root, hashed), 'rb') as f:
+                minified = f.read()
+            self.assertNotIn(b'\n', minified)
+            with open(os.path.join(root, hashed + '.gz'), 'rb') as f:
+                self.assertEqual(gzip.decompress(f.read()), minified)
+
+            inner = []
+            application = assets.StaticFilesApplication(
+                lambda environ, start_response: inner.append(environ['PATH_INFO']) or [], root, '/static/')
+
+            def get(path, **headers):
+                environ = dict(headers, REQUEST_METHOD='GET', PATH_INFO=path)
+                started = []
+                body = b''.join(application(environ, lambda status, headers: started.extend([status, dict(headers)])))
+                return started[0], started[1], body
+
+            status, headers, body = get('/static/' + hashed, HTTP_ACCEPT_ENCODING='gzip, deflate')
+            self.assertEqual(status, '200 OK')
+            self.assertEqual(headers['Content-Encoding'], 'gzip')
+            self.assertEqual(headers['Cache-Control'], 'public, max-age=31536000, immutable')
+            self.assertEqual(headers['Content-Type'], 'text/css; charset=utf-8')
+            self.assertEqual(gzip.decompress(body), minified)
+            status, headers, body = get('/static/' + hashed, HTTP_IF_NONE_MATCH=headers['ETag'], HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual((status, body), ('304 Not Modified', b''))
+            status, headers, body = get('/static/instateam/main.css', HTTP_ACCEPT_ENCODING='gzip;q=0')
+            self.assertEqual((status, body), ('200 OK', minified))
+            self.assertEqual(headers['Cache-Control'], 'public, max-age=60')
+            self.assertEqual(get('/static/instateam/missing.css')[0], '404 Not Found')
+            application({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/teammembers/'}, None)
+            self.assertEqual(inner, ['/teammembers/'])
+
+
+
+class DeleteTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        for i in range(6):
+            TeamMember.objects.create(
+                first_name='Member', last_name='Number', phone='+1415937%04d' % i,
+                email='member%s@%s.com' % (i, 'example' if i % 2 else 'other'), role='admin' if i < 2 else 'regular')
+        self.pks = list(TeamMember.objects.order_by('pk').values_list('pk', flat=True))
+
+
+    def send(self, data):
+        return self.client.post(reverse('api_team_members_bulk_delete'), json.dumps(data), content_type='application/json')
+
+
+    @override_settings(INSTATEAM_SOFT_DELETE=True)
+    def test_soft_delete(self):
+        member = TeamMember.objects.get(pk=self.pks[0])
+        resp = self.client.post(reverse('team_members_delete', kwargs={'pk': member.pk}))
+        self.assertRedirects(resp, reverse('team_members_list'))
+        self.assertFalse(TeamMember.objects.filter(pk=member.pk).exists())
+        self.assertIsNotNone(TeamMember.all_objects.get(pk=member.pk).deleted_at)
+        self.assertEqual(self.client.get(reverse('team_members_update', kwargs={'pk': member.pk})).status_code, 404)
+        self.assertNotContains(self.client.get(reverse('team_members_list')), 'member0@other.com')
+        self.assertEqual(search.search_members('member0'), [])
+        # its email and phone can be taken again
+        form = TeamMemberForm(data={
+            'first_name': 'New', 'last_name': 'Member', 'email': 'member0@other.com', 'phone': '+14159370000', 'role': 'regular'})
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        self.assertEqual(TeamMember.all_objects.filter(email='member0@other.com').count(), 2)
+
+
+    def test_hard_delete_by_default(self):
+        TeamMember.objects.get(pk=self.pks[0]).delete()
+        self.assertFalse(TeamMember.all_objects.filter(pk=self.pks[0]).exists())
+
+
+    def test_bulk_delete_by_ids(self):
+        resp = self.send({'ids': self.pks[:3] + [999]})
+        self.assertEqual(resp.json(), {'deleted': 3, 'soft': False})
+        self.assertEqual(TeamMember.all_objects.count(), 3)
+        self.assertEqual(search.search_members('member1'), [])
+
+
+    @override_settings(INSTATEAM_SOFT_DELETE=True)
+    def test_bulk_delete_by_filter(self):
+        resp = self.send({'filter': {'role': 'regular', 'email_domain': 'example.com'}, 'dry_run': True})
+        self.assertEqual(resp.json(), {'deleted': 0, 'matching': 2})
+        resp = self.send({'filter': {'role': 'regular', 'email_domain': 'example.com'}})
+        self.assertEqual(resp.json(), {'deleted': 2, 'soft': True})
+        self.assertEqual(TeamMember.objects.count(), 4)
+        self.assertEqual(TeamMember.all_objects.count(), 6)
+        for data in ({}, {'filter': {}}, {'filter': {'phone': '+1'}}, {'filter': {'role': ''}}, {'ids': ['1']},
+                     {'ids': [1], 'filter': {'role': 'admin'}}):
+            self.assertEqual(self.send(data).status_code, 400, data)
+
+
+    def test_bulk_delete_statements_per_batch(self):
+        "Each batch is deleted with the same statements, whatever its size"
+        queries = []
+        for batch in (self.pks[:1], self.pks[1:6]):
+            with CaptureQueriesContext(connection) as context:
+                TeamMember.objects.filter(pk__in=batch).bulk_delete()
+            queries.append(len(context))
+        self.assertEqual(queries[0], queries[1])
+        # a query for the pks, then the same statements for every batch
+        for i in range(3):
+            TeamMember.objects.create(first_name='A', last_name='B', phone='+1415937100%s' % i, email='%s@b.com' % i)
+        with self.assertNumQueries(1 + 3 * (queries[0] - 1)):
+            TeamMember.objects.filter(email__endswith='@b.com').bulk_delete(batch_size=1)
+
+
+    @override_settings(INSTATEAM_SOFT_DELETE=True)
+    def test_purge(self):
+        TeamMember.objects.filter(pk__in=self.pks[:4]).bulk_delete()
+        TeamMember.all_objects.filter(pk__in=self.pks[:3]).update(deleted_at=timezone.now() - timedelta(days=40))
+        out = StringIO()
+        call_command('purge_members', batch_size=2, stdout=out)
+        self.assertIn('Done, 3 rows purged.', out.getvalue())
+        self.assertEqual(sorted(TeamMember.all_objects.values_list('pk', flat=True)), self.pks[3:])
+        with connection.cursor() as cursor:
+            sql, params = (TeamMember.all_objects.filter(deleted_at__lt=timezone.now())
+                           .order_by('deleted_at').values('pk').query.sql_with_params())
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            self.assertIn('teammember_deleted_at_idx', ' '.join(str(row) for row in cursor.fetchall()))
+
+
+class ChangeFeedTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.member = TeamMember.objects.create(
+            first_name='First', last_name='Member', phone='+14159370000', email='first@example.com')
+
+
+    def changes(self, cursor=None, **params):
+        if cursor is not None:
+            params['cursor'] = cursor
+        return self.client.get(reverse('api_team_member_changes'), params)
+
+
+    def test_every_write_path_is_recorded(self):
+        cursor = self.changes().json()['cursor']
+        self.client.post(reverse('team_members_update', kwargs={'pk': self.member.pk}), {
+            'first_name': 'Renamed', 'last_name': 'Member', 'phone': '4159370000', 'email': 'first@example.com',
+            'role': 'regular'})
+        self.client.post(reverse('api_team_members_batch'), json.dumps({'upsert': [
+            {'first_name': 'Batch', 'last_name': 'Member', 'phone': '+14159370001', 'email': 'batch@example.com',
+             'role': 'regular'},
+        ]}), content_type='application/json')
+        batch_pk = TeamMember.objects.get(email='batch@example.com').pk
+        self.client.delete(reverse('api_team_member', kwargs={'pk': self.member.pk}))
+        self.client.post(reverse('api_team_members_bulk_delete'), json.dumps({'ids': [batch_pk]}),
+                         content_type='application/json')
+
+        data = self.changes(cursor).json()
+        self.assertEqual([(change['action'], change['id']) for change in data['changes']], [
+            ('update', self.member.pk), ('create', batch_pk), ('delete', self.member.pk), ('delete', batch_pk)])
+        self.assertEqual(data['changes'][0]['member']['first_name'], 'Renamed')
+        self.assertEqual(data['changes'][1]['member']['phone'], '+14159370001')
+        self.assertIsNone(data['changes'][2]['member'])
+        self.assertEqual(data['cursor'], data['changes'][-1]['cursor'])
+        self.assertEqual(self.changes(data['cursor']).json(), {'changes': [], 'cursor': data['cursor'], 'more': False})
+
+
+    def test_rolled_back_changes_are_not_recorded(self):
+        count = MemberChange.objects.count()
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                TeamMember.objects.bulk_create([TeamMember(
+                    first_name='Rolled', last_name='Back', phone='+14159370002', email='rolled@example.com')])
+                raise RuntimeError
+        self.assertEqual(MemberChange.objects.count(), count)
+
+
+    def test_backfill_is_not_recorded(self):
+        count = MemberChange.objects.count()
+        TeamMember.objects.bulk_update([self.member], ['phone_national'])
+        self.member.save(update_fields=['full_name_sort'])
+        self.assertEqual(MemberChange.objects.count(), count)
+
+
+    def test_pages(self):
+        for i in range(1, 5):
+            TeamMember.objects.create(first_name='Other', last_name='Member', phone='+1415937000%s' % i,
+                                      email='other%s@example.com' % i)
+        data = self.changes(0, page_size=3).json()
+        self.assertEqual(len(data['changes']), 3)
+        self.assertTrue(data['more'])
+        data = self.changes(data['cursor'], page_size=3).json()
+        self.assertEqual(len(data['changes']), 2)
+        self.assertFalse(data['more'])
+        self.assertEqual(self.changes('nope').status_code, 400)
+
+
+    def test_compaction(self):
+        old = MemberChange.objects.get()
+        MemberChange.objects.filter(pk=old.pk).update(changed_at=timezone.now() - timedelta(days=30))
+        self.member.last_name = 'Renamed'
+        self.member.save()
+        out = StringIO()
+        call_command('compact_changes', '--days', '7', stdout=out)
+        self.assertIn('Done, 1 changes deleted.', out.getvalue())
+        self.assertEqual(self.changes(0).status_code, 410)
+        data = self.changes(old.pk).json()
+        self.assertEqual([change['member']['last_name'] for change in data['changes']], ['Renamed'])
+
+
+class ConcurrentUpdateTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.member = TeamMember.objects.create(
+            first_name='First', last_name='Member', phone='+14159370000', email='first@example.com')
+        self.data = {'first_name': 'First', 'last_name': 'Member', 'phone': '+14159370000',
+                     'email': 'first@example.com', 'role': 'regular'}
+
+
+    def test_save_compares_and_swaps(self):
+        first, second = TeamMember.objects.get(), TeamMember.objects.get()
+        first.last_name = 'Renamed'
+        first.save()
+        self.assertEqual(first.version, 2)
+        second.first_name = 'Lost'
+        with self.assertRaises(ConcurrentUpdate):
+            second.save()
+        self.assertEqual(second.version, 1)
+        self.assertEqual(TeamMember.objects.values_list('first_name', 'last_name', 'version').get(),
+                         ('First', 'Renamed', 2))
+        # nor is a member deleted meanwhile inserted again
+        TeamMember.objects.all().delete()
+        with self.assertRaises(ConcurrentUpdate):
+            first.save()
+        self.assertFalse(TeamMember.all_objects.exists())
+
+
+    def test_edit_form_conflict(self):
+        url = reverse('team_members_update', kwargs={'pk': self.member.pk})
+        self.assertContains(self.client.get(url), 'name="version" value="1"')
+        TeamMember.objects.filter(pk=self.member.pk).update(version=2)
+        resp = self.client.post(url, dict(self.data, first_name='Stale', version=1))
+        self.assertContains(resp, 'Someone else changed this team member', status_code=409)
+        self.assertContains(resp, 'name="version" value="2"', status_code=409)
+        self.assertEqual(TeamMember.objects.get().first_name, 'First')
+        resp = self.client.post(url, dict(self.data, first_name='Again', version=2))
+        self.assertRedirects(resp, reverse('team_members_list'))
+        self.assertEqual(TeamMember.objects.values_list('first_name', 'version').get(), ('Again', 3))
+
+
+    def test_api_conflict(self):
+        url = reverse('api_team_member', kwargs={'pk': self.member.pk})
+        self.assertEqual(self.client.get(url).json()['version'], 1)
+        resp = self.client.patch(url, json.dumps({'role': 'admin', 'version': 1}), content_type='application/json')
+        self.assertEqual(resp.json()['version'], 2)
+        resp = self.client.put(url, json.dumps(dict(self.data, version=1)), content_type='application/json')
+        self.assertEqual(resp.status_code, 409)
+        # without a version, the one read by the request is checked
+        resp = self.client.patch(url, json.dumps({'first_name': 'Other'}), content_type='application/json')
+        self.assertEqual(resp.json()['version'], 3)
+
+
+    def test_batch_upserts_a_member_once(self):
+        for key in ({'id': self.member.pk}, {}):
+            resp = self.client.post(reverse('api_team_members_batch'), json.dumps({'upsert': [
+                dict(self.data, first_name='One', **key), dict(self.data, first_name='Two', **key),
+            ]}), content_type='application/json')
+            self.assertEqual(resp.status_code, 400)
+            self.assertIn('only once', resp.json()['error'])
+        self.assertFalse(TeamMember.objects.filter(first_name__in=['One', 'Two']).exists())
+
+
+    def test_batch_conflict_rolls_back(self):
+        other = TeamMember.objects.create(
+            first_name='Other', last_name='Member', phone='+14159370001', email='other@example.com')
+        TeamMember.objects.filter(pk=other.pk).update(version=5)
+        resp = self.client.post(reverse('api_team_members_batch'), json.dumps({'upsert': [
+            dict(self.data, id=self.member.pk, first_name='Batch', version=1),
+            {'id': other.pk, 'first_name': 'Batch', 'last_name': 'Member', 'phone': '+14159370001',
+             'email': 'other@example.com', 'role': 'regular', 'version': 4},
+        ]}), content_type='application/json')
+        self.assertEqual(resp.status_code, 409)
+        self.assertFalse(TeamMember.objects.filter(first_name='Batch').exists())
+        members = list(TeamMember.objects.order_by('pk'))
+        members[1].version = 5
+        for member in members:
+            member.first_name = 'Batch'
+        TeamMember.objects.bulk_update(members, ['first_name'])
+        self.assertEqual(list(TeamMember.objects.order_by('pk').values_list('first_name', 'version')),
+                         [('Batch', 2), ('Batch', 6)])
+
+
+@override_settings(INSTATEAM_PAGE_CACHE=None)
+class ListFilterTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        for i, (first_name, last_name, email, role) in enumerate([
+                ('John', 'Smith', 'john@example.com', 'admin'),
+                ('Joan', 'Smithers', 'joan@example.com', 'admin'),
+                ('Jo', 'Smit', 'jo@example.com', 'regular'),
+                ('Alice', 'Smile', 'josh@example.com', 'regular'),
+                ('Bob', 'Jones', 'bob@example.com', 'regular')]):
+            TeamMember.objects.create(first_name=first_name, last_name=last_name, email=email, role=role,
+                                      phone='+1415937000%s' % i)
+
+
+    def names(self, **params):
+        resp = self.client.get(reverse('team_members_list'), params)
+        return [member.first_name for member in resp.context_data['object_list']]
+
+
+    def test_filters_and_sorts(self):
+        self.assertEqual(self.names(), ['Bob', 'Alice', 'Jo', 'John', 'Joan'])
+        self.assertEqual(self.names(sort='first_name'), ['Alice', 'Bob', 'Jo', 'Joan', 'John'])
+        self.assertEqual(self.names(sort='email'), ['Bob', 'Jo', 'Joan', 'John', 'Alice'])
+        self.assertEqual(self.names(role='admin'), ['John', 'Joan'])
+        self.assertEqual(self.names(name='SMITH'), ['John', 'Joan'])
+        self.assertEqual(self.names(name='smith j'), ['John'])
+        self.assertEqual(self.names(email='jo', sort='email'), ['Jo', 'Joan', 'John', 'Alice'])
+        self.assertEqual(self.names(email='jo', role='regular', name='smi'), ['Alice', 'Jo'])
+        self.assertEqual(self.client.get(reverse('team_members_list'), {'role': 'owner'}).status_code, 404)
+        self.assertEqual(self.client.get(reverse('team_members_list'), {'sort': 'phone'}).status_code, 404)
+
+
+    def test_pager_keeps_the_filters(self):
+        resp = self.client.get(reverse('team_members_list'), {'role': 'regular', 'sort': 'email', 'page_size': 2})
+        self.assertContains(resp, '3 team members match.')
+        page = resp.context_data['page_obj']
+        self.assertContains(resp, '?cursor=%s&amp;role=regular&amp;sort=email&amp;page_size=2' % page.next_cursor)
+        resp = self.client.get(reverse('team_members_list'), {
+            'role': 'regular', 'sort': 'email', 'page_size': 2, 'cursor': page.next_cursor})
+        self.assertEqual([member.first_name for member in resp.context_data['object_list']], ['Alice'])
+
+
+    def test_every_combination_uses_an_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN is SQLite specific')
+        declared = {index.name for index in TeamMember._meta.indexes}
+        declared.update(constraint.name for constraint in TeamMember._meta.constraints)
+        for role, name, email, sort in itertools.product(
+                ('', 'admin', 'regular'), ('', 'smi'), ('', 'jo'), views.LIST_SORTS):
+            params = {'role': role, 'name': name, 'email': email, 'sort': sort, 'page_size': 1}
+            filtered = bool(role or name or email)
+            with CaptureQueriesContext(connection) as first:
+                resp = self.client.get(reverse('team_members_list'), params)
+            with CaptureQueriesContext(connection) as after:
+                self.client.get(reverse('team_members_list'), dict(params, cursor=resp.context_data['page_obj'].next_cursor))
+            # each page and its count
+            queries = [(query['sql'], filtered) for query in first.captured_queries] + \
+                      [(query['sql'], filtered or 'COUNT(' not in query['sql']) for query in after.captured_queries]
+            queries = [(sql, bounded) for sql, bounded in queries if 'FROM "instateam_teammember"' in sql]
+            self.assertEqual(len(queries), 4, queries)
+            for sql, bounded in queries:
+                with connection.cursor() as cursor:
+                    cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                    plan = ' | '.join(row[-1] for row in cursor.fetchall())
+                self.assertIsNone(re.search(r'SCAN (TABLE )?instateam_teammember(?! USING)', plan), (params, plan))
+                self.assertTrue(set(re.findall(r'INDEX (\w+)', plan)) <= declared, (params, plan))
+                if bounded or 'TEMP B-TREE' in plan:
+                    # only the first page and count of the whole roster may walk an index from its
+                    # start, and only in order: sorting every member would be a full scan too
+                    self.assertIn('SEARCH', plan, (params, plan))
+
+
+
+class RoleTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = TeamMember.objects.create(
+            first_name='Ada', last_name='Admin', email='ada@example.com', phone='4159370001', role='admin')
+        self.regular = TeamMember.objects.create(
+            first_name='Reg', last_name='Ular', email='reg@example.com', phone='4159370002')
+        User.objects.create_user('ada', 'ada@example.com', 'password')
+        User.objects.create_user('reg', 'reg@example.com', 'password')
+
+
+    def test_roles_are_read_once(self):
+        Role.forget_table()
+        with self.assertNumQueries(1):
+            self.assertEqual(Role.names(), ['regular', 'admin'])
+        members = list(TeamMember.objects.order_by('pk'))
+        with self.assertNumQueries(0):
+            self.assertEqual([member.role.name for member in members], ['admin', 'regular'])
+            self.assertEqual([member.is_admin() for member in members], [True, False])
+            self.assertEqual(validation.clean_fields(members[0]), {})
+            members[1].role_id = 9
+            self.assertEqual(list(validation.clean_fields(members[1])), ['role'])
+        with self.assertRaises(ValueError):
+            members[1].role = 'owner'
+        # saving a role has the table read again
+        self.addCleanup(Role.forget_table)
+        Role.objects.create(id=3, name='manager', label='Manager')
+        self.assertEqual(Role.names(), ['regular', 'admin', 'manager'])
+
+
+    def test_roles_changed_by_another_process(self):
+        self.addCleanup(Role.forget_table)
+        Role.names()
+        # what the other process's Role.roles_changed() leaves in the shared cache, along with its change
+        Role.objects.filter(pk=Role.ADMIN).update(label='Administrator')
+        cache.set(Role.VERSION_CACHE_KEY, 'changed elsewhere')
+        self.assertEqual(Role.cached(Role.ADMIN).label, 'Admin - Can delete members')
+        self.client.get(reverse('team_members_list'))
+        self.assertEqual(Role.cached(Role.ADMIN).label, 'Administrator')
+        # with a cache of its own, a process reads the table again once it's too old
+        Role.objects.filter(pk=Role.ADMIN).update(label='Admin')
+        with override_settings(INSTATEAM_ROLE_TABLE_TIMEOUT=0):
+            Role.check_table()
+        self.assertEqual(Role.cached(Role.ADMIN).label, 'Admin')
+
+
+    def test_form_and_api_use_role_names(self):
+        form = TeamMemberForm(instance=self.admin)
+        self.assertEqual(form.initial['role'], 'admin')
+        self.assertIn(('admin', 'Admin - Can delete members'), list(form.fields['role'].choices))
+        resp = self.client.patch(reverse('api_team_member', kwargs={'pk': self.regular.pk}),
+                                 json.dumps({'role': 'admin'}), content_type='application/json')
+        self.assertEqual(resp.json()['role'], 'admin')
+        self.assertEqual(TeamMember.objects.get(pk=self.regular.pk).role_id, Role.ADMIN)
+        resp = self.client.patch(reverse('api_team_member', kwargs={'pk': self.regular.pk}),
+                                 json.dumps({'role': 'owner'}), content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
+
+
+    def test_deletes_are_allowed_without_enforced_roles(self):
+        resp = self.client.post(reverse('team_members_delete', kwargs={'pk': self.regular.pk}))
+        self.assertEqual(resp.status_code, 302)
+
+
+    @override_settings(INSTATEAM_ENFORCE_ROLES=True)
+    def test_only_admins_delete(self):
+        self.client.login(username='reg', password='password')
+        resp = self.client.post(reverse('team_members_delete', kwargs={'pk': self.admin.pk}))
+        self.assertEqual(resp.status_code, 403)
+        resp = self.client.delete(reverse('api_team_member', kwargs={'pk': self.admin.pk}))
+        self.assertEqual(resp.status_code, 403)
+        resp = self.client.post(reverse('api_team_members_batch'), json.dumps({'delete': [self.admin.pk]}),
+                                content_type='application/json')
+        self.assertEqual(resp.status_code, 403)
+        resp = self.client.post(reverse('api_team_members_bulk_delete'), json.dumps({'ids': [self.admin.pk]}),
+                                content_type='application/json')
+        self.assertEqual(resp.status_code, 403)
+        self.assertTrue(TeamMember.objects.filter(pk=self.admin.pk).exists())
+        # counting them needs no permission
+        resp = self.client.post(reverse('api_team_members_bulk_delete'),
+                                json.dumps({'ids': [self.admin.pk], 'dry_run': True}), content_type='application/json')
+        self.assertEqual(resp.json()['matching'], 1)
+
+        self.client.login(username='ada', password='password')
+        resp = self.client.post(reverse('api_team_members_bulk_delete'), json.dumps({'filter': {'role': 'regular'}}),
+                                content_type='application/json')
+        self.assertEqual(resp.json()['deleted'], 1)
+        self.client.logout()
+        resp = self.client.post(reverse('team_members_delete', kwargs={'pk': self.admin.pk}))
+        self.assertEqual(resp.status_code, 403)
+
+
+    @override_settings(INSTATEAM_ENFORCE_ROLES=True)
+    def test_permissions_are_checked_once_per_request(self):
+        request = RequestFactory().post('/')
+        request.user = User.objects.get(username='ada')
+        with self.assertNumQueries(1):
+            for i in range(3):
+                permissions.for_request(request).require(permissions.DELETE_MEMBERS)
+        request = RequestFactory().post('/')
+        request.user = User.objects.get(username='reg')
+        self.assertFalse(permissions.for_request(request).has(permissions.DELETE_MEMBERS))
+
+
+
+class JobsTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        files = tempfile.TemporaryDirectory()
+        self.addCleanup(files.cleanup)
+        job_files = override_settings(INSTATEAM_JOB_FILES_DIR=files.name)
+        job_files.enable()
+        self.addCleanup(job_files.disable)
+        self.members = [TeamMember.objects.create(
+            first_name='Member', last_name='Number', email='member%s@example.com' % i, phone='+1415937000%s' % i)
+            for i in range(5)]
+        self.worker = jobs.Worker(name='test')
+
+
+    def test_background_bulk_delete(self):
+        resp = self.client.post(reverse('api_team_members_bulk_delete'), json.dumps({
+            'ids': [self.members[0].pk, self.members[1].pk], 'background': True}), content_type='application/json')
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(self.client.get(resp['Location']).json()['status'], 'queued')
+        self.assertEqual(TeamMember.objects.count(), 5)
+        self.assertEqual(self.worker.run_pending(), 1)
+        status = self.client.get(resp['Location']).json()
+        self.assertEqual((status['status'], status['result'], status['attempts']), ('done', {'deleted': 2}, 1))
+        self.assertEqual(status['progress'], {'done': 2, 'total': 2})
+        self.assertEqual(TeamMember.objects.count(), 3)
+        # checked before anything is queued
+        resp = self.client.post(reverse('api_team_members_bulk_delete'), json.dumps({
+            'filter': {'phone': '+1'}, 'background': True}), content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(Job.objects.count(), 1)
+
+
+    def test_background_import(self):
+        upload = SimpleUploadedFile('members.csv', (
+            'first_name,last_name,email,phone\n'
+            'Alan,Turing,alan@example.com,4159370011\n'
+            'Grace,Hopper,member0@example.com,4159370012\n').encode())
+        resp = self.client.post(reverse('team_members_import'), {'file': upload, 'background': 'on'})
+        job = resp.context['job']
+        self.assertContains(resp, reverse('api_job', kwargs={'pk': job.pk}))
+        self.assertFalse(TeamMember.objects.filter(email='alan@example.com').exists())
+        self.assertEqual(len(os.listdir(os.path.join(jobs.files().location, 'imports'))), 1)
+        self.worker.run_pending()
+        job.refresh_from_db()
+        result = job.get_result()
+        self.assertEqual((job.status, result['rows'], result['created'], result['rejected']), ('done', 2, 1, 1))
+        self.assertEqual(result['errors'], [[3, 'email', 'Team member with this Email already exists.']])
+        self.assertTrue(TeamMember.objects.filter(email='alan@example.com').exists())
+        self.assertEqual(os.listdir(os.path.join(jobs.files().location, 'imports')), [])
+
+
+    def test_background_export(self):
+        resp = self.client.get(reverse('team_members_export'), {'format': 'jsonl', 'background': '1'})
+        self.assertEqual(resp.status_code, 202)
+        self.assertIsNone(resp.json()['file'])
+        self.worker.run_pending()
+        status = self.client.get(resp['Location']).json()
+        self.assertEqual(status['progress'], {'done': 5, 'total': 5})
+        resp = self.client.get(status['file'])
+        self.assertEqual(resp['Content-Disposition'], 'attachment; filename="team-members.jsonl"')
+        self.assertEqual(len(b''.join(resp.streaming_content).splitlines()), 5)
+
+
+    def test_retries_back_off_then_fail(self):
+        def flaky(job, progress):
+            raise RuntimeError('down')
+        jobs.TASKS['flaky'] = flaky
+        self.addCleanup(jobs.TASKS.pop, 'flaky')
+        job = jobs.enqueue('flaky', max_attempts=2)
+        with self.assertLogs('instateam.jobs', 'ERROR'):
+            self.assertEqual(self.worker.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.error), ('queued', 1, 'RuntimeError: down'))
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=4))
+        # not before then
+        self.assertEqual(self.worker.run_pending(), 0)
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        with self.assertLogs('instateam.jobs', 'ERROR'):
+            self.assertEqual(self.worker.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertIsNotNone(job.finished_at)
+
+
+    def test_jobs_are_claimed_once(self):
+        job = jobs.enqueue('unknown')
+        self.assertEqual(jobs.Worker(name='first').claim(), job)
+        self.assertIsNone(jobs.Worker(name='second').claim())
+        # the first worker went away without a word
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        claimed = jobs.Worker(name='third').claim()
+        self.assertEqual((claimed, claimed.worker, claimed.attempts), (job, 'third', 2))
+        self.worker.run(claimed)
+        # the jobs of unknown tasks aren't retried, and a worker can't finish a job it lost
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'running')
+        jobs.Worker(name='third').run(claimed)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), ('failed', 'Unknown task unknown'))
+
+
+    def test_progress_is_throttled(self):
+        job = jobs.enqueue('unknown')
+        job = self.worker.claim()
+        progress = jobs.Progress(self.worker, job)
+        with self.assertNumQueries(1):
+            for done in range(100):
+                progress.report(done, 100)
+        self.assertEqual(Job.objects.get(pk=job.pk).progress_done, 0)
+        with self.assertNumQueries(1):
+            progress.report(100, 100, force=True, created=100)
+        self.assertEqual(Job.objects.get(pk=job.pk).get_result(), {'created': 100})
+
+
+    def test_rebuild_search_index_reports_progress(self):
+        job = jobs.enqueue('rebuild_search_index', batch_size=2)
+        reports = []
+        report = jobs.Progress.report
+        with mock.patch.object(jobs.Progress, 'report', lambda *args, **kwargs: reports.append(args[1:]) or
+                               report(*args, **kwargs)):
+            self.worker.run(self.worker.claim())
+        # a heartbeat per batch, written as it goes rather than with the whole index
+        self.assertEqual(reports, [(2, 5), (4, 5), (5, 5)])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.get_result(), job.progress_done), ('done', {'indexed': 5}, 5))
+
+
+    def test_run_worker_once_and_purge(self):
+        jobs.enqueue('rebuild_search_index')
+        out = StringIO()
+        call_command('run_worker', '--once', stdout=out)
+        self.assertIn('Ran 1 jobs.', out.getvalue())
+        self.assertEqual(jobs.purge_jobs(timezone.now() - timedelta(days=1)), 0)
+        self.assertEqual(jobs.purge_jobs(timezone.now() + timedelta(seconds=1)), 1)
+        self.assertFalse(Job.objects.exists())
+
+
+
+@override_settings(INSTATEAM_READ_REPLICAS=['replica1'])
+class ReplicaTestCase(TestCase):
+    "There's no replica in the tests: the reads the router sends to one go to the default database."
+
+    def setUp(self):
+        cache.clear()
+        self.member = TeamMember.objects.create(
+            first_name='Ada', last_name='Lovelace', email='ada@example.com', phone='4159370001')
+        self.routed = []
+        db_for_read = ReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            self.routed.append(db_for_read(router, model, **hints))
+            return None
+        patcher = mock.patch.object(ReplicaRouter, 'db_for_read', record)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+    def reads(self, url, client=None):
+        "Where the reads of a GET of `url` were routed, including those made while streaming."
+        self.routed = []
+        resp = (client or self.client).get(url)
+        self.assertEqual(resp.status_code, 200)
+        if resp.streaming:
+            b''.join(resp.streaming_content)
+        return set(self.routed)
+
+
+    def test_read_paths_read_from_a_replica(self):
+        for url in ('/teammembers/', '/teammembers/?stream=1', '/teammembers/search?q=ada',
+                    '/teammembers/export?format=csv', '/api/teammembers'):
+            self.assertEqual(self.reads(url), {'replica1'}, url)
+        # the other pages read what they're about to change from the primary
+        self.assertEqual(self.reads('/teammembers/%s/edit' % self.member.pk), {None})
+
+
+    def test_writers_read_their_writes(self):
+        resp = self.client.post('/teammembers/new', {
+            'first_name': 'Grace', 'last_name': 'Hopper', 'email': 'grace@example.com',
+            'phone': '4159370002', 'role': 'regular'})
+        self.assertEqual(resp.status_code, 302)
+        self.assertNotIn('replica1', self.routed)
+        self.assertEqual(resp.cookies[STICKY_COOKIE]['max-age'], 10)
+        self.assertEqual(self.reads('/teammembers/'), {None})
+        self.assertEqual(self.reads('/teammembers/', client=Client()), {'replica1'})
+        with override_settings(INSTATEAM_READ_REPLICAS=[]):
+            resp = Client().post('/teammembers/%s/delete' % self.member.pk)
+        self.assertNotIn(STICKY_COOKIE, resp.cookies)
+
+
+    def test_writes_go_to_the_primary(self):
+        router = ReplicaRouter()
+        self.member._state.db = 'replica1'
+        self.assertEqual(router.db_for_write(TeamMember, instance=self.member), 'default')
+        self.assertFalse(router.allow_migrate('replica1', 'instateam'))
+        self.assertTrue(router.allow_migrate('default', 'instateam'))
+
+
+
+class LoadTestTestCase(LiveServerTestCase):
+    # the roles created by the migrations, which each test's flush deletes
+    serialized_rollback = True
+
+    def setUp(self):
+        cache.clear()
+
+
+    def test_form_fields(self):
+        page = ('<form method="get"><input name="q" value="x"></form>'
+                '<form method="post"><input type="hidden" name="csrfmiddlewaretoken" value="token">'
+                '<input name="email" value="a@example.com"><input type="radio" name="role" value="regular">'
+                '<input type="radio" name="role" value="admin" checked><input type="submit" value="Save"></form>')
+        self.assertEqual(loadtest.form_fields(page[page.index('</form>') + 7:]), {
+            'csrfmiddlewaretoken': 'token', 'email': 'a@example.com', 'role': 'admin'})
+        self.assertEqual(loadtest.parse_mix('list=3,delete=1'), {'list': 3.0, 'delete': 1.0})
+        with self.assertRaises(ValueError):
+            loadtest.parse_mix('list=3,upload=1')
+
+
+    def test_seed_members_after_the_soft_deleted_ones(self):
+        bench.seed_members(2)
+        TeamMember.objects.get(pk=2).delete(soft=True)
+        bench.seed_members(1)
+        self.assertEqual(list(TeamMember.all_objects.values_list('pk', flat=True).order_by('pk')), [1, 2, 3])
+        # the database assigns the next pk after the seeded ones
+        self.assertGreater(TeamMember.objects.create(**bench.member_attributes(3)).pk, 3)
+
+
+    def test_scenarios_run_without_errors(self):
+        bench.seed_members(50)
+        report = loadtest.run(self.live_server_url, 50, clients=1, seconds=1.0,
+                              mix={'list': 1, 'search': 1, 'create': 1, 'edit': 1, 'delete': 1})
+        self.assertEqual(report['errors'], 0, report)
+        self.assertEqual(set(report['requests_by_name']), {
+            'list', 'search', 'create_form', 'create_post', 'edit_form', 'edit_post', 'delete_post'})
+        requests = report['requests_by_name']
+        # the creates and deletes went through, along with their CSRF tokens
+        created = requests['create_post']['statuses'].get('302', 0)
+        deleted = requests['delete_post']['statuses'].get('302', 0)
+        self.assertEqual(TeamMember.objects.count(), 50 + created - deleted)
\ No newline at end of file
@@ -1,15 +1,36 @@
 from django.urls import path, re_path
 
-from . import views
+from . import api, views
 
 urlpatterns = [
     path('', views.index, name='index'),
     re_path('^teammembers/?$', views.TeamMembersList.as_view(), 
         name='team_members_list'),
+    re_path('^teammembers/search/?$', views.team_members_search,
+        name='team_members_search'),
+    re_path('^teammembers/import/?$', views.TeamMembersImport.as_view(),
+        name='team_members_import'),
+    re_path('^teammembers/export/?$', views.TeamMembersExport.as_view(),
+        name='team_members_export'),
     re_path('^teammembers/new/?$', views.TeamMembersCreate.as_view(), 
         name='team_members_create'),
     re_path('^teammembers/(?P<pk>\d+)/edit/?$', views.TeamMembersUpdate.as_view(), 
         name='team_members_update'),
     re_path('^teammembers/(?P<pk>\d+)/delete/?$', views.TeamMembersDelete.as_view(), 
         name='team_members_delete'),
+    re_path('^api/teammembers/?$', api.TeamMembersApi.as_view(),
+        name='api_team_members'),
+    re_path('^api/teammembers/batch/?$', api.TeamMembersBatchApi.as_view(),
+        name='api_team_members_batch'),
+    re_path('^api/teammembers/delete/?$', api.TeamMembersBulkDeleteApi.as_view(),
+        name='api_team_members_bulk_delete'),
+    re_path('^api/teammembers/changes/?$', api.TeamMemberChangesApi.as_view(),
+        name='api_team_member_changes'),
+    re_path('^api/teammembers/(?P<pk>\d+)/?$', api.TeamMemberApi.as_view(),
+        name='api_team_member'),
+    re_path('^api/jobs/(?P<pk>\d+)/?$', api.JobApi.as_view(),
+        name='api_job'),
+    re_path('^api/jobs/(?P<pk>\d+)/file/?$', api.JobFileApi.as_view(),
+        name='api_job_file'),
+    re_path('^metrics/?$', views.prometheus_metrics, name='metrics'),
 ]
\ No newline at end of file
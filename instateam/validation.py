@@ -0,0 +1,147 @@
+"""
+Validation of team members, shared by TeamMember.full_clean() (so by the forms),
+the importer and the API batch endpoint, with the same error messages everywhere.
+
+It differs from Django's own validation in three ways: phone numbers are parsed
+and checked through the caches of instateam.phones, roles are looked up in the
+cached role table (see Role.table), and the uniqueness of the emails and phones
+of any number of members is checked with a single query (see unique_errors).
+"""
+from django.core import validators
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+from phonenumber_field.phonenumber import PhoneNumber
+from phonenumber_field.validators import validate_international_phonenumber
+
+from . import phones
+
+
+UNIQUE_FIELDS = ('email', 'phone')
+
+
+def is_empty(value):
+    # `in EMPTY_VALUES` would have PhoneNumber.__eq__ parse every empty value
+    if isinstance(value, PhoneNumber):
+        return not (value.national_number or value.raw_input)
+    return value in validators.EMPTY_VALUES
+
+
+def validate_phone(value):
+    "validate_international_phonenumber, with the cached checks."
+    phone = phones.parse(value)
+    if isinstance(phone, PhoneNumber) and not phones.is_valid(phone):
+        validate_international_phonenumber(phone)
+
+
+def clean_fields(member, exclude=None):
+    """
+    Model.clean_fields(), returning the errors as {field name: [ValidationError]}
+    rather than raising them, and running the phone field's validators through
+    the caches of instateam.phones.
+    """
+    exclude = exclude or ()
+    errors = {}
+    for field in member._meta.fields:
+        if field.name in exclude:
+            continue
+        raw_value = getattr(member, field.attname)
+        if field.blank and is_empty(raw_value):
+            continue
+        try:
+            if field.name == 'phone':
+                value = phones.parse(raw_value, region=field.region)
+                # field.validate() only checks for blanks and choices, with PhoneNumber.__eq__ parsing each empty value
+                if is_empty(value) or field.choices:
+                    field.validate(value, member)
+                for validator in field.validators:
+                    (validate_phone if validator is validate_international_phonenumber else validator)(value)
+            elif field.name == 'role':
+                # against the cached role table, where ForeignKey.validate() queries it for each member
+                value = field.to_python(raw_value)
+                if value not in field.remote_field.model.table():
+                    raise ValidationError(field.error_messages['invalid'], code='invalid', params={
+                        'model': field.remote_field.model._meta.verbose_name, 'pk': value,
+                        'field': field.remote_field.field_name, 'value': value})
+            else:
+                value = field.clean(raw_value, member)
+            if value is not raw_value:
+                # the phone field's descriptor parses whatever it's given again
+                setattr(member, field.attname, value)
+        except ValidationError as e:
+            errors[field.name] = e.error_list
+    return errors
+
+
+def _unique_value(member, name):
+    value = getattr(member, name)
+    if is_empty(value):
+        return None
+    # phones are stored in E.164 format (PHONENUMBER_DB_FORMAT)
+    return value.as_e164 if isinstance(value, PhoneNumber) else value
+
+
+def unique_errors(members, exclude=None, exclude_pks=(), using=None):
+    """
+    Check the emails and phones of `members` are free, with a single query, and
+    return their errors as a list of {field name: [ValidationError]}, one per
+    member. A value is taken when another member has it in the database (except
+    those of `exclude_pks`, e.g. about to be deleted), or when an earlier member
+    of `members` has it.
+    """
+    fields = [name for name in UNIQUE_FIELDS if name not in (exclude or ())]
+    results = [{} for member in members]
+    if not members or not fields:
+        return results
+    model = members[0]._meta.model
+
+    lookup = Q()
+    for name in fields:
+        # PhoneNumber instances rather than their E.164 strings, which the lookup would parse again
+        values = [getattr(member, name) for member in members if _unique_value(member, name) is not None]
+        if values:
+            lookup |= Q(**{'%s__in' % name: values})
+    taken = {}
+    if lookup:
+        queryset = model._default_manager.filter(lookup).exclude(pk__in=exclude_pks)
+        if using is not None:
+            queryset = queryset.using(using)
+        for row in queryset.values_list('pk', *fields):
+            for name, value in zip(fields, row[1:]):
+                taken[(name, value)] = row[0]
+
+    for member, errors in zip(members, results):
+        values = [(name, _unique_value(member, name)) for name in fields]
+        for name, value in values:
+            owner = taken.get((name, value), member)
+            if value is not None and owner is not member and owner != member.pk:
+                errors[name] = [member.unique_error_message(model, (name,))]
+        if not errors:
+            # later members can't have its email and phone any more
+            for name, value in values:
+                taken.setdefault((name, value), member)
+    return results
+
+
+def error_messages(errors):
+    "{field name: [ValidationError]} to {field name: [messages]}."
+    return {name: [message for error in field_errors for message in error.messages]
+            for name, field_errors in errors.items()}
+
+
+def validate_many(members, exclude_pks=(), using=None):
+    """
+    Validate a list of TeamMember instances as TeamMember.full_clean() would, with
+    one query for the whole list, and return their errors as a list of
+    {field name: [messages]}, one per member (empty for valid members). Members
+    with invalid fields aren't checked for uniqueness.
+    """
+    field_errors = [clean_fields(member) for member in members]
+    valid = [member for member, errors in zip(members, field_errors) if not errors]
+    valid_errors = iter(unique_errors(valid, exclude_pks=exclude_pks, using=using))
+    results = []
+    for member, errors in zip(members, field_errors):
+        if not errors:
+            errors = next(valid_errors)
+        results.append(error_messages(errors))
+    return results
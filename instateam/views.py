@@ -1,21 +1,217 @@
+import io
+from itertools import islice
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect
-from django.urls import reverse_lazy
+from django.template.loader import get_template
+from django.urls import reverse, reverse_lazy
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.http import require_GET
 from django.views.generic.list import ListView
-from django.views.generic.edit import CreateView, UpdateView, DeleteView
+from django.views.generic.edit import CreateView, UpdateView, DeleteView, FormView
+
+from . import exporters, jobs, metrics, permissions
+from .api import job_accepted
+from .conditional import export_condition, form_page_condition, revalidate, roster_condition, roster_state
+from .db.replicas import reads_from_replica
+from .models import ConcurrentUpdate, Role, TeamMember
+from .forms import MemberImportForm, TeamMemberForm
+from .importers import ImportFormatError, MemberImporter, read_rows
+from .pagecache import PageCache
+from .pagination import InvalidCursor, KeysetPaginator, requested_page_size
+from .presenters import RosterListing, member_row, member_rows
+from .search import search_members
 
-from .models import TeamMember
-from .forms import TeamMemberForm
+
+# the list template leaves this marker where the member rows go when streaming
+STREAM_ROWS_MARKER = '<!-- instateam:rows -->'
 
 
 def index(request):
     return redirect('team_members_list')
 
 
+@reads_from_replica
+@require_GET
+def team_members_search(request):
+    "Prefix search on names, emails and phone numbers: /teammembers/search?q=<query>[&limit=<n>]"
+    max_limit = getattr(settings, 'INSTATEAM_SEARCH_MAX_RESULTS', 100)
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 20)), max_limit))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be a number'}, status=400)
+    results = []
+    for member in search_members(request.GET.get('q', ''), limit=limit):
+        row = member_row(member)._asdict()
+        row['url'] = reverse('team_members_update', kwargs={'pk': member.pk})
+        results.append(row)
+    return JsonResponse({'results': results})
+
+
+@require_GET
+def prometheus_metrics(request):
+    "The request metrics of this process, in the Prometheus text format."
+    return HttpResponse(metrics.REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# ?sort= of the list: the keyset ordering, each one served by an index of TeamMember.Meta
+LIST_SORTS = {
+    'last_name': ('last_name', 'first_name', 'pk'),
+    'first_name': ('first_name', 'last_name', 'pk'),
+    'email': ('email', 'pk'),
+}
+# the query parameters of the list kept by its pager links
+LIST_PARAMETERS = ('role', 'name', 'email', 'sort', 'page_size')
+
+
+def filter_members(queryset, params):
+    """
+    Filter the members by ?role, ?name (a prefix of "last name first name", in any
+    case) and ?email (a prefix), and return them with the ordering of ?sort.
+    The prefixes are range lookups on indexed columns, see TeamMember.Meta.
+    Raises ValueError on an unknown role or sort.
+    """
+    role = params.get('role')
+    if role:
+        try:
+            role = Role.named(role)
+        except Role.DoesNotExist:
+            raise ValueError('Unknown role %s' % role)
+        queryset = queryset.filter(role_id=role.pk)
+    name = params.get('name', '').strip().lower()
+    if name:
+        queryset = queryset.filter(full_name_sort__prefix=name)
+    email = params.get('email', '').strip()
+    if email:
+        queryset = queryset.filter(email__prefix=email)
+    sort = params.get('sort') or 'last_name'
+    if sort not in LIST_SORTS:
+        raise ValueError('Unknown sort %s' % sort)
+    return queryset, LIST_SORTS[sort]
+
+
+@method_decorator(reads_from_replica, name='dispatch')
 class TeamMembersList(ListView):
+    "The roster, filtered and sorted with the query parameters of filter_members()."
     model = TeamMember
     context_object_name = 'team_members'
     queryset = TeamMember.objects.all()
     template_name = 'instateam/teammembers_list.html'
+    rows_template_name = 'instateam/teammembers_rows.html'
+
+    def get_queryset(self):
+        try:
+            queryset, self.ordering = filter_members(super().get_queryset(), self.request.GET)
+        except ValueError as e:
+            raise Http404(str(e))
+        return queryset.order_by(*self.ordering)
+
+    def get_paginate_by(self, queryset):
+        if self.request.GET.get('stream'):
+            # the streamed page renders every row itself, there's nothing to paginate
+            return None
+        try:
+            return requested_page_size(self.request)
+        except ValueError:
+            raise Http404('Invalid page size')
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, page_size, ordering=self.ordering)
+        try:
+            page = paginator.page(self.request.GET.get('cursor'))
+        except InvalidCursor as e:
+            raise Http404(str(e))
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    @method_decorator(roster_condition)
+    def get(self, request, *args, **kwargs):
+        if request.GET.get('stream'):
+            return revalidate(self.stream_response())
+        page_cache = PageCache.from_settings()
+        if page_cache is None:
+            return revalidate(super().get(request, *args, **kwargs))
+        render = lambda: super(TeamMembersList, self).get(request, *args, **kwargs).render()
+        return revalidate(page_cache.respond(request, render, roster_state(request)))
+
+    def stream_response(self):
+        """
+        Render the whole roster without buffering it: the page layout is rendered once
+        around a marker, and the rows in between are rendered chunk by chunk from a
+        server-side iterator.
+        """
+        queryset = self.get_queryset()
+        chunk_size = getattr(settings, 'INSTATEAM_STREAM_CHUNK_SIZE', 2000)
+        self.object_list = queryset.none()
+        context = self.get_context_data(
+            streaming=True, stream_rows_marker=STREAM_ROWS_MARKER, member_count=queryset.count())
+        page = get_template(self.template_name).render(context, self.request)
+        head, tail = page.split(STREAM_ROWS_MARKER, 1)
+        rows_template = get_template(self.rows_template_name)
+
+        def render():
+            yield head
+            members = queryset.iterator(chunk_size=chunk_size)
+            while True:
+                chunk = list(islice(members, chunk_size))
+                if not chunk:
+                    break
+                yield rows_template.render(
+                    {'team_members': member_rows(chunk), 'row_cache_timeout': context['row_cache_timeout']},
+                    self.request)
+            yield tail
+
+        return StreamingHttpResponse(render(), content_type='text/html; charset=utf-8')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # the rendered rows are cached per member and member version, see teammembers_rows.html
+        context['row_cache_timeout'] = getattr(settings, 'INSTATEAM_ROW_CACHE_TIMEOUT', 300)
+        if not context.get('streaming'):
+            listing = RosterListing(context['object_list'], context['paginator'], context['page_obj'])
+            context['team_members'] = listing
+            context['member_count'] = listing.count
+        context['list_query'] = urlencode([
+            (name, self.request.GET[name]) for name in LIST_PARAMETERS if self.request.GET.get(name)])
+        context['filtered'] = any(self.request.GET.get(name) for name in ('role', 'name', 'email'))
+        context['roles'] = Role.names()
+        context['sorts'] = [(sort, sort.replace('_', ' ')) for sort in LIST_SORTS]
+        return context
+
+
+def accepts_gzip(request):
+    return 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+
+
+@method_decorator(reads_from_replica, name='dispatch')
+@method_decorator(export_condition, name='get')
+class TeamMembersExport(View):
+    """
+    Stream every member as CSV, JSON Lines or vCard: /teammembers/export?format=csv|jsonl|vcard
+    The export is gzipped on the fly for clients accepting it, and answered with a 304
+    when the client's copy is still current (If-None-Match/If-Modified-Since). With
+    ?background=1, a worker writes it to a file instead, see /api/jobs/<id>.
+    """
+
+    def get(self, request, *args, **kwargs):
+        file_format = request.GET.get('format', 'csv')
+        if file_format not in exporters.FORMATS:
+            return HttpResponseBadRequest('Unknown export format, expected one of: %s' % ', '.join(exporters.FORMATS))
+        if request.GET.get('background'):
+            return job_accepted(jobs.enqueue('export_members', file_format=file_format))
+        content_type, extension = exporters.FORMATS[file_format]
+        chunks = exporters.export_members(
+            file_format, chunk_size=getattr(settings, 'INSTATEAM_STREAM_CHUNK_SIZE', 2000))
+        if accepts_gzip(request):
+            response = StreamingHttpResponse(exporters.gzip_chunks(chunks), content_type=content_type)
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = StreamingHttpResponse(chunks, content_type=content_type)
+        response['Vary'] = 'Accept-Encoding'
+        response['Content-Disposition'] = 'attachment; filename="team-members.%s"' % extension
+        return revalidate(response)
 
 
 class TeamMembersCreate(CreateView):
@@ -32,7 +228,52 @@ class TeamMembersUpdate(UpdateView):
     context_object_name = 'teammember'
     success_url = reverse_lazy('team_members_list')
 
+    @method_decorator(form_page_condition)
+    def get(self, request, *args, **kwargs):
+        return revalidate(super().get(request, *args, **kwargs))
+
+    def form_valid(self, form):
+        try:
+            return super().form_valid(form)
+        except ConcurrentUpdate:
+            current = TeamMember.objects.filter(pk=self.object.pk).values_list('version', flat=True).first()
+            if current is None:
+                raise Http404('This team member was deleted meanwhile')
+            # the values submitted are shown again, saving them once more overwrites the other change
+            form.data = form.data.copy()
+            form.data['version'] = current
+            form.add_error(None, 'Someone else changed this team member meanwhile, check the values before saving again.')
+            response = self.form_invalid(form)
+            response.status_code = 409
+            return response
+
 
 class TeamMembersDelete(DeleteView):
     model = TeamMember
-    success_url = reverse_lazy('team_members_list')
\ No newline at end of file
+    success_url = reverse_lazy('team_members_list')
+
+    def delete(self, request, *args, **kwargs):
+        permissions.for_request(request).require(permissions.DELETE_MEMBERS)
+        return super().delete(request, *args, **kwargs)
+
+
+class TeamMembersImport(FormView):
+    form_class = MemberImportForm
+    template_name = 'instateam/teammembers_import.html'
+
+    def form_valid(self, form):
+        if form.cleaned_data['background']:
+            uploaded = form.cleaned_data['file']
+            name = jobs.files().save('imports/%s' % uploaded.name, uploaded)
+            job = jobs.enqueue('import_members', file=name, file_format=form.file_format)
+            return self.render_to_response(self.get_context_data(form=MemberImportForm(), job=job))
+        importer = MemberImporter(batch_size=getattr(settings, 'INSTATEAM_IMPORT_BATCH_SIZE', 1000))
+        lines = io.TextIOWrapper(form.cleaned_data['file'], encoding='utf-8', newline='')
+        try:
+            result = importer.run(read_rows(lines, form.file_format))
+        except (ImportFormatError, UnicodeDecodeError) as e:
+            form.add_error('file', str(e))
+            return self.form_invalid(form)
+        max_errors = getattr(settings, 'INSTATEAM_IMPORT_MAX_DISPLAYED_ERRORS', 100)
+        return self.render_to_response(self.get_context_data(
+            form=form, result=result, errors=result.errors[:max_errors]))
\ No newline at end of file
@@ -0,0 +1,67 @@
+"""
+The work a fresh process would otherwise do on its first requests: compiling
+the templates (kept by the cached template loader, see CACHED_TEMPLATES),
+populating the URL resolver and loading the phone number metadata.
+
+The WSGI and ASGI application modules run it when INSTATEAM_WARMUP is on, so
+that a preforking server loading the application before it forks (e.g.
+gunicorn --preload) does it once, and every worker starts warm. It doesn't
+touch the database: connections mustn't be shared with the forked workers.
+"""
+import os
+import time
+
+from django.apps import apps
+from django.template.loader import get_template
+from django.urls import get_resolver, resolve, reverse
+
+from . import phones, urls
+from .forms import MemberImportForm, TeamMemberForm
+
+
+def app_templates(app_label='instateam'):
+    "The names of the templates in an app's templates directory."
+    root = os.path.join(apps.get_app_config(app_label).path, 'templates')
+    for directory, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if filename.endswith('.html'):
+                yield os.path.relpath(os.path.join(directory, filename), root).replace(os.sep, '/')
+
+
+def compile_templates():
+    for name in app_templates():
+        get_template(name)
+    # the widget templates of the forms, compiled by the form renderer's own engine
+    form = TeamMemberForm()
+    # rather than the role table's choices, read from the database
+    form.fields['role'].choices = [('regular', 'Regular')]
+    str(form)
+    str(MemberImportForm())
+
+
+def resolve_urls():
+    get_resolver().reverse_dict
+    for pattern in urls.urlpatterns:
+        kwargs = {name: '1' for name in pattern.pattern.regex.groupindex}
+        resolve(reverse(pattern.name, kwargs=kwargs))
+
+
+def preload_phones():
+    phones.preload_metadata(phones.configured_regions())
+
+
+STEPS = (
+    ('templates', compile_templates),
+    ('urls', resolve_urls),
+    ('phones', preload_phones),
+)
+
+
+def warm_up():
+    "Run every step, and return their durations in seconds as [(step, seconds)]."
+    durations = []
+    for name, step in STEPS:
+        start = time.perf_counter()
+        step()
+        durations.append((name, time.perf_counter() - start))
+    return durations